@@ -2,6 +2,7 @@ import json
 import os
 import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import Optional
 
@@ -15,10 +16,19 @@ from .generate_diagram import GenerateDiagram
 from .refine_diagram import RefineDiagram
 from .generate_code_from_diagram import GenerateCodeFromDiagram
 from .redo_command import RedoCommand
+from .jump_to_version_command import JumpToVersionCommand
 # from application.undo_command import UndoCommand
+from ..domain.internal.plantuml_autofix import autofix_enabled, autofix_plantuml, max_autofix_rounds, repair_stats
+from ..domain.internal.plantuml_encoding import decode_plantuml
+from ..domain.internal.plantuml_linter import format_issues, has_errors, lint_plantuml, linter_enabled
+from ..domain.internal.plantuml_regions import extract_region_reply, find_region, region_repair_enabled, region_repair_min_lines, skeleton, splice
+from ..domain.internal.plantuml_renderer import RenderResult, get_renderer, thumbnail_source
 from ..domain.internal.plantuml_sanitizer import sanitize_plantuml
 from ..domain.internal.plantuml_validator import PlantUMLValidator
 from ..infrastructure.internal.agent_factory import AgentFactory
+from ..infrastructure.internal.ollama_http import CancelToken
+from ..infrastructure.internal.semantic_cache import semantic_partition
+from ..util.env import env_int
 
 def extract_sections(result):
     """
@@ -42,6 +52,9 @@ def extract_sections(result):
     # Default: no code found, fallback
     return "", result.strip()
 
+def raw_model_copy_enabled() -> bool:
+    return (os.getenv("STORE_RAW_MODEL", "1").lower() in ("1", "true", "yes", "on"))
+
 class ApplicationService(IApplicationService):
     def __init__(self, infra: IInfrastructureService, domain: IDomainAccess, websocket_service: IWebSocketService | None = None):
         # Core dependencies
@@ -86,37 +99,110 @@ class ApplicationService(IApplicationService):
         return self.infra.generate_code(model)
 
     def render_model(self, model_id: str) -> str:
-        model = self.infra.load_model(model_id)
-        return self.infra.render_model(model)
+        return self.render_diagram(model_id, "svg").data.decode("utf-8")
 
-    def cleanup_expired(self) -> None:
-        self.infra.cleanup_old_models()
+    def render_plantuml(self, plantuml: str, fmt: str = "svg") -> RenderResult:
+        if not (plantuml or "").strip():
+            raise ValueError("plantuml is required")
+        renderer = get_renderer()
+        if renderer is None:
+            raise NotImplementedError("Server-side rendering is disabled (PLANTUML_RENDER=0)")
+        return renderer.render(plantuml, fmt)
 
-    def generate_and_save_diagram(self, user_email, project_id, name, diagram_type, prompt, diagram_id=None, agent_type=None, pipeline_prompts=None, pipeline_models=None):
+    def render_diagram(self, diagram_id: str, fmt: str = "svg", thumbnail: bool = False) -> RenderResult:
+        if not diagram_id:
+            raise ValueError("diagramId is required")
+        record = self.domain.get_diagram_by_id(diagram_id)
+        if not record:
+            raise ValueError(f"Diagram {diagram_id} not found")
+        plantuml = record if isinstance(record, str) else record.get("plantuml") or ""
+        if thumbnail and plantuml.strip():
+            plantuml = thumbnail_source(plantuml)
+        return self.render_plantuml(plantuml, fmt)
+
+    def render_encoded(self, encoded: str, fmt: str = "svg") -> RenderResult:
+        """Render a plantuml.com-style `<fmt>/<encoded>` path segment."""
+        return self.render_plantuml(decode_plantuml(encoded), fmt)
+
+    def render_cached(self, key: str, fmt: str) -> Optional[RenderResult]:
+        renderer = get_renderer()
+        return renderer.cached(key, fmt) if renderer is not None else None
+
+    def cleanup_expired(self) -> dict:
+        """Expire model blobs and idle command history now, then checkpoint/vacuum the SQLite files."""
+        return self.infra.run_retention_sweep()
+
+    def generate_and_save_diagram(self, *args, **kwargs):
+        """Same arguments as _generate_and_save_diagram; its writes (raw copy, diagram record) commit together."""
+        with self.infra.unit_of_work():
+            return self._generate_and_save_diagram(*args, **kwargs)
+
+    def _generate_and_save_diagram(self, user_email, project_id, name, diagram_type, prompt, diagram_id=None, agent_type=None, pipeline_prompts=None, pipeline_models=None, best_of_n=None, best_of_concurrency=None, user_prompt=None):
         self.ensure_user_exists(user_email)
         print("Generating diagram for user:", user_email)
         if not diagram_id:
             diagram_id = str(uuid.uuid4())
 
-        result = self.generate_model(prompt, diagram_id, agent_type, diagram_type=diagram_type, pipeline_prompts=pipeline_prompts, pipeline_models=pipeline_models)
+        # Near-duplicate prompts reuse a previously validated diagram. Only fresh generations
+        # pass `user_prompt`; refinements depend on the current diagram and are never looked up.
+        partition = semantic_partition(diagram_type, agent_type, prompt, user_prompt, pipeline_models) if user_prompt else None
+        if partition:
+            hit = self.infra.semantic_lookup(user_prompt, partition)
+            if hit and hit.get("plantuml"):
+                print(f"[semantic-cache] reusing validated diagram (similarity={hit.get('similarity')})")
+                self._save_raw_model(diagram_id, hit.get("raw") or hit["plantuml"])
+                return self._save_diagram_record(
+                    diagram_id, project_id, user_email, name, diagram_type, hit["plantuml"], hit.get("explanation", "")
+                )
+
+        candidate = None
+        n = self._positive_int(best_of_n, env_int("BEST_OF_N", 1))
+        if n > 1:
+            candidate = self._generate_best_of_n(
+                prompt, agent_type, diagram_type, pipeline_prompts, pipeline_models,
+                n=n, concurrency=self._positive_int(best_of_concurrency, env_int("BEST_OF_N_CONCURRENCY", 2)),
+            )
+
+        if candidate:
+            result, plantuml_text, explanation, already_valid = candidate
+            self._save_raw_model(diagram_id, result)
+        else:
+            result = self.generate_model(prompt, diagram_id, agent_type, diagram_type=diagram_type, pipeline_prompts=pipeline_prompts, pipeline_models=pipeline_models)
+            plantuml_text, explanation = self._prepare_plantuml(result, diagram_type)
+            already_valid = False
         print("results:", result)
-        plantuml_text, explanation = extract_sections(result)
 
-        created_at = datetime.utcnow().isoformat()
         print("Prompt to LLM:", prompt)
         print("Extracted PlantUML:", plantuml_text)
         print("Extracted Explanation:", explanation)
 
-        sanitize_enabled = (os.getenv("ENABLE_PLANTUML_SANITIZER", "1").lower() in ("1", "true", "yes", "on"))
-        if sanitize_enabled and (diagram_type or "").lower() in ("class", "eerd"):
-            plantuml_text = sanitize_plantuml(plantuml_text)
-
-        plantuml_text = self._validate_and_fix_plantuml(
-            plantuml_text=plantuml_text,
-            diagram_type=diagram_type,
-            original_prompt=prompt,
-        )
+        is_valid = already_valid
+        if not already_valid:
+            plantuml_text, is_valid = self._validate_and_fix_plantuml_status(
+                plantuml_text=plantuml_text,
+                diagram_type=diagram_type,
+                original_prompt=prompt,
+            )
 
+        if partition and self._semantic_storable(is_valid):
+            try:
+                self.infra.semantic_store(
+                    user_prompt,
+                    partition,
+                    {"plantuml": plantuml_text, "explanation": explanation, "raw": result},
+                )
+            except Exception as exc:
+                print(f"[semantic-cache] failed to store diagram: {exc}")
+
+        return self._save_diagram_record(diagram_id, project_id, user_email, name, diagram_type, plantuml_text, explanation)
+
+    def _save_raw_model(self, diagram_id: str, raw: str) -> None:
+        """Keep the raw LLM output as <diagramId>#DIAGRAM (STORE_RAW_MODEL=0 skips this extra write)."""
+        if raw_model_copy_enabled():
+            self.infra.save_model(diagram_id, "DIAGRAM", raw)
+
+    def _save_diagram_record(self, diagram_id, project_id, user_email, name, diagram_type, plantuml_text, explanation):
+        created_at = datetime.utcnow().isoformat()
         diagram_item = {
             "diagramId": diagram_id,
             "projectId": project_id,
@@ -139,11 +225,102 @@ class ApplicationService(IApplicationService):
             "explanation": explanation
         }
 
+    @staticmethod
+    def _semantic_storable(is_valid: Optional[bool]) -> bool:
+        """Store validated diagrams; unvalidated ones only when SEMANTIC_CACHE_REQUIRE_VALID is off."""
+        if is_valid:
+            return True
+        require_valid = (os.getenv("SEMANTIC_CACHE_REQUIRE_VALID", "1").lower() in ("1", "true", "yes", "on"))
+        return is_valid is None and not require_valid
+
+    @staticmethod
+    def _positive_int(value, default: int) -> int:
+        try:
+            num = int(value)
+            return num if num > 0 else default
+        except (TypeError, ValueError):
+            return default
+
+    @staticmethod
+    def _prepare_plantuml(result: str, diagram_type: Optional[str]) -> tuple[str, str]:
+        """Split the agent output into (plantuml, explanation) and apply the sanitizer."""
+        plantuml_text, explanation = extract_sections(result)
+        sanitize_enabled = (os.getenv("ENABLE_PLANTUML_SANITIZER", "1").lower() in ("1", "true", "yes", "on"))
+        if sanitize_enabled and (diagram_type or "").lower() in ("class", "eerd"):
+            plantuml_text = sanitize_plantuml(plantuml_text)
+        return plantuml_text, explanation
+
+    def _generate_best_of_n(self, prompt, agent_type, diagram_type, pipeline_prompts, pipeline_models, n: int, concurrency: int):
+        """
+        Generate up to `n` candidates concurrently, one per UML model, and return
+        the first one the PlantUML validator accepts as
+        (raw_result, plantuml, explanation, is_valid). Without a validator the
+        fastest candidate wins. If nothing validates, the first candidate to
+        finish is returned for the normal repair loop. Returns None when the agent
+        has fewer than two UML models to fan out over.
+        """
+        models = self.infra.uml_model_candidates(agent_type, pipeline_models)[:n]
+        if len(models) < 2:
+            print(f"[best-of-n] only {len(models)} UML model(s) available; using the single-candidate path.")
+            return None
+
+        validator = getattr(self, "_uml_validator", None)
+        if validator is not None and not validator.is_available():
+            validator = None
+
+        tokens = {model: CancelToken() for model in models}
+
+        def _candidate(model: str) -> str:
+            overrides = dict(pipeline_models or {})
+            overrides["uml"] = [model]
+            # The PlantUML validator picks the winner, so skip the per-candidate LLM validator stage
+            # unless the request asked for specific validation models.
+            if validator is not None and "validation" not in overrides:
+                overrides["validation"] = []
+            return self.infra.prompt_to_uml(prompt, agent_type, diagram_type=diagram_type, pipeline_prompts=pipeline_prompts, pipeline_models=overrides, cancel=tokens[model])
+
+        print(f"[best-of-n] generating {len(models)} candidates with concurrency={concurrency}: {models}")
+        executor = ThreadPoolExecutor(max_workers=min(concurrency, len(models)), thread_name_prefix="best-of-n")
+        futures = {executor.submit(_candidate, model): model for model in models}
+        first = None
+        errors = []
+        try:
+            for future in as_completed(futures):
+                model = futures[future]
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    print(f"[best-of-n] candidate model={model} failed: {exc}")
+                    errors.append(f"{model}: {exc!r}")
+                    continue
+                plantuml_text, explanation = self._prepare_plantuml(result, diagram_type)
+                if validator is None:
+                    print(f"[best-of-n] no validator configured; taking fastest candidate from model={model}")
+                    return result, plantuml_text, explanation, False
+                is_valid, _ = validator.validate(plantuml_text)
+                if is_valid:
+                    print(f"[best-of-n] candidate from model={model} passed validation")
+                    return result, plantuml_text, explanation, True
+                print(f"[best-of-n] candidate from model={model} {'could not be validated' if is_valid is None else 'failed validation'}")
+                if first is None:
+                    first = (result, plantuml_text, explanation, False)
+        finally:
+            # Queued candidates are dropped and running ones are cancelled, which closes their
+            # Ollama streams. Once every candidate has finished, cancelling is a no-op.
+            for token in tokens.values():
+                token.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if first is None:
+            raise RuntimeError(f"All best-of-N candidates failed: {' | '.join(errors)}")
+        print("[best-of-n] no candidate passed validation; repairing the first one")
+        return first
+
     def generate_model(self, prompt: str, diagram_id: str, agent_type: str = None, diagram_type: str = None, pipeline_prompts: dict | None = None, pipeline_models: dict | None = None) -> str:
         print("running generate_modela")
         uml = self.infra.prompt_to_uml(prompt, agent_type, diagram_type=diagram_type, pipeline_prompts=pipeline_prompts, pipeline_models=pipeline_models)
         print("running generate_model")
-        self.infra.save_model(diagram_id, "DIAGRAM", uml)
+        self._save_raw_model(diagram_id, uml)
         return uml
     
     def generate_code_from_uml(self, prompt: str, agent_type: str = None) -> str:
@@ -216,6 +393,12 @@ class ApplicationService(IApplicationService):
     def handle_redo_request(self, user_email: str, body: dict) -> dict:
         return RedoCommand(app_service=self).execute(user_email, body)
 
+    def handle_jump_request(self, user_email: str, body: dict) -> dict:
+        return JumpToVersionCommand(app_service=self).execute(user_email, body)
+
+    def list_command_history(self, user_email: str, diagram_id: str) -> dict:
+        return {"diagramId": diagram_id, "versions": self.domain.list_command_versions(diagram_id)}
+
     def _validate_and_fix_plantuml(
         self,
         plantuml_text: str,
@@ -226,9 +409,22 @@ class ApplicationService(IApplicationService):
         Run PlantUML validation (if configured) and try to auto-fix syntax errors
         by asking the agent to refine the diagram using the validator output.
         """
+        return self._validate_and_fix_plantuml_status(plantuml_text, diagram_type, original_prompt)[0]
+
+    def _validate_and_fix_plantuml_status(
+        self,
+        plantuml_text: str,
+        diagram_type: Optional[str],
+        original_prompt: str,
+    ) -> tuple[str, Optional[bool]]:
+        """
+        Same as _validate_and_fix_plantuml but also reports whether the final diagram
+        passed validation (None when no validator is configured or the validator
+        timed out; the diagram is then returned as is rather than "repaired").
+        """
         validator = getattr(self, "_uml_validator", None)
         if not validator or not validator.is_available():
-            return plantuml_text
+            return plantuml_text, None
 
         current = plantuml_text
         max_attempts = 5
@@ -236,13 +432,67 @@ class ApplicationService(IApplicationService):
         last_error_signature = None
         fallback_agent_name = os.getenv("PLANTUML_VALIDATION_FALLBACK_AGENT")
         fallback_used = False
+        use_linter = linter_enabled()
+        last_lint_signature = None
+        use_autofix = autofix_enabled()
+        autofix_rounds = max_autofix_rounds()
+        seen = {current}
+        use_regions = region_repair_enabled()
+        region_min_lines = region_repair_min_lines()
+
+        def validate(text: str, issues: list) -> tuple[Optional[bool], str]:
+            ok, output = validator.validate(text)
+            if ok is False and issues:
+                output = f"{output}\nLinter hints:\n{format_issues(issues)}"
+            return ok, output
+
+        def check(text: str) -> tuple[Optional[bool], str, bool]:
+            """(is_valid, output, whether the validator produced the verdict)."""
+            nonlocal last_lint_signature
+            issues = lint_plantuml(text, diagram_type) if use_linter else []
+            lint_signature = format_issues([i for i in issues if i.severity == "error"])
+            if has_errors(issues) and lint_signature != last_lint_signature:
+                # Obviously broken output goes straight to repair without a JVM round-trip. If the
+                # same lint errors come back, defer to the real validator in case the linter is wrong.
+                last_lint_signature = lint_signature
+                print("[plantuml-linter] rejected diagram before validation")
+                return False, format_issues(issues), False
+            return (*validate(text, issues), True)
 
         for attempt in range(1, max_attempts + 1):
-            is_valid, validator_output = validator.validate(current)
+            is_valid, validator_output, validated = check(current)
+
+            # Deterministic rewrites first; they do not count against the LLM attempts.
+            autofixed = False
+            autofix_budget = autofix_rounds
+            while use_autofix and is_valid is False and autofix_budget > 0:
+                if not validated:
+                    # Autofix only rewrites lines the validator itself rejects; a linter
+                    # verdict alone is not enough to touch the diagram.
+                    is_valid, validator_output = validate(current, lint_plantuml(current, diagram_type) if use_linter else [])
+                    validated = True
+                    if is_valid is not False:
+                        break
+                fixed, rules = autofix_plantuml(current, diagram_type, validator_output)
+                if not rules or fixed in seen:
+                    break
+                autofix_budget -= 1
+                seen.add(fixed)
+                repair_stats().record_autofix(rules)
+                print(f"[plantuml-autofix] applied {rules}")
+                current, autofixed = fixed, True
+                is_valid, validator_output, validated = check(current)
+
+            if is_valid is None:
+                print(f"[plantuml] validation unavailable ({validator_output}); returning diagram unchecked")
+                return current, None
+
             if is_valid:
+                if autofixed:
+                    repair_stats().record_avoided()
                 print(f"[plantuml] validator accepted diagram on attempt {attempt}/{max_attempts}:")
                 print(current)
-                return current
+                return current, True
 
             print(f"[plantuml] validation failed (attempt {attempt}/{max_attempts}): {validator_output}")
 
@@ -273,16 +523,30 @@ class ApplicationService(IApplicationService):
                     print(f"[plantuml] unable to instantiate fallback agent '{fallback_agent_name}': {exc}")
 
             try:
-                agent_response = self.infra.refine_model(current, feedback, agent_override=agent_override)
-                refined, _ = extract_sections(agent_response)
-                current = sanitize_plantuml(refined or agent_response)
+                repair_stats().record_llm_repair()
+                # Long diagrams with a located error only send the failing block; a repeated
+                # error falls back to rewriting the whole diagram.
+                region = None
+                if use_regions and repeat_error_count == 0 and len(current.splitlines()) >= region_min_lines:
+                    error_line = self._extract_validator_line(validator_output)
+                    region = find_region(current, error_line) if error_line else None
+                if region:
+                    start, end = region
+                    print(f"[plantuml] repairing lines {start + 1}-{end + 1} only")
+                    region_prompt = self._build_region_feedback(current, start, end, validator_output, diagram_type)
+                    reply = extract_region_reply(self.infra.refine_region(region_prompt, agent_override=agent_override))
+                    current = sanitize_plantuml(splice(current, start, end, reply)) if reply.strip() else current
+                else:
+                    agent_response = self.infra.refine_model(current, feedback, agent_override=agent_override)
+                    refined, _ = extract_sections(agent_response)
+                    current = sanitize_plantuml(refined or agent_response)
             except NotImplementedError:
                 print("[plantuml] refine_model not supported by current agent; aborting auto-fix.")
                 break
 
         print(f"[plantuml] validator failed after {max_attempts} attempts. Final diagram:")
         print(current)
-        return current
+        return current, False
 
     @staticmethod
     def _build_validator_feedback(
@@ -305,6 +569,29 @@ class ApplicationService(IApplicationService):
             f"Original user request:\n{original_prompt}"
         )
 
+    @staticmethod
+    def _build_region_feedback(plantuml_text: str, start: int, end: int, validator_output: str, diagram_type: Optional[str]) -> str:
+        """
+        Prompt for rewriting only the failing block. The rest of the diagram is shown as a
+        collapsed skeleton so names and structure stay consistent without re-sending it.
+        """
+        region = "\n".join(plantuml_text.splitlines()[start:end + 1])
+        return (
+            f"A {diagram_type or 'PlantUML'} diagram failed syntax validation. Rewrite ONLY the region below so it is valid PlantUML.\n"
+            f"Validator output:\n{validator_output or 'Unknown validator error'}\n\n"
+            f"Diagram outline (the region is marked, other block bodies are shown as '...'):\n"
+            f"{skeleton(plantuml_text, start, end)}\n\n"
+            f"Region (lines {start + 1}-{end + 1}):\n{region}\n\n"
+            "Rules:\n"
+            "- Return only the corrected region lines, with no @startuml/@enduml, markdown fences or commentary.\n"
+            "- Keep the same elements, names and meaning; keep any block opened in the region closed in the region."
+        )
+
+    @staticmethod
+    def _extract_validator_line(validator_output: str | None) -> int | None:
+        match = re.search(r"line\s+(\d+)", validator_output or "", re.IGNORECASE)
+        return int(match.group(1)) if match else None
+
     @staticmethod
     def _extract_validator_signature(validator_output: str | None) -> str | None:
         """
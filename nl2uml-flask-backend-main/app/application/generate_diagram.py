@@ -14,6 +14,8 @@ class GenerateDiagram:
         prompt = body.get("prompt", "")
         agent_type = body.get("AI_Agent", "").lower().strip() or "openai"
         pipeline_models = body.get("ollamaModels") or body.get("ollama_models")
+        best_of_n = body.get("bestOfN")
+        best_of_concurrency = body.get("bestOfConcurrency")
 
         print(f"[nlp_agent] GenerateDiagram")
 
@@ -43,6 +45,9 @@ class GenerateDiagram:
                 pipeline_prompts=pipeline_prompts,
                 agent_type=agent_type,
                 pipeline_models=pipeline_models,
+                best_of_n=best_of_n,
+                best_of_concurrency=best_of_concurrency,
+                user_prompt=prompt,
             )
             return response_json
         except Exception as exc:
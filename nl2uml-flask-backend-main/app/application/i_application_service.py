@@ -21,7 +21,7 @@ class IApplicationService(ABC):
         pass
 
     @abstractmethod
-    def cleanup_expired(self) -> None:
+    def cleanup_expired(self) -> dict:
         pass
 
     @abstractmethod
@@ -92,3 +92,11 @@ class IApplicationService(ABC):
     @abstractmethod
     def handle_redo_request(self, user_email: str, body: dict) -> dict:
         pass
+
+    @abstractmethod
+    def handle_jump_request(self, user_email: str, body: dict) -> dict:
+        pass
+
+    @abstractmethod
+    def list_command_history(self, user_email: str, diagram_id: str) -> dict:
+        pass
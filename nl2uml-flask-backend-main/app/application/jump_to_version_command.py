@@ -0,0 +1,36 @@
+from typing import Dict
+from datetime import datetime
+
+class JumpToVersionCommand:
+    def __init__(self, app_service: "ApplicationService"):
+        self.app = app_service
+
+    def execute(self, user_email: str, body: Dict) -> Dict:
+        diagram_id = body.get("diagramId")
+        project_id = body.get("ProjectId") or body.get("projectId")
+        command_id = body.get("commandId")
+
+        if not diagram_id or not project_id or not command_id:
+            raise ValueError("diagramId, projectId and commandId required.")
+
+        result = self.app.domain.jump_to_command(user_email, project_id, diagram_id, command_id)
+        if not result:
+            raise ValueError("Version not found.")
+
+        plantuml = result.get("plantuml", "")
+        self._persist_state(user_email, project_id, diagram_id, plantuml)
+
+        return {
+            "diagramId": diagram_id,
+            "commandId": command_id,
+            "plantuml": plantuml,
+            "message": result.get("message", "Jump successful"),
+        }
+
+    def _persist_state(self, user_email: str, project_id: str, diagram_id: str, plantuml: str) -> None:
+        diagram = self.app.domain.get_diagram_by_id(diagram_id)
+        if not diagram:
+            return
+        diagram["plantuml"] = plantuml
+        diagram["updatedAt"] = datetime.utcnow().isoformat()
+        self.app.domain.create_diagram_record(diagram)
@@ -12,6 +12,8 @@ class RefineDiagram:
         feedback = body.get("feedback", "")
         agent_type = body.get("AI_Agent", "").lower().strip() or "ollama"
         pipeline_models = body.get("ollamaModels") or body.get("ollama_models")
+        best_of_n = body.get("bestOfN")
+        best_of_concurrency = body.get("bestOfConcurrency")
 
         if not (diagram_id and project_id and feedback):
             raise ValueError("Missing required parameters")
@@ -29,31 +31,35 @@ class RefineDiagram:
             "Return the updated PlantUML code only."
         )
 
-        new_diagram = self.app.generate_and_save_diagram(
-            user_email=user_email,
-            project_id=project_id,
-            name=current["name"],
-            diagram_type=current["diagramType"],
-            prompt=updated_prompt,
-            diagram_id=diagram_id,
-            agent_type=agent_type,
-            pipeline_models=pipeline_models,
-        )
-
-        plantuml_after = new_diagram.get("plantuml", "")
-
-        try:
-            self.app.domain.record_refine_command(
-                diagram_id=diagram_id,
+        # The regenerated diagram and its history entry commit together.
+        with self.app.infra.unit_of_work():
+            new_diagram = self.app.generate_and_save_diagram(
                 user_email=user_email,
                 project_id=project_id,
-                command_id=command_id,
-                timestamp=timestamp,
-                plantuml_before=plantuml_before,
-                plantuml_after=plantuml_after,
+                name=current["name"],
+                diagram_type=current["diagramType"],
+                prompt=updated_prompt,
+                diagram_id=diagram_id,
+                agent_type=agent_type,
+                pipeline_models=pipeline_models,
+                best_of_n=best_of_n,
+                best_of_concurrency=best_of_concurrency,
             )
-        except AttributeError:
-            pass
+
+            plantuml_after = new_diagram.get("plantuml", "")
+
+            try:
+                self.app.domain.record_refine_command(
+                    diagram_id=diagram_id,
+                    user_email=user_email,
+                    project_id=project_id,
+                    command_id=command_id,
+                    timestamp=timestamp,
+                    plantuml_before=plantuml_before,
+                    plantuml_after=plantuml_after,
+                )
+            except AttributeError:
+                pass
 
         if self.app.websocket_service:
             self.app.websocket_service.push_message_to_user(
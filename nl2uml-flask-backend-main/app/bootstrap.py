@@ -12,6 +12,7 @@ from .infrastructure.repositories.model_store_repository import (
 )
 from .infrastructure.repositories.sqlite_user_repository import SqliteUserRepository
 from .infrastructure.repositories.sqlite_command_history_repository import SqliteCommandHistoryRepository
+from .infrastructure.repositories.sqlite_validation_store import validation_store_from_env
 
 # --- Agent factory (function-style preferred) ---
 try:
@@ -23,10 +24,13 @@ except Exception:
 
 from .application.application_service import ApplicationService
 from .infrastructure.infrastructure_service import InfrastructureService
+from .infrastructure.internal.retention import get_retention_sweeper, sweeper_enabled
 
 # --- Domain services ---
 from .domain.domain_access import DomainAccess
 from .domain.internal.prompt_template_service import PromptTemplateService
+from .domain.internal.render_queue import get_render_queue
+from .domain.internal.plantuml_validation_cache import configure_validation_store
 
 # --- In-memory repos (users/commands always available; models only in USE_INMEM_REPO path) ---
 from .domain.internal.user_repository_memory import InMemoryUserRepository as LocalUserRepository
@@ -140,8 +144,18 @@ def build_application_service_injection() -> ApplicationService:
         model_repository=model_repo,
         prompt_template_service=prompt_templates,
         command_repo=command_repo,
+        render_queue=get_render_queue(),
     )
 
+    # --- PlantUML validation cache: persisted when PLANTUML_VALIDATION_CACHE_DB is set ---
+    configure_validation_store(validation_store_from_env())
+
+    # --- Retention: the ModelStoreAdapter registered its store; add command history and start sweeping ---
+    sweeper = get_retention_sweeper()
+    sweeper.register_history(command_repo)
+    if sweeper_enabled():
+        sweeper.start()
+
     # --- Presentation / WebSockets ---
     _dispatcher, websocket_push = _build_websockets()
 
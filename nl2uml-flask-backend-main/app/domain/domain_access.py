@@ -6,11 +6,12 @@ from .internal.uml_model import UMLModel
 from .internal.prompt_template_factory import PromptTemplateFactory
 
 class DomainAccess(IDomainAccess):
-    def __init__(self, user_repo, model_repository, prompt_template_service, command_repo):
+    def __init__(self, user_repo, model_repository, prompt_template_service, command_repo, render_queue=None):
         self.user_repo = user_repo
         self.model_repository = model_repository
         self.prompt_template_service = prompt_template_service
         self.command_repo = command_repo
+        self.render_queue = render_queue
 
     def parse_uml(self, raw: str):
         return UMLModel(raw)
@@ -70,6 +71,9 @@ class DomainAccess(IDomainAccess):
     # --- Projects ---
     def create_project(self, user_email: str, name: str, description: str) -> dict:
         project = {"projectId": str(uuid.uuid4()), "name": name, "description": description}
+        if hasattr(self.user_repo, "add_project"):
+            self.user_repo.add_project(user_email, project)
+            return project
         user = self.user_repo.get_user(user_email) or {"projects": []}
         projects = list(user.get("projects", []))
         projects.append(project)
@@ -84,12 +88,16 @@ class DomainAccess(IDomainAccess):
         return list(user.get("projects", []))
 
     def get_project(self, user_email: str, project_id: str) -> dict | None:
+        if hasattr(self.user_repo, "get_project"):
+            return self.user_repo.get_project(user_email, project_id)
         for proj in self.list_projects(user_email):
             if proj.get("projectId") == project_id:
                 return proj
         return None
 
     def delete_project(self, user_email: str, project_id: str) -> bool:
+        if hasattr(self.user_repo, "delete_project"):
+            return bool(self.user_repo.delete_project(user_email, project_id))
         projects = [p for p in self.list_projects(user_email) if p.get("projectId") != project_id]
         if hasattr(self.user_repo, "update_projects"):
             self.user_repo.update_projects(email=user_email, projects=projects)
@@ -100,6 +108,9 @@ class DomainAccess(IDomainAccess):
     def create_diagram_record(self, diagram_item: dict) -> None:
         pk = diagram_item["diagramId"]
         self.model_repository.save(pk, diagram_item)
+        # Warm the render cache so the browser's first image request is a hit.
+        if self.render_queue is not None:
+            self.render_queue.submit(diagram_item.get("plantuml"))
 
     def list_project_diagrams(self, project_id: str) -> list[dict]:
         if hasattr(self.model_repository, "get_by_project"):
@@ -138,3 +149,13 @@ class DomainAccess(IDomainAccess):
         if hasattr(self.command_repo, "redo"):
             return self.command_repo.redo(diagram_id, user_email, project_id)
         return None
+
+    def list_command_versions(self, diagram_id: str) -> list[dict]:
+        if hasattr(self.command_repo, "list_versions"):
+            return self.command_repo.list_versions(diagram_id)
+        return []
+
+    def jump_to_command(self, user_email: str, project_id: str, diagram_id: str, command_id: str) -> dict | None:
+        if hasattr(self.command_repo, "jump_to"):
+            return self.command_repo.jump_to(diagram_id, user_email, project_id, command_id)
+        return None
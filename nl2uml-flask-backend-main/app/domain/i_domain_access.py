@@ -76,3 +76,11 @@ class IDomainAccess(ABC):
     @abstractmethod
     def redo_last_command(self, user_email: str, project_id: str, diagram_id: str) -> dict | None:
         pass
+
+    @abstractmethod
+    def list_command_versions(self, diagram_id: str) -> list[dict]:
+        pass
+
+    @abstractmethod
+    def jump_to_command(self, user_email: str, project_id: str, diagram_id: str, command_id: str) -> dict | None:
+        pass
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 class CommandHistoryRepository(ABC):
     @abstractmethod
@@ -23,3 +23,11 @@ class CommandHistoryRepository(ABC):
     @abstractmethod
     def redo(self, diagram_id: str, user_email: str, project_id: str) -> Optional[Dict[str, str]]:
         """Move the cursor forward one command and return the resulting plantuml snapshot."""
+
+    @abstractmethod
+    def list_versions(self, diagram_id: str) -> List[Dict[str, object]]:
+        """Recorded versions of a diagram, oldest first, without their plantuml text."""
+
+    @abstractmethod
+    def jump_to(self, diagram_id: str, user_email: str, project_id: str, command_id: str) -> Optional[Dict[str, str]]:
+        """Move the cursor to `command_id` and return that version's plantuml snapshot."""
@@ -1,16 +1,61 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, Deque, Dict, List, Optional
 from .command_history_repository import CommandHistoryRepository
+from .plantuml_delta import DELTA, FULL, encode_version, make_delta, rebuild
+from app.util.env import env_number
+
+DEFAULT_MAX_DEPTH = 100
+DEFAULT_MAX_DIAGRAMS = 1000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _size(cmd: Dict[str, Any]) -> int:
+    return len(cmd.get("plantumlAfter") or "") + len(cmd.get("beforeDelta") or "")
+
+
+class _DiagramHistory:
+    __slots__ = ("cmds", "cursor", "bytes")
+
+    def __init__(self) -> None:
+        # versions oldest first; cmds[0] is always a keyframe
+        self.cmds: Deque[Dict[str, Any]] = deque()
+        self.cursor = 0
+        self.bytes = 0
+
 
 class InMemoryCommandHistoryRepository(CommandHistoryRepository):
-    def __init__(self):
-        # diagramId -> list[command]
-        self._history: Dict[str, List[Dict[str, Any]]] = {}
+    """
+    Stores each version as a keyframe or a line delta against the previous
+    version, like SqliteCommandHistoryRepository (see plantuml_delta). A
+    per-diagram cursor (index of the current version) makes undo/redo a
+    direct index move; a lock keeps concurrent clicks from racing.
 
-    def _commands(self, diagram_id: str) -> List[Dict[str, Any]]:
-        cmds = self._history.setdefault(diagram_id, [])
-        cmds.sort(key=lambda c: c["timestamp"])
-        return cmds
+    Memory is bounded three ways: each diagram keeps at most
+    COMMAND_HISTORY_MAX_DEPTH versions (the oldest is dropped and its
+    successor rewritten as a keyframe), at most COMMAND_HISTORY_MAX_DIAGRAMS
+    diagrams are kept, and the stored text is capped at
+    COMMAND_HISTORY_MAX_BYTES. Over either of the last two limits, the least
+    recently used diagrams lose their history.
+    """
+
+    def __init__(self, max_depth: Optional[int] = None, max_diagrams: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_depth = max(2, int(max_depth or env_number("COMMAND_HISTORY_MAX_DEPTH", DEFAULT_MAX_DEPTH)))
+        self.max_diagrams = int(max_diagrams or env_number("COMMAND_HISTORY_MAX_DIAGRAMS", DEFAULT_MAX_DIAGRAMS))
+        self.max_bytes = int(max_bytes or env_number("COMMAND_HISTORY_MAX_BYTES", DEFAULT_MAX_BYTES))
+        # diagramId -> history, least recently used first
+        self._history: "OrderedDict[str, _DiagramHistory]" = OrderedDict()
+        self._bytes = 0
+        self._counters = {"trimmed": 0, "evicted": 0}
+        self._lock = threading.Lock()
+
+    def _touch(self, diagram_id: str) -> Optional[_DiagramHistory]:
+        history = self._history.get(diagram_id)
+        if history is not None:
+            self._history.move_to_end(diagram_id)
+        return history
 
     def record_refine(
         self,
@@ -23,65 +68,137 @@ class InMemoryCommandHistoryRepository(CommandHistoryRepository):
         plantuml_before: str,
         plantuml_after: str,
     ) -> None:
-        cmds = self._commands(diagram_id)
-        # Remove redo stack (anything after current)
-        current_idx = next((i for i, c in enumerate(cmds) if c.get("isCurrent")), None)
-        if current_idx is not None:
-            cmds[:] = cmds[: current_idx + 1]
-            cmds[current_idx]["isCurrent"] = False
-        elif not cmds:
-            # seed baseline snapshot for undo
-            cmds.append(
-                {
+        with self._lock:
+            history = self._touch(diagram_id)
+            if history is not None and history.cmds:
+                # Remove redo stack (anything after current)
+                while len(history.cmds) > history.cursor + 1:
+                    self._account(history, -_size(history.cmds.pop()))
+            else:
+                # seed baseline snapshot for undo
+                history = self._history[diagram_id] = _DiagramHistory()
+                self._append(history, {
                     "commandId": f"base-{diagram_id}",
                     "timestamp": timestamp - 1,
-                    "plantumlAfter": plantuml_before,
+                    "plantumlAfter": plantuml_before or "",
+                    "storage": FULL,
                     "userEmail": user_email,
                     "projectId": project_id,
-                    "isCurrent": False,
-                }
-            )
+                })
 
-        cmds.append(
-            {
+            current_idx = history.cursor
+            previous = self._state(history, current_idx)
+            chain_length = current_idx - self._keyframe_index(history, current_idx)
+            storage, payload = encode_version(previous, plantuml_after or "", chain_length)
+            self._append(history, {
                 "commandId": command_id,
                 "timestamp": timestamp,
-                "plantumlBefore": plantuml_before,
-                "plantumlAfter": plantuml_after,
+                "plantumlAfter": payload,
+                "storage": storage,
+                "beforeDelta": make_delta(previous, plantuml_before or "") if (plantuml_before or "") != previous else None,
                 "userEmail": user_email,
                 "projectId": project_id,
-                "isCurrent": True,
+            })
+            history.cursor = len(history.cmds) - 1
+            while len(history.cmds) > self.max_depth:
+                self._drop_oldest(history)
+            self._evict(keep=diagram_id)
+
+    def _account(self, history: _DiagramHistory, delta: int) -> None:
+        history.bytes += delta
+        self._bytes += delta
+
+    def _append(self, history: _DiagramHistory, cmd: Dict[str, Any]) -> None:
+        history.cmds.append(cmd)
+        self._account(history, _size(cmd))
+
+    def _drop_oldest(self, history: _DiagramHistory) -> None:
+        # The new oldest version must be self-contained, so materialize it first.
+        successor = history.cmds[1]
+        if successor.get("storage") == DELTA:
+            text = self._state(history, 1)
+            self._account(history, len(text) - len(successor.get("plantumlAfter") or ""))
+            successor["plantumlAfter"], successor["storage"] = text, FULL
+        self._account(history, -_size(history.cmds.popleft()))
+        history.cursor = max(history.cursor - 1, 0)
+        self._counters["trimmed"] += 1
+
+    def _evict(self, keep: str) -> None:
+        while len(self._history) > 1 and (len(self._history) > self.max_diagrams or self._bytes > self.max_bytes):
+            diagram_id = next(iter(self._history))
+            if diagram_id == keep:
+                break
+            self._bytes -= self._history.pop(diagram_id).bytes
+            self._counters["evicted"] += 1
+
+    @staticmethod
+    def _keyframe_index(history: _DiagramHistory, idx: int) -> int:
+        while idx > 0 and history.cmds[idx].get("storage") == DELTA:
+            idx -= 1
+        return idx
+
+    def _state(self, history: _DiagramHistory, idx: int) -> str:
+        start = self._keyframe_index(history, idx)
+        return rebuild((c.get("storage", FULL), c.get("plantumlAfter")) for c in islice(history.cmds, start, idx + 1))
+
+    def _move(self, diagram_id: str, step: int, message: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            history = self._touch(diagram_id)
+            if history is None or not 0 <= history.cursor + step < len(history.cmds):
+                return None
+            history.cursor += step
+            return {
+                "diagramId": diagram_id,
+                "plantuml": self._state(history, history.cursor),
+                "message": message,
             }
-        )
 
     def undo(self, diagram_id: str, user_email: str, project_id: str) -> Optional[Dict[str, str]]:
-        cmds = self._commands(diagram_id)
-        if not cmds:
-            return None
-        current_idx = next((i for i, c in enumerate(cmds) if c.get("isCurrent")), None)
-        if current_idx is None or current_idx == 0:
-            return None
-        cmds[current_idx]["isCurrent"] = False
-        cmds[current_idx - 1]["isCurrent"] = True
-        prev_cmd = cmds[current_idx - 1]
-        return {
-            "diagramId": diagram_id,
-            "plantuml": prev_cmd.get("plantumlAfter", ""),
-            "message": "Undo successful",
-        }
+        return self._move(diagram_id, -1, "Undo successful")
 
     def redo(self, diagram_id: str, user_email: str, project_id: str) -> Optional[Dict[str, str]]:
-        cmds = self._commands(diagram_id)
-        if not cmds:
-            return None
-        current_idx = next((i for i, c in enumerate(cmds) if c.get("isCurrent")), None)
-        if current_idx is None or current_idx >= len(cmds) - 1:
-            return None
-        cmds[current_idx]["isCurrent"] = False
-        cmds[current_idx + 1]["isCurrent"] = True
-        next_cmd = cmds[current_idx + 1]
-        return {
-            "diagramId": diagram_id,
-            "plantuml": next_cmd.get("plantumlAfter", ""),
-            "message": "Redo successful",
-        }
+        return self._move(diagram_id, 1, "Redo successful")
+
+    def list_versions(self, diagram_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            history = self._history.get(diagram_id)
+            if history is None:
+                return []
+            return [
+                {
+                    "commandId": c["commandId"],
+                    "timestamp": c["timestamp"],
+                    "commandType": "BASE" if c["commandId"].startswith("base-") else "RefineDiagram",
+                    "isCurrent": idx == history.cursor,
+                    "keyframe": c.get("storage") != DELTA,
+                }
+                for idx, c in enumerate(history.cmds)
+            ]
+
+    def jump_to(self, diagram_id: str, user_email: str, project_id: str, command_id: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            history = self._touch(diagram_id)
+            if history is None:
+                return None
+            target_idx = next((i for i, c in enumerate(history.cmds) if c["commandId"] == command_id), None)
+            if target_idx is None:
+                return None
+            history.cursor = target_idx
+            return {
+                "diagramId": diagram_id,
+                "commandId": command_id,
+                "plantuml": self._state(history, target_idx),
+                "message": "Jump successful",
+            }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "diagrams": len(self._history),
+                "versions": sum(len(h.cmds) for h in self._history.values()),
+                "bytes": self._bytes,
+                "maxDepth": self.max_depth,
+                "maxDiagrams": self.max_diagrams,
+                "maxBytes": self.max_bytes,
+                **self._counters,
+            }
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.util.env import env_int
+from .plantuml_linter import (
+    ACTIVITY_BLOCKS,
+    BOX_RE,
+    DECLARATION_RE,
+    END_BOX_RE,
+    ERROR,
+    MEMBER_LINE_RE,
+    SEQUENCE_END_RE,
+    SEQUENCE_GROUP_RE,
+    LintIssue,
+    has_arrow,
+    lint_plantuml,
+    strip_arrows,
+)
+
+UNICODE_ARROWS = (("→", "->"), ("←", "<-"), ("⇒", "->"), ("—", "-"), ("–", "-"))
+BLOCK_CLOSERS = {
+    "if": "endif",
+    "while": "endwhile",
+    "repeat": "repeat while ()",
+    "fork": "end fork",
+    "split": "end split",
+    "switch": "endswitch",
+    "box": "end box",
+}
+FENCE_RE = re.compile(r"^\s*```")
+ILLEGAL_DECL_RE = re.compile(
+    r"^(?P<indent>\s*)(?P<kw>class|interface|enum|entity|abstract\s+class|component|participant|actor|usecase)\s+"
+    r"(?P<name>[A-Za-z_][\w]*(?:[- ][\w]+)+)(?P<rest>\s*(?:<<.*>>)?\s*\{?\s*)$",
+    re.IGNORECASE,
+)
+ILLEGAL_ALIAS_RE = re.compile(r"\bas\s+(?P<alias>[A-Za-z_][\w]*(?:[- ][A-Za-z_][\w]*)+)\s*(?P<rest>\{?)\s*$", re.IGNORECASE)
+VALIDATOR_LINE_RE = re.compile(r"line\s+(\d+)", re.IGNORECASE)
+# Braces whose body may hold declarations and relationships, so where it should end is a guess.
+CONTAINER_RE = re.compile(
+    r"^\s*(?:package|namespace|node|folder|frame|cloud|database|rectangle|component|state|card|together)\b",
+    re.IGNORECASE,
+)
+DEFAULT_MAX_ROUNDS = 3
+
+
+def autofix_enabled() -> bool:
+    return (os.getenv("PLANTUML_AUTOFIX", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def max_autofix_rounds() -> int:
+    return max(env_int("PLANTUML_AUTOFIX_MAX_ROUNDS", DEFAULT_MAX_ROUNDS, positive=False), 0)
+
+
+def autofix_plantuml(plantuml: str, diagram_type: Optional[str] = None, validator_output: str = "") -> Tuple[str, List[str]]:
+    """
+    Apply local rewrites for diagnostics we know how to repair without an LLM.
+    Structural problems come from the linter; the validator's error line is used
+    for fixes the linter cannot see (illegal names/aliases, stray markdown
+    fences). `validator_output` must come from the PlantUML validator itself:
+    brace and block fixes only run when it rejected the line they touch, so a
+    linter false positive never rewrites a valid diagram. Returns the rewritten
+    text and the names of the rules that fired; an empty list means nothing
+    recognizable was found.
+    """
+    lines = (plantuml or "").splitlines()
+    applied: List[str] = []
+    error_line = _validator_line(validator_output)
+
+    # Line-local rewrites first, so the structural pass below sees the final text.
+    fixed_lines, rules = _fix_lines(lines, diagram_type, error_line)
+    applied.extend(rules)
+    lines = fixed_lines
+
+    issues = [i for i in lint_plantuml("\n".join(lines), diagram_type) if i.severity == ERROR]
+    if issues:
+        lines, rules = _fix_structure(lines, issues, error_line)
+        applied.extend(rules)
+
+    return "\n".join(lines), applied
+
+
+def _validator_line(validator_output: str) -> Optional[int]:
+    match = VALIDATOR_LINE_RE.search(validator_output or "")
+    return int(match.group(1)) if match else None
+
+
+def _fix_lines(lines: List[str], diagram_type: Optional[str], error_line: Optional[int]) -> Tuple[List[str], List[str]]:
+    applied: List[str] = []
+    out: List[str] = []
+    renames: Dict[str, str] = {}
+    for idx, line in enumerate(lines, start=1):
+        if FENCE_RE.match(line):
+            applied.append("drop-markdown-fence")
+            continue
+        if any(sym in line for sym, _ in UNICODE_ARROWS) and not line.strip().startswith(("'", "note", "title")):
+            for sym, ascii_arrow in UNICODE_ARROWS:
+                line = line.replace(sym, ascii_arrow)
+            applied.append("ascii-arrow")
+        if error_line is not None and idx == error_line:
+            line, renamed = _fix_illegal_name(line)
+            if renamed:
+                renames.update(renamed)
+                applied.append("illegal-alias")
+        out.append(line)
+    if renames:
+        out = [_apply_renames(line, renames) if not ILLEGAL_DECL_RE.match(line) else line for line in out]
+    return out, applied
+
+
+def _fix_illegal_name(line: str) -> Tuple[str, Dict[str, str]]:
+    """`class Order Item {` -> `class "Order Item" as Order_Item {`; `as Web Server` -> `as Web_Server`."""
+    decl = ILLEGAL_DECL_RE.match(line)
+    if decl and not re.search(r"\b(extends|implements)\b", decl.group("name"), re.IGNORECASE):
+        name = decl.group("name")
+        alias = re.sub(r"[- ]+", "_", name)
+        rest = decl.group("rest").rstrip()
+        new_line = f'{decl.group("indent")}{decl.group("kw")} "{name}" as {alias}'
+        return (f"{new_line} {rest.strip()}" if rest.strip() else new_line), {name: alias}
+    alias_match = ILLEGAL_ALIAS_RE.search(line)
+    if alias_match:
+        bad = alias_match.group("alias")
+        good = re.sub(r"[- ]+", "_", bad)
+        suffix = f" {alias_match.group('rest')}" if alias_match.group("rest") else ""
+        return line[: alias_match.start("alias")] + good + suffix, {bad: good}
+    return line, {}
+
+
+def _apply_renames(line: str, renames: Dict[str, str]) -> str:
+    stripped = line.strip()
+    if stripped.startswith(("'", "note", "title")) or stripped.lower().startswith("@"):
+        return line
+    # Only rewrite the part before a label so message/relationship text stays as written.
+    head, sep, label = line.partition(" : ")
+    for bad, good in renames.items():
+        head = re.sub(rf'(?<!")\b{re.escape(bad)}\b(?!")', good, head)
+    return head + sep + label
+
+
+def _fix_structure(lines: List[str], issues: List[LintIssue], error_line: Optional[int]) -> Tuple[List[str], List[str]]:
+    """
+    Stray closers are only dropped on the line the validator rejected. Missing
+    closers are only added when the validator rejected a line at or after the
+    opener (PlantUML reports an unclosed block where it gives up, usually at
+    @enduml). A closer goes right after the opener's body, before the first
+    line that cannot belong to it; when that line cannot be told, no closer is
+    added and the diagram is left to the LLM repair. Braces are never removed
+    from relationship lines.
+    """
+    applied: List[str] = []
+    drop: set = set()
+    stray_braces: set = set()
+    closers: List[Tuple[int, str, str]] = []
+    stray_closes: List[Tuple[int, str]] = []
+    terminate: set = set()
+    need_start = need_end = False
+
+    for issue in issues:
+        if issue.code == "missing-startuml":
+            need_start = True
+        elif issue.code == "missing-enduml":
+            need_end = True
+        elif issue.code == "unbalanced-brace" and issue.line == error_line:
+            stray_braces.add(issue.line)
+        elif issue.code == "unexpected-close" and issue.line == error_line:
+            parts = issue.message.split("'")
+            stray_closes.append((issue.line, parts[3] if len(parts) > 3 else ""))
+        elif issue.code == "unclosed-brace" and error_line is not None and error_line >= issue.line:
+            closers.append((issue.line, "}", ""))
+        elif issue.code == "unclosed-block" and error_line is not None and error_line >= issue.line:
+            name = issue.message.split("'")[1] if "'" in issue.message else ""
+            closers.append((issue.line, BLOCK_CLOSERS.get(name, "end"), name))
+        elif issue.code == "unterminated-action":
+            terminate.add(issue.line)
+
+    for line, name in stray_closes:
+        # `endwhile` reached while an inner `if` is open still closes its `while`: keep it and close the `if` instead.
+        opener = next((c for c in reversed(closers) if name and c[2] == name and c[0] < line), None)
+        if opener is not None:
+            closers.remove(opener)
+        else:
+            drop.add(line)
+
+    # 0-based line index -> closers to insert before it, innermost (latest opened) first.
+    inserts: Dict[int, List[str]] = {}
+    positions = [(_body_end(lines, opened, closer == "}"), opened, closer) for opened, closer, _ in closers]
+    if all(pos is not None for pos, _, _ in positions):
+        for pos, _, closer in sorted(positions, key=lambda c: (c[0], -c[1])):
+            inserts.setdefault(pos, []).append(closer)
+            applied.append("close-brace" if closer == "}" else "close-block")
+
+    out: List[str] = []
+    for idx, line in enumerate(lines, start=1):
+        out.extend(inserts.get(idx - 1, ()))
+        if idx in drop:
+            applied.append("drop-stray-close")
+            continue
+        if idx in stray_braces and not has_arrow(line) and "}" in strip_arrows(line):
+            if line.strip() == "}":
+                applied.append("drop-stray-brace")
+                continue
+            cut = line.rfind("}")
+            line = line[:cut] + line[cut + 1:]
+            applied.append("drop-stray-brace")
+        if idx in terminate:
+            line = line.rstrip() + ";"
+            applied.append("terminate-action")
+        out.append(line)
+    out.extend(inserts.get(len(lines), ()))
+
+    if need_end or not any(line.strip().lower().startswith("@enduml") for line in out):
+        out.append("@enduml")
+        applied.append("add-enduml")
+    if need_start:
+        out.insert(0, "@startuml")
+        applied.append("add-startuml")
+    return out, applied
+
+
+def _body_end(lines: List[str], opened: int, brace: bool) -> Optional[int]:
+    """
+    0-based index where the closer for the block opened on line `opened` goes:
+    after its last body line, before the first line that cannot be a member
+    (an `@end` marker, a closer of an enclosing block and, for element braces,
+    a relationship or a new declaration). None for container braces, whose
+    body could end anywhere.
+    """
+    if brace and CONTAINER_RE.match(lines[opened - 1]):
+        return None
+    depth = 0
+    end = opened
+    for idx in range(opened, len(lines)):
+        text = lines[idx].strip()
+        if not text or text.startswith("'"):
+            continue
+        if text.lower().startswith("@end"):
+            return end
+        if brace:
+            if depth == 0 and (DECLARATION_RE.match(text) or (has_arrow(text) and not MEMBER_LINE_RE.match(text))):
+                return end
+            for ch in strip_arrows(text):
+                if ch == "{":
+                    depth += 1
+                elif ch == "}":
+                    if depth == 0:
+                        return end
+                    depth -= 1
+        elif any(close_re.match(text) for _, _, close_re in ACTIVITY_BLOCKS) or END_BOX_RE.match(text) or SEQUENCE_END_RE.match(text):
+            if depth == 0:
+                return end
+            depth -= 1
+        elif any(open_re.match(text) for _, open_re, _ in ACTIVITY_BLOCKS) or BOX_RE.match(text) or SEQUENCE_GROUP_RE.match(text):
+            depth += 1
+        end = idx + 1
+    # No @enduml: the body runs to the end, where the marker is added.
+    return end
+
+
+class RepairStats:
+    """
+    Counters for the validation repair loop. `llmRoundTripsAvoided` counts diagrams
+    that failed validation and were then accepted after deterministic fixes alone.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters = {"autofixRounds": 0, "llmRoundTripsAvoided": 0, "llmRepairs": 0}
+        self._rules: Dict[str, int] = {}
+
+    def record_autofix(self, rules: List[str]) -> None:
+        with self._lock:
+            self._counters["autofixRounds"] += 1
+            for rule in rules:
+                self._rules[rule] = self._rules.get(rule, 0) + 1
+
+    def record_avoided(self) -> None:
+        with self._lock:
+            self._counters["llmRoundTripsAvoided"] += 1
+
+    def record_llm_repair(self) -> None:
+        with self._lock:
+            self._counters["llmRepairs"] += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._counters)
+            out["rules"] = dict(self._rules)
+        return out
+
+
+_STATS = RepairStats()
+
+
+def repair_stats() -> RepairStats:
+    return _STATS
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import difflib
+import json
+from typing import Iterable, List, Optional, Tuple
+
+from app.util.env import env_number
+
+# How a command history version is stored: the full text (a keyframe) or a line delta against the previous version.
+FULL = "full"
+DELTA = "delta"
+DEFAULT_KEYFRAME_INTERVAL = 20
+
+
+def keyframe_interval() -> int:
+    """A full copy is stored at least every N versions (COMMAND_HISTORY_KEYFRAME_INTERVAL)."""
+    return int(env_number("COMMAND_HISTORY_KEYFRAME_INTERVAL", DEFAULT_KEYFRAME_INTERVAL))
+
+
+def make_delta(old: str, new: str) -> str:
+    """
+    Line delta turning `old` into `new`, as compact JSON: a list of
+    `[start, end, text]` ops, each replacing old lines [start, end) with `text`.
+    Unchanged lines are not stored.
+    """
+    a = (old or "").splitlines(keepends=True)
+    b = (new or "").splitlines(keepends=True)
+    ops = [
+        [i1, i2, "".join(b[j1:j2])]
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+        if tag != "equal"
+    ]
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def apply_delta(old: str, delta: str) -> str:
+    """Inverse of make_delta; raises ValueError when the delta does not fit `old`."""
+    lines = (old or "").splitlines(keepends=True)
+    try:
+        ops = json.loads(delta or "[]")
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"Invalid delta: {exc}") from exc
+    out: List[str] = []
+    pos = 0
+    for op in ops:
+        start, end, text = op
+        if not (pos <= start <= end <= len(lines)):
+            raise ValueError(f"Delta op [{start}, {end}) does not fit a {len(lines)}-line base")
+        out.extend(lines[pos:start])
+        out.append(text)
+        pos = end
+    out.extend(lines[pos:])
+    return "".join(out)
+
+
+def encode_version(previous: Optional[str], text: str, chain_length: int) -> Tuple[str, str]:
+    """
+    Storage form for a new version following `previous`, whose chain already
+    holds `chain_length` deltas since its keyframe. Returns (FULL, text) when a
+    keyframe is due or the delta would not be smaller than the text itself.
+    """
+    text = text or ""
+    if previous is None or chain_length + 1 >= keyframe_interval():
+        return FULL, text
+    delta = make_delta(previous, text)
+    if len(delta) >= len(text):
+        return FULL, text
+    return DELTA, delta
+
+
+def rebuild(chain: Iterable[Tuple[str, Optional[str]]]) -> str:
+    """Replay (storage, payload) pairs from a keyframe onwards and return the final text."""
+    text: Optional[str] = None
+    for storage, payload in chain:
+        if storage == DELTA:
+            if text is None:
+                raise ValueError("Delta chain does not start with a keyframe")
+            text = apply_delta(text, payload or "")
+        else:
+            text = payload or ""
+    return text or ""
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import zlib
+
+# PlantUML's URL alphabet, mapped onto standard base64 so the stdlib codec does the bit shuffling.
+PLANTUML_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+BASE64_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+MAX_ENCODED_LENGTH = 64 * 1024
+MAX_DECODED_BYTES = 1024 * 1024
+
+_TO_BASE64 = str.maketrans(PLANTUML_ALPHABET, BASE64_ALPHABET)
+_TO_PLANTUML = str.maketrans(BASE64_ALPHABET, PLANTUML_ALPHABET)
+
+
+def encode_plantuml(plantuml: str) -> str:
+    """The `/svg/<encoded>` form used by plantuml.com and `plantuml-encoder` (raw deflate + custom base64)."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    data = compressor.compress(plantuml.encode("utf-8")) + compressor.flush()
+    return base64.b64encode(data).decode("ascii").rstrip("=").translate(_TO_PLANTUML)
+
+
+def decode_plantuml(encoded: str) -> str:
+    """
+    Inverse of encode_plantuml. Also accepts the `~1` prefix (deflate with the
+    same alphabet, as emitted by some clients) and `~h` hex-encoded text.
+    Raises ValueError for anything that is not a well-formed encoding, and caps
+    the inflated size so a small URL cannot expand into an unbounded diagram.
+    """
+    encoded = (encoded or "").strip()
+    if not encoded:
+        raise ValueError("Encoded diagram is empty")
+    if len(encoded) > MAX_ENCODED_LENGTH:
+        raise ValueError("Encoded diagram is too long")
+    if encoded.startswith("~h"):
+        try:
+            return bytes.fromhex(encoded[2:]).decode("utf-8")
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ValueError(f"Invalid hex-encoded diagram: {exc}") from exc
+    if encoded.startswith("~1"):
+        encoded = encoded[2:]
+    if encoded.strip(PLANTUML_ALPHABET) or len(encoded) % 4 == 1:
+        raise ValueError("Invalid PlantUML encoding")
+
+    text = encoded.translate(_TO_BASE64)
+    try:
+        data = base64.b64decode(text + "=" * (-len(text) % 4))
+    except binascii.Error as exc:
+        raise ValueError(f"Invalid PlantUML encoding: {exc}") from exc
+
+    # The encoder pads the last group with zero bytes; raw inflate leaves them in unused_data.
+    inflater = zlib.decompressobj(-15)
+    try:
+        raw = inflater.decompress(data, MAX_DECODED_BYTES)
+    except zlib.error as exc:
+        raise ValueError(f"Invalid PlantUML encoding: {exc}") from exc
+    if inflater.unconsumed_tail:
+        raise ValueError("Decoded diagram is too large")
+    if not inflater.eof:
+        raise ValueError("Invalid PlantUML encoding: truncated data")
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        raise ValueError(f"Decoded diagram is not UTF-8: {exc}") from exc
@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import List, Optional
+
+ERROR = "error"
+WARNING = "warning"
+
+ARROW_GRAMMAR_RE = re.compile(
+    r"^[<>o*#x+^}{|\\/(]{0,3}"
+    r"[-.=~]+(?:\[[^\]]*\])?(?:(?:left|right|up|down|le|ri|do|l|r|u|d)[-.=~]+)?[-.=~]*"
+    r"[<>o*#x+^{}|\\/)]{0,3}$",
+    re.IGNORECASE,
+)
+ARROWISH_RE = re.compile(r"(--|\.\.|->|<-|-\[|[–—→←⇒])")
+UNICODE_ARROW_RE = re.compile(r"[–—→←⇒]")
+QUOTED_RE = re.compile(r'"[^"]*"')
+ENDPOINT = r'(?:"[^"]+"|[\w.$]+|\([^)]+\)|:[^:]+:|\[[^\]]+\])'
+RELATION_RE = re.compile(
+    rf"^\s*(?P<left>{ENDPOINT})\s*(?:\"[^\"]*\"\s*)?(?P<arrow>[^\s\"]+)\s*(?:\"[^\"]*\"\s*)?(?P<right>{ENDPOINT})"
+)
+DECLARATION_RE = re.compile(
+    r"^\s*(?:abstract\s+class|abstract|class|interface|enum|annotation|entity|protocol|struct|exception|metaclass|stereotype|"
+    r"component|actor|usecase|package|namespace|node|folder|frame|cloud|database|rectangle|artifact|card|queue|stack|"
+    r"storage|file|boundary|control|collections|participant|object|state|port|portin|portout|map|json|diamond|circle)\s+"
+    r"(?P<name>\"[^\"]+\"|[\w.$]+)(?:\s+as\s+(?P<alias>\"[^\"]+\"|[\w.$]+))?",
+    re.IGNORECASE,
+)
+# Class-body separators (`--`, `.. title ..`) and members (`-name: int`) look like arrows but are not.
+MEMBER_LINE_RE = re.compile(r"^(--|\.\.|==|__|[+#~]|-\w)")
+
+# Activity (new syntax) blocks: opener pattern -> accepted closers.
+ACTIVITY_BLOCKS = (
+    ("if", re.compile(r"^if\s*\(", re.IGNORECASE), re.compile(r"^end\s*if\b", re.IGNORECASE)),
+    ("while", re.compile(r"^while\s*\(", re.IGNORECASE), re.compile(r"^end\s*while\b", re.IGNORECASE)),
+    ("repeat", re.compile(r"^repeat\s*(:.*)?$", re.IGNORECASE), re.compile(r"^repeat\s*while\b", re.IGNORECASE)),
+    ("fork", re.compile(r"^fork$", re.IGNORECASE), re.compile(r"^end\s*(fork|merge)\b", re.IGNORECASE)),
+    ("split", re.compile(r"^split$", re.IGNORECASE), re.compile(r"^end\s*split\b", re.IGNORECASE)),
+    ("switch", re.compile(r"^switch\s*\(", re.IGNORECASE), re.compile(r"^end\s*switch\b", re.IGNORECASE)),
+)
+SEQUENCE_GROUP_RE = re.compile(r"^(alt|opt|loop|par|par2|break|critical|group)\b", re.IGNORECASE)
+SEQUENCE_END_RE = re.compile(r"^end$", re.IGNORECASE)
+BOX_RE = re.compile(r"^box\b", re.IGNORECASE)
+END_BOX_RE = re.compile(r"^end\s*box\b", re.IGNORECASE)
+NOTE_OPEN_RE = re.compile(r"^[rh]?note\b", re.IGNORECASE)
+NOTE_END_RE = re.compile(r"^end\s*[rh]?note\b", re.IGNORECASE)
+TEXT_BLOCKS = {
+    "legend": re.compile(r"^end\s*legend\b", re.IGNORECASE),
+    "title": re.compile(r"^end\s*title\b", re.IGNORECASE),
+    "header": re.compile(r"^end\s*header\b", re.IGNORECASE),
+    "footer": re.compile(r"^end\s*footer\b", re.IGNORECASE),
+    "ref": re.compile(r"^end\s*ref\b", re.IGNORECASE),
+}
+ACTION_TERMINATORS = (";", "|", "<", ">", "]", "}", "/")
+
+
+class LintIssue:
+    """One diagnostic. `line` is 1-based, matching PlantUML's own error lines."""
+
+    __slots__ = ("line", "severity", "code", "message")
+
+    def __init__(self, line: int, severity: str, code: str, message: str) -> None:
+        self.line = line
+        self.severity = severity
+        self.code = code
+        self.message = message
+
+    def __str__(self) -> str:
+        label = "Error" if self.severity == ERROR else "Warning"
+        return f"{label} line {self.line}: {self.message}"
+
+    def __repr__(self) -> str:
+        return f"LintIssue({self.line}, {self.severity!r}, {self.code!r}, {self.message!r})"
+
+
+def linter_enabled() -> bool:
+    return (os.getenv("PLANTUML_LINTER", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def has_errors(issues: List[LintIssue]) -> bool:
+    return any(issue.severity == ERROR for issue in issues)
+
+
+def format_issues(issues: List[LintIssue]) -> str:
+    """Render issues in the validator's "Error line N" style so the repair loop can parse them."""
+    return "\n".join(str(issue) for issue in issues)
+
+
+def lint_plantuml(plantuml: str, diagram_type: Optional[str] = None) -> List[LintIssue]:
+    """
+    Cheap structural checks for the mistakes LLMs make most often. Only problems
+    PlantUML is certain to reject are errors (missing markers, unbalanced braces,
+    unclosed or stray blocks, unterminated activity actions, non-ASCII arrows);
+    guesses such as odd arrow tokens are warnings. Relationship targets are not
+    checked against declarations, since PlantUML creates undeclared elements on
+    the fly.
+    """
+    kind = (diagram_type or "").lower().replace(" ", "").replace("_", "")
+    issues: List[LintIssue] = []
+    lines = (plantuml or "").splitlines()
+    content = [(idx + 1, ln.strip()) for idx, ln in enumerate(lines) if ln.strip()]
+    if not content:
+        return [LintIssue(1, ERROR, "empty", "diagram is empty")]
+
+    first_no, first = content[0]
+    if not first.lower().startswith("@startuml"):
+        issues.append(LintIssue(first_no, ERROR, "missing-startuml", "diagram must start with @startuml"))
+    end_nos = [no for no, text in content if text.lower().startswith("@enduml")]
+    if not end_nos:
+        issues.append(LintIssue(len(lines) + 1, ERROR, "missing-enduml", "diagram is missing @enduml"))
+    elif end_nos[-1] != content[-1][0]:
+        issues.append(LintIssue(end_nos[-1] + 1, WARNING, "content-after-enduml", "content after @enduml is ignored"))
+
+    brace_stack: List[int] = []
+    block_stack: List[tuple] = []
+    text_block: Optional[re.Pattern] = None
+    action_start: Optional[int] = None
+    in_block_comment = False
+
+    for no, text in content:
+        lower = text.lower()
+        if lower.startswith("@startuml") or lower.startswith("@enduml"):
+            continue
+        if in_block_comment:
+            if "'/" in text:
+                in_block_comment = False
+            continue
+        if text.startswith("/'"):
+            in_block_comment = "'/" not in text[2:]
+            continue
+        if text.startswith("'"):
+            continue
+        if text_block is not None:
+            if text_block.match(text):
+                text_block = None
+            continue
+        if action_start is not None:
+            if text.endswith(ACTION_TERMINATORS):
+                action_start = None
+            continue
+
+        if NOTE_OPEN_RE.match(text) and ":" not in text and not QUOTED_RE.search(text):
+            text_block = NOTE_END_RE
+            continue
+        opener = lower.split(" ", 1)[0]
+        if opener in TEXT_BLOCKS and (opener != "ref" or ":" not in text) and (opener not in ("title", "header", "footer") or lower == opener):
+            text_block = TEXT_BLOCKS[opener]
+            continue
+        if opener in ("skinparam", "!define", "!include", "hide", "show", "left", "top", "scale", "!theme", "allowmixing", "set"):
+            _check_braces(text, no, brace_stack, issues)
+            continue
+
+        if text.startswith(":") and kind in ("", "activity") and not text.endswith(ACTION_TERMINATORS) and not re.match(r"^:[^:]+:\s*$", text):
+            action_start = no
+            continue
+
+        _check_blocks(text, no, kind, block_stack, issues)
+        _check_braces(text, no, brace_stack, issues)
+
+        if DECLARATION_RE.match(text):
+            continue
+        _check_relation(text, no, issues)
+
+    if action_start is not None:
+        issues.append(LintIssue(action_start, ERROR, "unterminated-action", "activity action is missing its terminating ';'"))
+    if text_block is not None:
+        issues.append(LintIssue(len(lines), ERROR, "unclosed-text-block", "note/legend/title block is never closed"))
+    for opened in brace_stack:
+        issues.append(LintIssue(opened, ERROR, "unclosed-brace", "'{' is never closed"))
+    for name, opened in block_stack:
+        closer = {"if": "endif", "while": "endwhile", "repeat": "repeat while", "fork": "end fork", "split": "end split", "switch": "endswitch", "box": "end box"}.get(name, "end")
+        issues.append(LintIssue(opened, ERROR, "unclosed-block", f"'{name}' block is missing '{closer}'"))
+
+    issues.sort(key=lambda issue: (issue.line, issue.severity != ERROR))
+    return issues
+
+
+def _strip_quoted(text: str) -> str:
+    return QUOTED_RE.sub('""', text)
+
+
+def strip_arrows(text: str) -> str:
+    """
+    `text` with quoted strings and relationship arrows removed, for counting
+    block braces: crow's-foot arrows such as `||--o{` and `}|..|{` contain
+    braces that neither open nor close a block.
+    """
+    return " ".join(token for token in _strip_quoted(text).split() if not ARROW_GRAMMAR_RE.match(token))
+
+
+def has_arrow(text: str) -> bool:
+    return any(ARROW_GRAMMAR_RE.match(token) for token in _strip_quoted(text).split())
+
+
+def _check_braces(text: str, no: int, stack: List[int], issues: List[LintIssue]) -> None:
+    for ch in strip_arrows(text):
+        if ch == "{":
+            stack.append(no)
+        elif ch == "}":
+            if stack:
+                stack.pop()
+            else:
+                issues.append(LintIssue(no, ERROR, "unbalanced-brace", "'}' has no matching '{'"))
+
+
+def _check_blocks(text: str, no: int, kind: str, stack: List[tuple], issues: List[LintIssue]) -> None:
+    for name, open_re, close_re in ACTIVITY_BLOCKS:
+        if close_re.match(text):
+            if stack and stack[-1][0] == name:
+                stack.pop()
+            else:
+                issues.append(LintIssue(no, ERROR, "unexpected-close", f"'{text.split('(')[0].strip()}' without a matching '{name}'"))
+            return
+    for name, open_re, _ in ACTIVITY_BLOCKS:
+        if open_re.match(text):
+            stack.append((name, no))
+            return
+    if END_BOX_RE.match(text):
+        if stack and stack[-1][0] == "box":
+            stack.pop()
+        else:
+            issues.append(LintIssue(no, ERROR, "unexpected-close", "'end box' without a matching 'box'"))
+        return
+    if kind == "sequence" and BOX_RE.match(text):
+        stack.append(("box", no))
+        return
+    if SEQUENCE_GROUP_RE.match(text) and kind in ("", "sequence"):
+        stack.append((text.split()[0].lower(), no))
+        return
+    if SEQUENCE_END_RE.match(text):
+        if stack and stack[-1][0] in ("alt", "opt", "loop", "par", "par2", "break", "critical", "group"):
+            stack.pop()
+        elif kind == "sequence":
+            issues.append(LintIssue(no, ERROR, "unexpected-close", "'end' without a matching group (alt/opt/loop/...)"))
+
+
+def _check_relation(text: str, no: int, issues: List[LintIssue]) -> None:
+    if MEMBER_LINE_RE.match(text):
+        return
+    head = _strip_quoted(text).split(" : ", 1)[0]
+    if ":" in head and not head.lstrip().startswith(":"):
+        head = head.split(":", 1)[0]
+    if not ARROWISH_RE.search(head):
+        return
+    if UNICODE_ARROW_RE.search(head):
+        issues.append(LintIssue(no, ERROR, "unicode-arrow", "arrow uses a typographic dash/arrow; use ASCII '-' and '>'"))
+        return
+    match = RELATION_RE.match(text)
+    if not match:
+        return
+    arrow = match.group("arrow")
+    if not ARROW_GRAMMAR_RE.match(arrow):
+        issues.append(LintIssue(no, WARNING, "unknown-arrow", f"unrecognized arrow '{arrow}'"))
+
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import List, Optional, Tuple
+
+from app.util.env import env_int
+from .plantuml_linter import ACTIVITY_BLOCKS, SEQUENCE_END_RE, SEQUENCE_GROUP_RE, strip_arrows
+
+DEFAULT_MIN_LINES = 25
+DEFAULT_MAX_REGION_LINES = 40
+DEFAULT_WINDOW = 3
+SKELETON_MAX_LINES = 60
+REGION_MARKER = "' >>> REGION TO REWRITE <<<"
+
+_FENCE_RE = re.compile(r"^\s*```")
+_MARKER_RE = re.compile(r"^\s*@(startuml|enduml)\b", re.IGNORECASE)
+
+
+def region_repair_enabled() -> bool:
+    return (os.getenv("PLANTUML_REGION_REPAIR", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def region_repair_min_lines() -> int:
+    return env_int("PLANTUML_REGION_REPAIR_MIN_LINES", DEFAULT_MIN_LINES, positive=False)
+
+
+def _block_pairs(lines: List[str]) -> List[Tuple[int, int]]:
+    """(open, close) line indices for brace blocks, activity blocks and sequence groups."""
+    pairs: List[Tuple[int, int]] = []
+    braces: List[int] = []
+    blocks: List[Tuple[str, int]] = []
+    for idx, raw in enumerate(lines):
+        text = raw.strip()
+        if not text or text.startswith("'"):
+            continue
+        closed = False
+        for name, open_re, close_re in ACTIVITY_BLOCKS:
+            if close_re.match(text):
+                if blocks and blocks[-1][0] == name:
+                    pairs.append((blocks.pop()[1], idx))
+                closed = True
+                break
+            if open_re.match(text):
+                blocks.append((name, idx))
+                closed = True
+                break
+        if not closed:
+            if SEQUENCE_GROUP_RE.match(text):
+                blocks.append(("group", idx))
+            elif SEQUENCE_END_RE.match(text) and blocks and blocks[-1][0] == "group":
+                pairs.append((blocks.pop()[1], idx))
+        for ch in strip_arrows(text):
+            if ch == "{":
+                braces.append(idx)
+            elif ch == "}" and braces:
+                pairs.append((braces.pop(), idx))
+    return pairs
+
+
+def find_region(plantuml: str, error_line: int, max_lines: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    """
+    0-based inclusive (start, end) of the innermost block containing the 1-based
+    `error_line`, or a small window around it when no block fits within
+    `max_lines`. Returns None when the line is outside the diagram body.
+    """
+    lines = plantuml.splitlines()
+    max_lines = max_lines or DEFAULT_MAX_REGION_LINES
+    err = error_line - 1
+    if err < 0 or err >= len(lines) or _MARKER_RE.match(lines[err]):
+        return None
+    containing = [(s, e) for s, e in _block_pairs(lines) if s <= err <= e and e - s + 1 <= max_lines]
+    if containing:
+        return min(containing, key=lambda pair: pair[1] - pair[0])
+    start, end = max(err - DEFAULT_WINDOW, 0), min(err + DEFAULT_WINDOW, len(lines) - 1)
+    while start < err and _MARKER_RE.match(lines[start]):
+        start += 1
+    while end > err and _MARKER_RE.match(lines[end]):
+        end -= 1
+    return start, end
+
+
+def skeleton(plantuml: str, start: int, end: int, max_lines: int = SKELETON_MAX_LINES) -> str:
+    """
+    The diagram outside the region, with block bodies collapsed to `...` and
+    the region replaced by REGION_MARKER, trimmed to the lines nearest the
+    region so the model sees the surrounding names without re-reading them all.
+    """
+    lines = plantuml.splitlines()
+    out: List[Tuple[int, str]] = []
+    depth = 0
+    for idx, line in enumerate(lines):
+        if start <= idx <= end:
+            if idx == start:
+                out.append((idx, REGION_MARKER))
+            continue
+        text = strip_arrows(line)
+        opens, closes = text.count("{"), text.count("}")
+        if depth == 0 or (depth == 1 and closes > opens):
+            out.append((idx, line))
+        elif not out or out[-1][1].strip() != "...":
+            out.append((idx, "  ..."))
+        depth = max(depth + opens - closes, 0)
+    if len(out) > max_lines:
+        marker_pos = next(i for i, (idx, _) in enumerate(out) if idx == start)
+        lo = max(0, min(marker_pos - max_lines // 2, len(out) - max_lines))
+        kept = out[lo:lo + max_lines]
+        if lo > 0:
+            kept.insert(0, (-1, f"' ... {lo} lines omitted"))
+        if lo + max_lines < len(out):
+            kept.append((-1, f"' ... {len(out) - lo - max_lines} lines omitted"))
+        out = kept
+    return "\n".join(line for _, line in out)
+
+
+def extract_region_reply(reply: str) -> str:
+    """Strip fences and any @startuml/@enduml wrapper the model added around the region."""
+    return "\n".join(
+        line for line in (reply or "").splitlines() if not _FENCE_RE.match(line) and not _MARKER_RE.match(line)
+    ).strip("\n")
+
+
+def splice(plantuml: str, start: int, end: int, replacement: str) -> str:
+    lines = plantuml.splitlines()
+    return "\n".join(lines[:start] + replacement.splitlines() + lines[end + 1:])
@@ -0,0 +1,451 @@
+from __future__ import annotations
+
+import os
+import re
+import atexit
+import hashlib
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.util.env import env_number
+from .plantuml_worker import PlantUMLWorkerError, is_single_diagram, security_profile_arg
+
+DATA_DIR_DEFAULT = "/var/lib/nl2uml"
+PIPE_DELIMITER = "___NL2UML_PLANTUML_RENDERED___"
+FORMATS = {"svg": "image/svg+xml", "png": "image/png"}
+DEFAULT_RENDER_WORKERS = 1
+DEFAULT_HEAP = "512m"
+DEFAULT_TIMEOUT_SECONDS = 60.0
+DEFAULT_STARTUP_SECONDS = 30.0
+DEFAULT_MAX_RENDERS = 500
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_THUMBNAIL_WIDTH = 240
+KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_BLOCK_RE = re.compile(r"^\s*@startuml\b.*?^\s*@enduml\b[^\n]*", re.IGNORECASE | re.MULTILINE | re.DOTALL)
+_MARKER_RE = re.compile(r"^\s*@(start|end)\w*", re.IGNORECASE | re.MULTILINE)
+
+
+class PlantUMLRenderError(RuntimeError):
+    """Rendering failed; the message is safe to return to the caller."""
+
+
+def renderer_enabled() -> bool:
+    return (os.getenv("PLANTUML_RENDER", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def normalize_format(fmt: Optional[str]) -> str:
+    fmt = (fmt or "svg").strip().lower().lstrip(".")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}' (expected one of: {', '.join(FORMATS)})")
+    return fmt
+
+
+def single_diagram(plantuml: str) -> str:
+    """
+    The text a resident pipe process can take: exactly one @startuml ... @enduml
+    block. Bare bodies are wrapped and, like the public server, only the first
+    block of a multi-diagram text is rendered.
+    """
+    text = (plantuml or "").strip()
+    if is_single_diagram(text):
+        return text
+    if not _MARKER_RE.search(text):
+        return f"@startuml\n{text}\n@enduml"
+    match = _BLOCK_RE.search(text)
+    if not match:
+        raise ValueError("Diagram has no complete @startuml ... @enduml block")
+    return match.group(0).strip()
+
+
+def thumbnail_source(plantuml: str, width: Optional[int] = None) -> str:
+    """The diagram with a `scale max <width> width` directive, rendered as its PNG thumbnail."""
+    width = int(width or env_number("PLANTUML_THUMBNAIL_WIDTH", DEFAULT_THUMBNAIL_WIDTH))
+    lines = single_diagram(plantuml).splitlines()
+    return "\n".join([lines[0], f"scale max {width} width"] + lines[1:])
+
+
+@dataclass
+class RenderResult:
+    key: str
+    fmt: str
+    data: bytes
+    cached: bool
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.fmt]
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.key}"'
+
+
+class RenderProcess:
+    """
+    One long-lived `java -jar plantuml.jar -pipe -t<fmt>` process.
+
+    Output is binary (PNG) so stdout is read in raw chunks by a reader thread and
+    split on the pipe delimiter PlantUML prints after each image. A timed-out or
+    crashed process is killed and restarted on next use, and processes are
+    recycled after `max_renders` images to bound JVM heap growth.
+    """
+
+    def __init__(self, java_cmd: str, jar_path: str, fmt: str, heap: str, timeout_seconds: float, max_renders: int) -> None:
+        self.java_cmd = java_cmd
+        self.jar_path = jar_path
+        self.fmt = fmt
+        self.heap = heap
+        self.timeout_seconds = timeout_seconds
+        self.max_renders = max_renders
+        self._proc: Optional[subprocess.Popen] = None
+        self._chunks: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._renders = 0
+        self.starts = 0
+
+    def _start(self) -> None:
+        cmd = [
+            self.java_cmd,
+            f"-Xmx{self.heap}",
+            "-Djava.awt.headless=true",
+            security_profile_arg(),
+            "-jar",
+            self.jar_path,
+            "-charset",
+            "UTF-8",
+            "-pipe",
+            f"-t{self.fmt}",
+            "-pipedelimitor",
+            PIPE_DELIMITER,
+        ]
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        except OSError as exc:
+            raise PlantUMLWorkerError(f"unable to start PlantUML renderer: {exc}") from exc
+        self._proc = proc
+        self.starts += 1
+        self._chunks = queue.Queue()
+        self._renders = 0
+        threading.Thread(target=self._pump, args=(proc, self._chunks), name="plantuml-render-reader", daemon=True).start()
+        print(f"[plantuml-render] started pid={proc.pid} format={self.fmt} heap={self.heap}")
+
+    @staticmethod
+    def _pump(proc: subprocess.Popen, chunks: "queue.Queue[Optional[bytes]]") -> None:
+        try:
+            while True:
+                chunk = proc.stdout.read(65536)
+                if not chunk:
+                    break
+                chunks.put(chunk)
+        except (OSError, ValueError):
+            pass
+        finally:
+            chunks.put(None)
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def render(self, plantuml: str) -> bytes:
+        if not self.alive() or self._renders >= self.max_renders:
+            self.close()
+            self._start()
+        startup = self._renders == 0
+        self._renders += 1
+        try:
+            self._proc.stdin.write((plantuml.rstrip("\n") + "\n").encode("utf-8"))
+            self._proc.stdin.flush()
+        except (OSError, ValueError) as exc:
+            self.close()
+            raise PlantUMLWorkerError(f"PlantUML renderer stdin closed: {exc}") from exc
+
+        marker = PIPE_DELIMITER.encode("ascii")
+        deadline = time.monotonic() + self.timeout_seconds + (env_number("PLANTUML_WORKER_STARTUP_SECONDS", DEFAULT_STARTUP_SECONDS) if startup else 0.0)
+        buf = bytearray()
+        while True:
+            # The delimiter is printed on its own line right after the image bytes.
+            end = buf.find(marker)
+            if end >= 0 and buf.find(b"\n", end + len(marker)) >= 0:
+                return bytes(buf[:end])
+            remaining = deadline - time.monotonic()
+            try:
+                chunk = self._chunks.get(timeout=max(remaining, 0.0)) if remaining > 0 else self._chunks.get_nowait()
+            except queue.Empty:
+                self.close()
+                raise TimeoutError(f"PlantUML rendering timed out after {self.timeout_seconds:.0f}s")
+            if chunk is None:
+                self.close()
+                raise PlantUMLWorkerError("PlantUML renderer exited while rendering")
+            buf.extend(chunk)
+
+
+class RenderCache:
+    """
+    Content-addressed image store under DATA_DIR/diagrams.
+
+    Files live at `<key[:2]>/<key>.<fmt>` where the key hashes the format, the
+    PlantUML build and the diagram text, so an entry never changes once written
+    and can be served with a strong ETag and immutable cache headers. Hits touch
+    the file's mtime; when the directory grows past its byte budget the least
+    recently used files are removed until it is back under 90% of the budget.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None) -> None:
+        self.root = root or os.getenv("RENDER_CACHE_DIR") or os.path.join(os.getenv("DATA_DIR", DATA_DIR_DEFAULT), "diagrams")
+        self.max_bytes = int(max_bytes or env_number("RENDER_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.{fmt}")
+
+    def get(self, key: str, fmt: str) -> Optional[bytes]:
+        path = self.path(key, fmt)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+        with self._lock:
+            self._counters["hits"] += 1
+        return data
+
+    def put(self, key: str, fmt: str, data: bytes) -> None:
+        path = self.path(key, fmt)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename so concurrent readers never see a partial image.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            print(f"[plantuml-render] failed to cache {key}.{fmt}: {exc}")
+            return
+        with self._lock:
+            self._counters["stores"] += 1
+            if self._total is None:
+                self._total = self._scan_size()
+            else:
+                self._total += len(data)
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def _files(self) -> List[Tuple[float, int, str]]:
+        out: List[Tuple[float, int, str]] = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self) -> None:
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._total = total
+            self._counters["evictions"] += removed
+        if removed:
+            print(f"[plantuml-render] evicted {removed} cached images, {total} bytes kept")
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._counters)
+            out["bytes"] = self._total
+        lookups = out["hits"] + out["misses"]
+        out["hitRate"] = round(out["hits"] / lookups, 3) if lookups else 0.0
+        out["maxBytes"] = self.max_bytes
+        out["root"] = self.root
+        return out
+
+
+class PlantUMLRenderer:
+    """
+    Renders PlantUML to SVG/PNG through resident pipe processes (a small pool per
+    format) in front of the content-addressed RenderCache. A crashed process is
+    retried once on a fresh JVM, then rendering falls back to a one-shot
+    `java -jar -pipe` call.
+    """
+
+    def __init__(self, jar_path: Optional[str] = None, java_cmd: Optional[str] = None, cache: Optional[RenderCache] = None) -> None:
+        self.jar_path = jar_path or os.getenv("PLANTUML_JAR_PATH") or os.getenv("PLANTUML_JAR")
+        self.java_cmd = java_cmd or os.getenv("PLANTUML_JAVA_CMD", "java")
+        self.cache = cache or RenderCache()
+        self.size = int(env_number("PLANTUML_RENDER_WORKERS", DEFAULT_RENDER_WORKERS))
+        self.heap = os.getenv("PLANTUML_RENDER_HEAP") or DEFAULT_HEAP
+        self.timeout_seconds = env_number("PLANTUML_RENDER_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)
+        self.max_renders = int(env_number("PLANTUML_RENDER_MAX_RENDERS", DEFAULT_MAX_RENDERS))
+        self._pools: Dict[str, "queue.Queue[RenderProcess]"] = {}
+        self._processes: List[RenderProcess] = []
+        self._lock = threading.Lock()
+        self._fingerprint: Optional[str] = None
+        self._counters = {"renders": 0, "timeouts": 0, "crashes": 0, "oneShot": 0, "totalSeconds": 0.0}
+
+    def is_available(self) -> bool:
+        return bool(self.jar_path) and os.path.exists(self.jar_path) and shutil.which(self.java_cmd) is not None
+
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            try:
+                st = os.stat(self.jar_path)
+                self._fingerprint = f"{self.jar_path}:{st.st_size}:{int(st.st_mtime)}"
+            except (OSError, TypeError):
+                self._fingerprint = self.jar_path or ""
+        return self._fingerprint
+
+    def cache_key(self, plantuml: str, fmt: str) -> str:
+        payload = f"{fmt}\n{self.fingerprint()}\n{single_diagram(plantuml)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cached(self, key: str, fmt: str) -> Optional[RenderResult]:
+        """Look up an earlier render by key only (the `/render/<key>.<fmt>` URL)."""
+        if not KEY_RE.match(key or ""):
+            return None
+        data = self.cache.get(key, fmt)
+        return RenderResult(key, fmt, data, True) if data is not None else None
+
+    def render(self, plantuml: str, fmt: str = "svg") -> RenderResult:
+        fmt = normalize_format(fmt)
+        text = single_diagram(plantuml)
+        key = self.cache_key(text, fmt)
+        data = self.cache.get(key, fmt)
+        if data is not None:
+            return RenderResult(key, fmt, data, True)
+        if not self.is_available():
+            raise NotImplementedError("PlantUML renderer is not available (set PLANTUML_JAR_PATH)")
+
+        started = time.perf_counter()
+        try:
+            data = self._render_resident(text, fmt)
+        finally:
+            with self._lock:
+                self._counters["renders"] += 1
+                self._counters["totalSeconds"] += time.perf_counter() - started
+        if not data:
+            raise PlantUMLRenderError("PlantUML produced no output")
+        self.cache.put(key, fmt, data)
+        return RenderResult(key, fmt, data, False)
+
+    def _pool(self, fmt: str) -> "queue.Queue[RenderProcess]":
+        with self._lock:
+            pool = self._pools.get(fmt)
+            if pool is None:
+                pool = self._pools[fmt] = queue.Queue()
+                for _ in range(self.size):
+                    proc = RenderProcess(self.java_cmd, self.jar_path, fmt, self.heap, self.timeout_seconds, self.max_renders)
+                    self._processes.append(proc)
+                    pool.put(proc)
+            return pool
+
+    def _render_resident(self, text: str, fmt: str) -> bytes:
+        pool = self._pool(fmt)
+        proc = pool.get()
+        try:
+            for attempt in (1, 2):
+                try:
+                    return proc.render(text)
+                except PlantUMLWorkerError as exc:
+                    with self._lock:
+                        self._counters["crashes"] += 1
+                    if attempt == 2:
+                        print(f"[plantuml-render] resident renderer failed ({exc}); using one-shot java")
+                except TimeoutError as exc:
+                    with self._lock:
+                        self._counters["timeouts"] += 1
+                    raise PlantUMLRenderError(str(exc)) from exc
+        finally:
+            pool.put(proc)
+        return self._render_once(text, fmt)
+
+    def _render_once(self, text: str, fmt: str) -> bytes:
+        with self._lock:
+            self._counters["oneShot"] += 1
+        cmd = [self.java_cmd, "-Djava.awt.headless=true", security_profile_arg(), "-jar", self.jar_path, "-charset", "UTF-8", "-pipe", f"-t{fmt}"]
+        try:
+            proc = subprocess.run(cmd, input=text.encode("utf-8"), capture_output=True, timeout=self.timeout_seconds)
+        except subprocess.TimeoutExpired as exc:
+            raise PlantUMLRenderError(f"PlantUML rendering timed out after {self.timeout_seconds:.0f}s") from exc
+        except OSError as exc:
+            raise PlantUMLRenderError(f"Unable to run PlantUML: {exc}") from exc
+        return proc.stdout
+
+    def close(self) -> None:
+        with self._lock:
+            processes = list(self._processes)
+        for proc in processes:
+            proc.close()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._counters)
+            processes = list(self._processes)
+        renders = out["renders"] or 0
+        out["avgSeconds"] = round(out.pop("totalSeconds") / renders, 4) if renders else 0.0
+        out["alive"] = sum(1 for p in processes if p.alive())
+        out["restarts"] = sum(max(p.starts - 1, 0) for p in processes)
+        out["cache"] = self.cache.stats()
+        return out
+
+
+_RENDERER: Optional[PlantUMLRenderer] = None
+_RENDERER_LOCK = threading.Lock()
+
+
+def get_renderer() -> Optional[PlantUMLRenderer]:
+    """Process-wide renderer, or None when PLANTUML_RENDER is off."""
+    global _RENDERER
+    if not renderer_enabled():
+        return None
+    if _RENDERER is None:
+        with _RENDERER_LOCK:
+            if _RENDERER is None:
+                _RENDERER = PlantUMLRenderer()
+    return _RENDERER
+
+
+def render_stats() -> Dict[str, object]:
+    return _RENDERER.stats() if _RENDERER is not None else {"enabled": renderer_enabled()}
+
+
+@atexit.register
+def _shutdown_renderer() -> None:
+    if _RENDERER is not None:
+        _RENDERER.close()
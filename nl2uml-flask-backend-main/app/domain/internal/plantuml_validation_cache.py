@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import os
+import re
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.util.env import env_int
+
+DEFAULT_CACHE_SIZE = 1024
+
+def _strip_block_comments(lines: List[str]) -> List[str]:
+    """
+    Drop `/' ... '/` comments the way PlantUML reads them: only when `/'` starts
+    a line, up to a line ending in `'/`. Anything else (e.g. `/'` inside a
+    quoted label) stays, as does a comment that is never closed.
+    """
+    out: List[str] = []
+    pending: Optional[List[str]] = None
+    for line in lines:
+        if pending is None:
+            stripped = line.lstrip()
+            if not stripped.startswith("/'"):
+                out.append(line)
+                continue
+            pending = []
+            rest = stripped[2:]
+        else:
+            rest = line
+        pending.append(line)
+        if "'/" in rest:
+            # Text after the closing '/ is kept as written, comment included.
+            if rest.split("'/", 1)[1].strip():
+                out.extend(pending)
+            pending = None
+    return out + (pending or [])
+
+
+def normalize_plantuml(plantuml: str) -> str:
+    """
+    Canonical form for cache keys: block and single-quote line comments removed,
+    whitespace runs collapsed and blank lines dropped. Case is kept because
+    PlantUML identifiers are case-sensitive.
+    """
+    lines = []
+    for line in _strip_block_comments((plantuml or "").splitlines()):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("'"):
+            continue
+        lines.append(re.sub(r"\s+", " ", stripped))
+    return "\n".join(lines)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ValidationStore(ABC):
+    """Persistence behind the validation cache; the SQLite one lives in infrastructure and is wired by bootstrap."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[bool, str, str]]:
+        """(is_valid, output, raw_hash) stored under `key`, or None."""
+
+    @abstractmethod
+    def put(self, key: str, raw_hash: str, is_valid: bool, output: str) -> None:
+        """Store a result; failures are logged, not raised."""
+
+
+class ValidationCache:
+    """
+    Bounded LRU of PlantUML validation results, optionally backed by a ValidationStore.
+
+    Entries are keyed by the hash of the normalized text plus a fingerprint of
+    the validator (jar path, size and mtime), so upgrading PlantUML invalidates
+    them. Failures carry line numbers that only hold for the exact text that was
+    checked, so a failed result is reused only when the raw text matches too;
+    successes are reused for any text that normalizes to the same form.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, store: Optional[ValidationStore] = None) -> None:
+        self.max_entries = max(int(max_entries or env_int("PLANTUML_VALIDATION_CACHE_SIZE", DEFAULT_CACHE_SIZE)), 1)
+        self.store = store
+        self._entries: "OrderedDict[str, Tuple[bool, str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0}
+
+    @staticmethod
+    def _keys(plantuml: str, fingerprint: str) -> Tuple[str, str]:
+        return _sha256(f"{fingerprint}\n{normalize_plantuml(plantuml)}"), _sha256(plantuml)
+
+    def get(self, plantuml: str, fingerprint: str = "") -> Optional[Tuple[bool, str]]:
+        key, raw_hash = self._keys(plantuml, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        store = self.store
+        if entry is None and store is not None:
+            entry = store.get(key)
+            if entry is not None:
+                with self._lock:
+                    self._remember(key, entry)
+        usable = entry is not None and (entry[0] or entry[2] == raw_hash)
+        with self._lock:
+            self._counters["hits" if usable else "misses"] += 1
+        return (entry[0], entry[1]) if usable else None
+
+    def put(self, plantuml: str, is_valid: bool, output: str, fingerprint: str = "") -> None:
+        key, raw_hash = self._keys(plantuml, fingerprint)
+        entry = (bool(is_valid), output or "", raw_hash)
+        with self._lock:
+            self._remember(key, entry)
+            self._counters["stores"] += 1
+        store = self.store
+        if store is not None:
+            store.put(key, raw_hash, entry[0], entry[1])
+
+    def _remember(self, key: str, entry: Tuple[bool, str, str]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._counters)
+            out["entries"] = len(self._entries)
+        lookups = out["hits"] + out["misses"]
+        out["hitRate"] = round(out["hits"] / lookups, 3) if lookups else 0.0
+        out["persistent"] = self.store is not None
+        return out
+
+
+_CACHE: Optional[ValidationCache] = None
+_CACHE_LOCK = threading.Lock()
+_STORE: Optional[ValidationStore] = None
+
+
+def validation_cache_enabled() -> bool:
+    return (os.getenv("PLANTUML_VALIDATION_CACHE", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def get_validation_cache() -> Optional[ValidationCache]:
+    """Process-wide cache shared by every PlantUMLValidator, or None when disabled."""
+    global _CACHE
+    if not validation_cache_enabled():
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = ValidationCache(store=_STORE)
+    return _CACHE
+
+
+def configure_validation_store(store: Optional[ValidationStore]) -> None:
+    """Persist the process-wide cache through `store` (called by bootstrap)."""
+    global _STORE
+    with _CACHE_LOCK:
+        _STORE = store
+        if _CACHE is not None:
+            _CACHE.store = store
+
+
+def validation_cache_stats() -> Dict[str, object]:
+    return _CACHE.stats() if _CACHE is not None else {"enabled": validation_cache_enabled()}
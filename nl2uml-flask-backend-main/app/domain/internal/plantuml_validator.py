@@ -4,18 +4,25 @@ import os
 import shutil
 import subprocess
 import tempfile
-from typing import Tuple
+from typing import Optional, Tuple
+
+from .plantuml_validation_cache import get_validation_cache
+from .plantuml_worker import PlantUMLWorkerError, get_worker_pool, is_single_diagram, security_profile_arg, worker_enabled
 
 
 class PlantUMLValidator:
     """
     Validates PlantUML diagrams using the official PlantUML jar when available.
     Provide PLANTUML_JAR_PATH (or PLANTUML_JAR) to enable validation.
+    Single diagrams go through a pool of persistent PlantUML processes
+    (see plantuml_worker); PLANTUML_WORKER=0 restores one `java -jar -check` per call.
     """
 
-    def __init__(self, jar_path: str | None = None, java_cmd: str | None = None):
+    def __init__(self, jar_path: str | None = None, java_cmd: str | None = None, use_worker: bool | None = None):
         self.jar_path = jar_path or os.getenv("PLANTUML_JAR_PATH") or os.getenv("PLANTUML_JAR")
         self.java_cmd = java_cmd or os.getenv("PLANTUML_JAVA_CMD", "java")
+        self.use_worker = worker_enabled() if use_worker is None else use_worker
+        self._fingerprint: str | None = None
 
     def is_available(self) -> bool:
         if not self.jar_path:
@@ -24,22 +31,57 @@ class PlantUMLValidator:
             return False
         return shutil.which(self.java_cmd) is not None
 
-    def validate(self, plantuml: str) -> Tuple[bool, str]:
+    def validate(self, plantuml: str) -> Tuple[Optional[bool], str]:
         """
         Returns (is_valid, output). When PlantUML jar is unavailable, returns (True, "").
+        is_valid is None when the check timed out, which says nothing about the diagram.
         """
         if not self.is_available():
             return True, ""
         if not plantuml.strip():
             return False, "PlantUML diagram is empty."
 
+        cache = get_validation_cache()
+        if cache is not None:
+            cached = cache.get(plantuml, self.fingerprint())
+            if cached is not None:
+                print("[plantuml-cache] reusing validation result")
+                return cached
+
+        if self.use_worker and is_single_diagram(plantuml):
+            try:
+                result = get_worker_pool(self.java_cmd, self.jar_path).check(plantuml)
+            except PlantUMLWorkerError as exc:
+                print(f"[plantuml-worker] {exc}; falling back to -check")
+                result = self._validate_with_check(plantuml)
+            except TimeoutError as exc:
+                # Timeouts may be load-related: not a verdict, so never cached or repaired.
+                return None, str(exc)
+        else:
+            result = self._validate_with_check(plantuml)
+
+        if cache is not None and self.is_available():
+            cache.put(plantuml, result[0], result[1], self.fingerprint())
+        return result
+
+    def fingerprint(self) -> str:
+        """Identifies the PlantUML build so cached results are dropped when the jar changes."""
+        if self._fingerprint is None:
+            try:
+                st = os.stat(self.jar_path)
+                self._fingerprint = f"{self.jar_path}:{st.st_size}:{int(st.st_mtime)}"
+            except OSError:
+                self._fingerprint = self.jar_path or ""
+        return self._fingerprint
+
+    def _validate_with_check(self, plantuml: str) -> Tuple[bool, str]:
         tmp_path = None
         try:
             with tempfile.NamedTemporaryFile("w", delete=False, suffix=".puml") as tmp:
                 tmp.write(plantuml)
                 tmp_path = tmp.name
 
-            cmd = [self.java_cmd, "-jar", self.jar_path, "-check", tmp_path]
+            cmd = [self.java_cmd, security_profile_arg(), "-jar", self.jar_path, "-check", tmp_path]
             proc = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
             output = (proc.stdout or "") + (proc.stderr or "")
             return proc.returncode == 0, output.strip()
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import os
+import re
+import atexit
+import queue
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.util.env import env_number
+
+PIPE_DELIMITER = "___NL2UML_PLANTUML_DONE___"
+DEFAULT_WORKERS = 2
+DEFAULT_HEAP = "256m"
+DEFAULT_TIMEOUT_SECONDS = 30.0
+DEFAULT_STARTUP_SECONDS = 30.0
+DEFAULT_MAX_CHECKS = 500
+DEFAULT_SECURITY_PROFILE = "SANDBOX"
+
+_MARKER_RE = re.compile(r"^\s*@(start|end)\w*", re.IGNORECASE)
+
+
+class PlantUMLWorkerError(RuntimeError):
+    """The worker process died or could not be started; callers fall back to `java -jar -check`."""
+
+
+def worker_enabled() -> bool:
+    return (os.getenv("PLANTUML_WORKER", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def is_single_diagram(plantuml: str) -> bool:
+    """
+    Pipe mode splits its input on @enduml, so only text holding exactly one
+    @startuml ... @enduml block can be sent; anything else would stall the worker
+    or be reported against the wrong diagram.
+    """
+    markers = [m.group(0).strip().lower() for m in (_MARKER_RE.match(line) for line in plantuml.splitlines()) if m]
+    return markers == ["@startuml", "@enduml"]
+
+
+def security_profile_arg() -> str:
+    """
+    JVM flag for PlantUML's security profile. Diagram sources come from
+    unauthenticated requests, so every JVM we start defaults to SANDBOX, which
+    blocks `!include` of local files and `!includeurl`. PLANTUML_SECURITY_PROFILE
+    can relax it (INTERNET allows public URLs); never use LEGACY here.
+    """
+    profile = (os.getenv("PLANTUML_SECURITY_PROFILE") or DEFAULT_SECURITY_PROFILE).strip().upper()
+    return f"-DPLANTUML_SECURITY_PROFILE={profile}"
+
+
+class PlantUMLWorker:
+    """
+    One long-lived `java -jar plantuml.jar -pipe -syntax` process.
+
+    Diagrams are written to stdin and the syntax report is read back up to the
+    pipe delimiter, so the JVM starts once instead of per validation and nothing
+    touches the filesystem. A reader thread feeds stdout into a queue so reads can
+    time out; a timed-out or crashed process is killed and restarted on next use.
+    """
+
+    def __init__(self, java_cmd: str, jar_path: str, heap: str, timeout_seconds: float, max_checks: int) -> None:
+        self.java_cmd = java_cmd
+        self.jar_path = jar_path
+        self.heap = heap
+        self.timeout_seconds = timeout_seconds
+        self.max_checks = max_checks
+        self._proc: Optional[subprocess.Popen] = None
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._checks = 0
+        self.starts = 0
+
+    def _start(self) -> None:
+        cmd = [
+            self.java_cmd,
+            f"-Xmx{self.heap}",
+            "-Djava.awt.headless=true",
+            security_profile_arg(),
+            "-jar",
+            self.jar_path,
+            "-charset",
+            "UTF-8",
+            "-pipe",
+            "-syntax",
+            "-pipedelimitor",
+            PIPE_DELIMITER,
+        ]
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                encoding="utf-8",
+                bufsize=1,
+            )
+        except OSError as exc:
+            raise PlantUMLWorkerError(f"unable to start PlantUML worker: {exc}") from exc
+        self._proc = proc
+        self.starts += 1
+        self._lines = queue.Queue()
+        self._checks = 0
+        threading.Thread(target=self._pump, args=(proc, self._lines), name="plantuml-worker-reader", daemon=True).start()
+        print(f"[plantuml-worker] started pid={proc.pid} heap={self.heap}")
+
+    @staticmethod
+    def _pump(proc: subprocess.Popen, lines: "queue.Queue[Optional[str]]") -> None:
+        try:
+            for line in proc.stdout:
+                lines.put(line.rstrip("\r\n"))
+        except (OSError, ValueError):
+            pass
+        finally:
+            lines.put(None)
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def check(self, plantuml: str) -> Tuple[bool, str]:
+        if not self.alive() or self._checks >= self.max_checks:
+            self.close()
+            self._start()
+        startup = self._checks == 0
+        self._checks += 1
+        try:
+            self._proc.stdin.write(plantuml.rstrip("\n") + "\n")
+            self._proc.stdin.flush()
+        except (OSError, ValueError) as exc:
+            self.close()
+            raise PlantUMLWorkerError(f"PlantUML worker stdin closed: {exc}") from exc
+
+        # The first diagram also pays for JVM startup.
+        deadline = time.monotonic() + self.timeout_seconds + (env_number("PLANTUML_WORKER_STARTUP_SECONDS", DEFAULT_STARTUP_SECONDS) if startup else 0.0)
+        report: List[str] = []
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                line = self._lines.get(timeout=max(remaining, 0.0)) if remaining > 0 else self._lines.get_nowait()
+            except queue.Empty:
+                self.close()
+                raise TimeoutError(f"PlantUML validation timed out after {self.timeout_seconds:.0f}s")
+            if line is None:
+                self.close()
+                raise PlantUMLWorkerError("PlantUML worker exited while validating")
+            if line == PIPE_DELIMITER:
+                break
+            report.append(line)
+        return _parse_syntax_report(report)
+
+
+def _parse_syntax_report(report: List[str]) -> Tuple[bool, str]:
+    """
+    `-syntax` prints either a warning line plus the diagram description, or
+    ERROR, the (0-based) line position and the error messages. Errors are
+    reshaped into the `-check` wording ("Error line N ...") the repair loop parses.
+    """
+    lines = [ln for ln in report if ln.strip()]
+    if not lines or lines[0].strip().upper() != "ERROR":
+        return True, "\n".join(lines)
+    position = lines[1].strip() if len(lines) > 1 else ""
+    messages = "; ".join(ln.strip() for ln in lines[2:]) or "Syntax Error?"
+    if position.isdigit():
+        return False, f"Error line {int(position) + 1} in diagram: {messages}"
+    return False, f"Error in diagram: {messages}"
+
+
+class PlantUMLWorkerPool:
+    """A fixed number of workers handed out one validation at a time."""
+
+    def __init__(self, java_cmd: str, jar_path: str, size: Optional[int] = None) -> None:
+        self.size = int(size or env_number("PLANTUML_WORKERS", DEFAULT_WORKERS))
+        heap = os.getenv("PLANTUML_WORKER_HEAP") or DEFAULT_HEAP
+        timeout_seconds = env_number("PLANTUML_WORKER_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)
+        max_checks = int(env_number("PLANTUML_WORKER_MAX_CHECKS", DEFAULT_MAX_CHECKS))
+        self._workers = [PlantUMLWorker(java_cmd, jar_path, heap, timeout_seconds, max_checks) for _ in range(self.size)]
+        self._idle: "queue.Queue[PlantUMLWorker]" = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        self._lock = threading.Lock()
+        self._counters = {"checks": 0, "timeouts": 0, "crashes": 0, "totalSeconds": 0.0}
+
+    def check(self, plantuml: str) -> Tuple[bool, str]:
+        """
+        Validate on an idle worker; a crash is retried once on a fresh process before
+        giving up. Raises TimeoutError when the diagram exceeds the worker timeout.
+        """
+        worker = self._idle.get()
+        started = time.perf_counter()
+        try:
+            for attempt in (1, 2):
+                try:
+                    return worker.check(plantuml)
+                except PlantUMLWorkerError:
+                    with self._lock:
+                        self._counters["crashes"] += 1
+                    if attempt == 2:
+                        raise
+                except TimeoutError:
+                    with self._lock:
+                        self._counters["timeouts"] += 1
+                    raise
+        finally:
+            with self._lock:
+                self._counters["checks"] += 1
+                self._counters["totalSeconds"] += time.perf_counter() - started
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.close()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._counters)
+        checks = out["checks"] or 0
+        out["avgSeconds"] = round(out.pop("totalSeconds") / checks, 4) if checks else 0.0
+        out["workers"] = self.size
+        out["alive"] = sum(1 for w in self._workers if w.alive())
+        out["restarts"] = sum(max(w.starts - 1, 0) for w in self._workers)
+        return out
+
+
+_POOLS: Dict[Tuple[str, str], PlantUMLWorkerPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_worker_pool(java_cmd: str, jar_path: str) -> PlantUMLWorkerPool:
+    key = (java_cmd, jar_path)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = PlantUMLWorkerPool(java_cmd, jar_path)
+        return pool
+
+
+def worker_stats() -> Dict[str, object]:
+    with _POOLS_LOCK:
+        items = list(_POOLS.items())
+    return {jar: pool.stats() for (_, jar), pool in items}
+
+
+@atexit.register
+def _shutdown_pools() -> None:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        pool.close()
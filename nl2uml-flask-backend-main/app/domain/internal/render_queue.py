@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from .plantuml_renderer import PlantUMLRenderer, get_renderer, thumbnail_source
+from app.util.env import env_number
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_THREADS = 1
+
+
+def prerender_enabled() -> bool:
+    return (os.getenv("PLANTUML_PRERENDER", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def thumbnails_enabled() -> bool:
+    return (os.getenv("PLANTUML_PRERENDER_THUMBNAIL", "0").lower() in ("1", "true", "yes", "on"))
+
+
+class PreRenderQueue:
+    """
+    Renders diagrams into the render cache in the background as soon as they are
+    saved, so the browser's first request for the image is a cache hit.
+
+    Jobs are keyed by the SVG cache key; a diagram already queued or in flight is
+    not queued again, and one already in the cache costs only a file read. The
+    queue is bounded and `submit` never blocks: when it is full the job is dropped
+    and the image is rendered on first view instead.
+    """
+
+    def __init__(self, renderer: PlantUMLRenderer, max_size: Optional[int] = None, threads: Optional[int] = None) -> None:
+        self.renderer = renderer
+        self._jobs: "queue.Queue[Tuple[str, str]]" = queue.Queue(maxsize=int(max_size or env_number("PLANTUML_PRERENDER_QUEUE", DEFAULT_QUEUE_SIZE)))
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._counters = {"submitted": 0, "deduplicated": 0, "dropped": 0, "rendered": 0, "cacheHits": 0, "failed": 0}
+        for idx in range(int(threads or env_number("PLANTUML_PRERENDER_THREADS", DEFAULT_THREADS))):
+            threading.Thread(target=self._run, name=f"plantuml-prerender-{idx}", daemon=True).start()
+
+    def submit(self, plantuml: Optional[str]) -> bool:
+        """Queue `plantuml` for rendering; returns False when it was skipped."""
+        if not (plantuml or "").strip() or not self.renderer.is_available():
+            return False
+        try:
+            key = self.renderer.cache_key(plantuml, "svg")
+        except ValueError:
+            return False
+        with self._lock:
+            self._counters["submitted"] += 1
+            if key in self._pending:
+                self._counters["deduplicated"] += 1
+                return False
+            self._pending.add(key)
+        try:
+            self._jobs.put_nowait((key, plantuml))
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(key)
+                self._counters["dropped"] += 1
+            return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            key, plantuml = self._jobs.get()
+            try:
+                result = self.renderer.render(plantuml, "svg")
+                if thumbnails_enabled():
+                    self.renderer.render(thumbnail_source(plantuml), "png")
+                with self._lock:
+                    self._counters["cacheHits" if result.cached else "rendered"] += 1
+            except Exception as exc:
+                with self._lock:
+                    self._counters["failed"] += 1
+                print(f"[plantuml-prerender] {key[:12]} failed: {exc}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._jobs.task_done()
+
+    def join(self) -> None:
+        self._jobs.join()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._counters)
+            out["pending"] = len(self._pending)
+        out["thumbnails"] = thumbnails_enabled()
+        return out
+
+
+_QUEUE: Optional[PreRenderQueue] = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_render_queue() -> Optional[PreRenderQueue]:
+    """Process-wide pre-render queue, or None when pre-rendering or rendering is off."""
+    global _QUEUE
+    if not prerender_enabled():
+        return None
+    renderer = get_renderer()
+    if renderer is None:
+        return None
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                _QUEUE = PreRenderQueue(renderer)
+    return _QUEUE
+
+
+def prerender_stats() -> Dict[str, object]:
+    return _QUEUE.stats() if _QUEUE is not None else {"enabled": prerender_enabled()}
@@ -64,9 +64,15 @@ class InMemoryUserRepository:
         u = self._get_or_create(email)
         u["projects"].append(project)
 
-    def delete_project(self, email: str, project_id: str) -> None:
+    def get_project(self, email: str, project_id: str) -> Optional[Dict[str, Any]]:
+        u = self._users.get(self._key(email)) or {}
+        return next((p for p in u.get("projects", []) if p.get("projectId") == project_id), None)
+
+    def delete_project(self, email: str, project_id: str) -> bool:
         u = self._get_or_create(email)
+        before = len(u["projects"])
         u["projects"] = [p for p in u["projects"] if p.get("projectId") != project_id]
+        return len(u["projects"]) < before
 
     def update_projects(self, email: str, projects: List[Dict[str, Any]]) -> None:
         # Replace the full project list (some services use this pattern)
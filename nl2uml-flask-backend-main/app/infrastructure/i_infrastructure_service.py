@@ -3,12 +3,18 @@ from typing import Protocol, Optional
 
 class IInfrastructureService(Protocol):
     def generate_prompt(self, prompt: str) -> str: ...
-    def prompt_to_uml(self, prompt: str, agent_type: Optional[str] = None, diagram_type: Optional[str] = None, pipeline_prompts: Optional[dict] = None, pipeline_models: Optional[dict] = None) -> str: ...
+    def prompt_to_uml(self, prompt: str, agent_type: Optional[str] = None, diagram_type: Optional[str] = None, pipeline_prompts: Optional[dict] = None, pipeline_models: Optional[dict] = None, cancel=None) -> str: ...
+    def uml_model_candidates(self, agent_type: Optional[str] = None, pipeline_models: Optional[dict] = None) -> list[str]: ...
+    def semantic_lookup(self, prompt: str, partition: str) -> Optional[dict]: ...
+    def semantic_store(self, prompt: str, partition: str, payload: dict) -> None: ...
     def explain_model(self, model: str) -> str: ...
     def render_model(self, model: str) -> str: ...
     def refine_model(self, model: str, feedback: str, agent_override=None) -> str: ...
+    def refine_region(self, prompt: str, agent_override=None) -> str: ...
     def generate_code(self, model: str, agent_type: Optional[str] = None) -> str: ...
-    def cleanup_old_models(self) -> None: ...
+    def cleanup_old_models(self) -> int: ...
+    def run_retention_sweep(self) -> dict: ...
     def retrieve(self, pk: str, sk: str) -> str: ...
+    def unit_of_work(self): ...
     def save_model(self, pk: str, sk: str, value: str) -> None: ...
     def load_model(self, pk: str, sk: str) -> str: ...
@@ -4,6 +4,10 @@ from typing import Optional
 
 from app.infrastructure.i_infrastructure_service import IInfrastructureService
 from app.infrastructure.internal.agent_factory import AgentFactory
+from app.infrastructure.internal.ollama_http import CancelToken
+from app.infrastructure.internal.retention import get_retention_sweeper
+from app.infrastructure.internal.unit_of_work import unit_of_work
+from app.infrastructure.internal.semantic_cache import get_semantic_cache
 from app.infrastructure.internal.websockets import WebSocketPushService
 from app.infrastructure.repositories.model_store_repository import ModelStoreAdapter, ModelStoreDiagramRepository
 
@@ -20,12 +24,36 @@ class InfrastructureService(IInfrastructureService):
     def generate_prompt(self, prompt: str) -> str:
         return self._ai.generate(prompt)
 
-    def prompt_to_uml(self, prompt: str, agent_type: Optional[str] = None, diagram_type: Optional[str] = None, pipeline_prompts: Optional[dict] = None, pipeline_models: Optional[dict] = None) -> str:
+    def prompt_to_uml(self, prompt: str, agent_type: Optional[str] = None, diagram_type: Optional[str] = None, pipeline_prompts: Optional[dict] = None, pipeline_models: Optional[dict] = None, cancel: Optional[CancelToken] = None) -> str:
+        """`cancel` abandons the generation; agents that cannot stop mid-request ignore it."""
         agent = AgentFactory.create_agent(agent_type) if agent_type else self._ai
         if hasattr(agent, "prompt_to_uml"):
-            return agent.prompt_to_uml(prompt, diagram_type=diagram_type, pipeline_prompts=pipeline_prompts, pipeline_models=pipeline_models)
+            extra = {"cancel": cancel} if cancel is not None else {}
+            return agent.prompt_to_uml(prompt, diagram_type=diagram_type, pipeline_prompts=pipeline_prompts, pipeline_models=pipeline_models, **extra)
         raise NotImplementedError("Selected agent does not support prompt_to_uml.")
 
+    def uml_model_candidates(self, agent_type: Optional[str] = None, pipeline_models: Optional[dict] = None) -> list[str]:
+        """
+        UML-stage models the selected agent can fan out over (empty for single-model agents).
+        A request-level `uml` override wins over the agent's configured list.
+        """
+        from app.infrastructure.internal.ollama_pipeline_client import parse_models
+        override = parse_models((pipeline_models or {}).get("uml"))
+        if override:
+            return override
+        agent = AgentFactory.create_agent(agent_type) if agent_type else self._ai
+        return list(getattr(agent, "uml_models", None) or [])
+
+    def semantic_lookup(self, prompt: str, partition: str) -> Optional[dict]:
+        """Return a cached diagram for a near-duplicate prompt, or None (also when the cache is off)."""
+        cache = get_semantic_cache()
+        return cache.lookup(prompt, partition) if cache is not None else None
+
+    def semantic_store(self, prompt: str, partition: str, payload: dict) -> None:
+        cache = get_semantic_cache()
+        if cache is not None:
+            cache.store(prompt, partition, payload)
+
     def explain_model(self, model: str) -> str:
         agent = self._ai
         if hasattr(agent, "explain_model"):
@@ -45,6 +73,15 @@ class InfrastructureService(IInfrastructureService):
             return agent.refine_model(model, feedback)
         raise NotImplementedError("This agent does not support refine_model.")
 
+    def refine_region(self, prompt: str, agent_override=None) -> str:
+        """Send a self-contained region-repair prompt; agents without a dedicated hook use plain generation."""
+        agent = agent_override if agent_override else self._ai
+        if hasattr(agent, "refine_region"):
+            return agent.refine_region(prompt)
+        if hasattr(agent, "generate"):
+            return agent.generate(prompt)
+        raise NotImplementedError("This agent does not support region repair.")
+
     def generate_code(self, model: str, agent_type: Optional[str] = None) -> str:
         agent = AgentFactory.create_agent(agent_type) if agent_type else self._ai
         if hasattr(agent, "generate_code"):
@@ -53,12 +90,19 @@ class InfrastructureService(IInfrastructureService):
             return agent.generate(model)
         raise NotImplementedError("Selected agent does not support code generation.")
 
-    def cleanup_old_models(self) -> None:
-        self._store.cleanup_old_models()
+    def cleanup_old_models(self) -> int:
+        return self._store.cleanup_old_models()
+
+    def run_retention_sweep(self) -> dict:
+        return get_retention_sweeper().sweep()
 
     def retrieve(self, pk: str, sk: str) -> str:
         return self._store.retrieve(pk, sk)
 
+    def unit_of_work(self):
+        """Context manager grouping the writes made inside it into one commit (see unit_of_work.UnitOfWork)."""
+        return unit_of_work()
+
     def save_model(self, pk: str, sk: str, value: str) -> None:
         print("Saving model to store:", pk, sk)
         self._store.save(pk, sk, value)
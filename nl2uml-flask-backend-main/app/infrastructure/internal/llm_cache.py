@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+from app.util.env import env_number
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR_DEFAULT = "/var/lib/nl2uml"
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_MEMORY_BYTES = 16 * 1024 * 1024
+EVICT_EVERY_PUTS = 32
+# Disk eviction trims to this fraction of the budget so it does not run on every put.
+EVICT_LOW_WATERMARK = 0.9
+# Refine and repair prompts must get a fresh sample each time; a cached reply would
+# repeat the very output that is being fixed.
+UNCACHED_STAGES = frozenset({"refine"})
+
+
+def cache_enabled() -> bool:
+    return (os.getenv("LLM_CACHE", "0").lower() in ("1", "true", "yes", "on"))
+
+
+def stage_cacheable(stage: str) -> bool:
+    return stage not in UNCACHED_STAGES
+
+
+def cache_key(model: str, prompt: str, num_ctx: Optional[int] = None, options: Optional[Dict[str, Any]] = None, host: str = "") -> str:
+    """
+    Content address for one generation: the prompt is hashed on its own so the
+    key stays short, then combined with everything else that changes the output.
+    """
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    material = json.dumps(
+        {"host": host.rstrip("/"), "model": model, "prompt": prompt_hash, "num_ctx": num_ctx, "options": options or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-level cache for LLM responses keyed by cache_key().
+
+    The front is an in-process LRU bounded by entry count and bytes; behind it is
+    a SQLite table under DATA_DIR that survives restarts and is shared by all
+    gunicorn workers. Entries expire after LLM_CACHE_TTL_SECONDS, and the table is
+    trimmed least-recently-used first once it exceeds LLM_CACHE_MAX_BYTES.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        memory_entries: Optional[int] = None,
+        memory_bytes: Optional[int] = None,
+    ) -> None:
+        data_dir = os.getenv("DATA_DIR", DATA_DIR_DEFAULT)
+        self.db_path = db_path or os.getenv("LLM_CACHE_PATH") or os.path.join(data_dir, "db", "llm_cache.sqlite")
+        self.ttl_seconds = ttl_seconds or env_number("LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)
+        self.max_bytes = int(max_bytes or env_number("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.memory_entries = int(memory_entries or env_number("LLM_CACHE_MEMORY_ENTRIES", DEFAULT_MEMORY_ENTRIES))
+        self.memory_bytes = int(memory_bytes or env_number("LLM_CACHE_MEMORY_BYTES", DEFAULT_MEMORY_BYTES))
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._disk_ok = True
+        self._counters = {"hits": 0, "memoryHits": 0, "diskHits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0}
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._ensure_schema()
+        except Exception as exc:
+            logger.warning("[llm-cache] disk tier disabled (%s): %s", self.db_path, exc)
+            self._disk_ok = False
+
+    # --- sqlite -----------------------------------------------------------
+    def _db(self):
+        return get_connection_manager(self.db_path)
+
+    def _ensure_schema(self) -> None:
+        def _create(conn):
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                       key TEXT PRIMARY KEY,
+                       model TEXT NOT NULL,
+                       response TEXT NOT NULL,
+                       size INTEGER NOT NULL,
+                       created_at REAL NOT NULL,
+                       accessed_at REAL NOT NULL,
+                       expires_at REAL NOT NULL
+                   )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache(expires_at)")
+
+        self._db().write(_create)
+
+    # --- memory tier ------------------------------------------------------
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= now:
+            self._memory_drop(key)
+            self._counters["expired"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: str, expires_at: float) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.memory_bytes:
+            return
+        self._memory_drop(key)
+        self._memory[key] = (value, expires_at)
+        self._memory_size += size
+        while self._memory and (len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes):
+            oldest = next(iter(self._memory))
+            self._memory_drop(oldest)
+
+    def _memory_drop(self, key: str) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[0].encode("utf-8"))
+
+    # --- public API -------------------------------------------------------
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            value = self._memory_get(key, now)
+            if value is not None:
+                self._counters["hits"] += 1
+                self._counters["memoryHits"] += 1
+                return value
+        value, expires_at = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._counters["diskHits"] += 1
+            self._memory_put(key, value, expires_at)
+        return value
+
+    def put(self, key: str, value: str, model: str = "") -> None:
+        if not value:
+            return
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._memory_put(key, value, expires_at)
+            self._counters["stores"] += 1
+            self._puts_since_evict += 1
+            evict = self._puts_since_evict >= EVICT_EVERY_PUTS
+            if evict:
+                self._puts_since_evict = 0
+        if not self._disk_ok:
+            return
+        try:
+            self._db().write(lambda conn: conn.execute(
+                """INSERT INTO llm_cache (key, model, response, size, created_at, accessed_at, expires_at)
+                   VALUES (?,?,?,?,?,?,?)
+                   ON CONFLICT(key) DO UPDATE SET response=excluded.response, size=excluded.size,
+                       accessed_at=excluded.accessed_at, expires_at=excluded.expires_at""",
+                (key, model, value, len(value.encode("utf-8")), now, now, expires_at),
+            ))
+            if evict:
+                self.evict()
+        except sqlite3.Error as exc:
+            logger.warning("[llm-cache] failed to store entry: %s", exc)
+
+    def _disk_get(self, key: str, now: float) -> Tuple[Optional[str], float]:
+        if not self._disk_ok:
+            return None, 0.0
+        try:
+            with self._db().connection() as conn:
+                row = conn.execute("SELECT response, expires_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if not row:
+                return None, 0.0
+            if row[1] <= now:
+                self._db().write(lambda conn: conn.execute("DELETE FROM llm_cache WHERE key=? AND expires_at <= ?", (key, now)))
+                with self._lock:
+                    self._counters["expired"] += 1
+                return None, 0.0
+            self._db().write(lambda conn: conn.execute("UPDATE llm_cache SET accessed_at=? WHERE key=?", (now, key)))
+            return row[0], row[1]
+        except sqlite3.Error as exc:
+            logger.warning("[llm-cache] lookup failed: %s", exc)
+            return None, 0.0
+
+    def evict(self) -> int:
+        """
+        Drop expired rows, then least-recently-used rows until the table is back
+        under the low watermark of the byte budget. Returns the rows removed.
+        """
+        if not self._disk_ok:
+            return 0
+
+        def _evict(conn) -> int:
+            removed = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total > self.max_bytes:
+                target = int(self.max_bytes * EVICT_LOW_WATERMARK)
+                doomed = []
+                for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at ASC"):
+                    if total <= target:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                conn.executemany("DELETE FROM llm_cache WHERE key=?", doomed)
+                removed += len(doomed)
+            return removed
+
+        removed = self._db().write(_evict)
+        if removed:
+            logger.info("[llm-cache] evicted %s entries", removed)
+            with self._lock:
+                self._counters["evictions"] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            lookups = out["hits"] + out["misses"]
+            out["hitRate"] = round(out["hits"] / lookups, 3) if lookups else 0.0
+            out["memoryEntries"] = len(self._memory)
+            out["memoryBytes"] = self._memory_size
+        if self._disk_ok:
+            try:
+                with self._db().connection() as conn:
+                    entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+                out["diskEntries"] = entries
+                out["diskBytes"] = size
+            except sqlite3.Error:
+                pass
+        out["diskEnabled"] = self._disk_ok
+        out["maxBytes"] = self.max_bytes
+        out["ttlSeconds"] = self.ttl_seconds
+        return out
+
+
+_CACHE: Optional[LLMResponseCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Process-wide cache, or None when LLM_CACHE is off."""
+    global _CACHE
+    if not cache_enabled():
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = LLMResponseCache()
+    return _CACHE
+
+
+def llm_cache_stats() -> Dict[str, Any]:
+    return _CACHE.stats() if _CACHE is not None else {"enabled": cache_enabled()}
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.util.env import env_number
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_TIMEOUT_THRESHOLD = 1
+DEFAULT_COOLDOWN_SECONDS = 60.0
+MAX_COOLDOWN_SECONDS = 600.0
+DEFAULT_LATENCY_BUCKET_SECONDS = 10.0
+WINDOW = 20
+
+
+class _ModelHealth:
+    def __init__(self) -> None:
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.consecutive_failures = 0
+        self.consecutive_timeouts = 0
+        self.outcomes: Deque[bool] = deque(maxlen=WINDOW)
+        self.latencies: Deque[float] = deque(maxlen=WINDOW)
+        self.open_until = 0.0
+        self.cooldown = 0.0
+
+    def failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def median_latency(self) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2]
+
+    def is_open(self, now: float) -> bool:
+        return self.open_until > now
+
+
+class ModelHealthTracker:
+    """
+    Per-model circuit breaker and scoring for one Ollama host.
+
+    A model's circuit opens after OLLAMA_CIRCUIT_FAILURES consecutive failures
+    (or OLLAMA_CIRCUIT_TIMEOUTS consecutive timeouts) and stays open for a cooldown
+    that doubles on every re-open, up to MAX_COOLDOWN_SECONDS. Once the cooldown
+    passes the model is tried again; one success closes the circuit.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = None,
+        timeout_threshold: Optional[int] = None,
+        cooldown_seconds: Optional[float] = None,
+        latency_bucket_seconds: Optional[float] = None,
+    ) -> None:
+        self.failure_threshold = int(failure_threshold or env_number("OLLAMA_CIRCUIT_FAILURES", DEFAULT_FAILURE_THRESHOLD))
+        self.timeout_threshold = int(timeout_threshold or env_number("OLLAMA_CIRCUIT_TIMEOUTS", DEFAULT_TIMEOUT_THRESHOLD))
+        self.cooldown_seconds = cooldown_seconds or env_number("OLLAMA_CIRCUIT_COOLDOWN_SECONDS", DEFAULT_COOLDOWN_SECONDS)
+        self.latency_bucket_seconds = latency_bucket_seconds or env_number("OLLAMA_HEALTH_LATENCY_BUCKET_SECONDS", DEFAULT_LATENCY_BUCKET_SECONDS)
+        self._models: Dict[str, _ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _health(self, model: str) -> _ModelHealth:
+        health = self._models.get(model)
+        if health is None:
+            health = self._models.setdefault(model, _ModelHealth())
+        return health
+
+    def order(self, models: List[str]) -> List[str]:
+        """
+        Return `models` with open circuits removed and the rest sorted by recent
+        failure rate, then median latency. Ties (including models with no history)
+        keep their configured order. If every circuit is open, the models whose
+        cooldown ends soonest are returned so the request still has a chance.
+        """
+        now = time.monotonic()
+        with self._lock:
+            closed = [m for m in models if not self._health(m).is_open(now)]
+            if not closed:
+                return sorted(models, key=lambda m: self._health(m).open_until)
+
+            def score(model: str):
+                health = self._health(model)
+                latency = health.median_latency()
+                latency_bucket = float("inf") if latency is None else latency // self.latency_bucket_seconds
+                return (round(health.failure_rate() * 4) / 4, latency_bucket)
+
+            ordered = sorted(closed, key=score)
+        skipped = [m for m in models if m not in ordered]
+        if skipped:
+            logger.info("[model-health] skipping models with open circuits: %s", skipped)
+        return ordered
+
+    def record_success(self, model: str, seconds: float) -> None:
+        with self._lock:
+            health = self._health(model)
+            health.successes += 1
+            health.outcomes.append(True)
+            health.latencies.append(seconds)
+            health.consecutive_failures = 0
+            health.consecutive_timeouts = 0
+            health.open_until = 0.0
+            health.cooldown = 0.0
+
+    def record_failure(self, model: str, timeout: bool = False) -> None:
+        with self._lock:
+            health = self._health(model)
+            health.failures += 1
+            health.outcomes.append(False)
+            health.consecutive_failures += 1
+            if timeout:
+                health.timeouts += 1
+                health.consecutive_timeouts += 1
+            tripped = (
+                health.consecutive_failures >= self.failure_threshold
+                or health.consecutive_timeouts >= self.timeout_threshold
+            )
+            if tripped:
+                health.cooldown = min(max(health.cooldown * 2, self.cooldown_seconds), MAX_COOLDOWN_SECONDS)
+                health.open_until = time.monotonic() + health.cooldown
+                logger.warning(
+                    "[model-health] circuit open for model=%s cooldown=%.0fs (failures=%s timeouts=%s)",
+                    model, health.cooldown, health.consecutive_failures, health.consecutive_timeouts,
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "successes": h.successes,
+                    "failures": h.failures,
+                    "timeouts": h.timeouts,
+                    "failureRate": round(h.failure_rate(), 3),
+                    "medianLatencySeconds": None if h.median_latency() is None else round(h.median_latency(), 3),
+                    "circuitOpen": h.is_open(now),
+                    "reopensInSeconds": round(max(h.open_until - now, 0.0), 1),
+                }
+                for model, h in self._models.items()
+            }
+
+
+_TRACKERS: Dict[str, ModelHealthTracker] = {}
+_TRACKERS_LOCK = threading.Lock()
+
+
+def get_health_tracker(host: str) -> ModelHealthTracker:
+    """Trackers are per host and process-wide, since agents are created per request."""
+    key = (host or "").rstrip("/")
+    with _TRACKERS_LOCK:
+        tracker = _TRACKERS.get(key)
+        if tracker is None:
+            tracker = _TRACKERS[key] = ModelHealthTracker()
+        return tracker
+
+
+def model_health_stats() -> Dict[str, Any]:
+    with _TRACKERS_LOCK:
+        items = list(_TRACKERS.items())
+    return {host: tracker.stats() for host, tracker in items}
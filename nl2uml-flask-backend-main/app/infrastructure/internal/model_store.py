@@ -1,33 +1,86 @@
 from __future__ import annotations
-import json, os, sqlite3
-from typing import Any, Dict, List, Optional
+import json, os, sqlite3, threading, time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: single-process use only
+    fcntl = None
+
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+from app.util.env import env_int, env_number
 
 DATA_DIR_DEFAULT = "/var/lib/nl2uml"
 JSON_FILENAME = "models.json"
+LOG_FILENAME = "models.log"
 SQLITE_DEFAULT = os.path.join(DATA_DIR_DEFAULT, "db", "nl2uml.sqlite")
 
+# Item fields every backend indexes for query(index, value).
+INDEXES = ("projectId", "userEmail", "type")
+# Item fields indexed for retention sweeps; expiresAt is epoch seconds (DynamoDB TTL format).
+RETENTION_FIELDS = ("createdAt", "expiresAt")
+
 class BaseModelStore:
+    indexes = INDEXES
     def get(self, model_id: str) -> Optional[Dict[str, Any]]: raise NotImplementedError
     def put(self, item: Dict[str, Any]) -> None: raise NotImplementedError
+    def put_many(self, items: List[Dict[str, Any]]) -> None:
+        """Store several items in one backend write where the backend supports it."""
+        for item in items: self.put(item)
     def delete(self, model_id: str) -> None: raise NotImplementedError
     def list(self) -> List[Dict[str, Any]]: raise NotImplementedError
+    def query(self, index: str, value: Any) -> List[Dict[str, Any]]:
+        """Items whose `index` field equals `value`; backends override this with an indexed lookup."""
+        self._check_index(index)
+        return [it for it in self.list() if it.get(index) == value]
+    def _check_index(self, index: str) -> None:
+        if index not in self.indexes: raise ValueError(f"Unknown index '{index}' (declared: {', '.join(self.indexes)})")
+    def expire(self, now: float, limit: int) -> int:
+        """Delete up to `limit` items whose expiresAt <= now; returns how many were deleted."""
+        expired = [it["id"] for it in self.list() if _is_expired(it, now)][:limit]
+        for model_id in expired: self.delete(model_id)
+        return len(expired)
+    def stamp_expiry(self, kind: str, expiry: int, limit: int) -> int:
+        """Set expiresAt on up to `limit` items of type `kind` that have none; returns how many were stamped."""
+        items = [it for it in self.query("type", kind) if it.get("expiresAt") is None][:limit]
+        for item in items: item["expiresAt"] = expiry
+        if items: self.put_many(items)
+        return len(items)
+
+def _expires_at(item: Dict[str, Any]) -> Optional[float]:
+    try: return float(item["expiresAt"]) if item.get("expiresAt") is not None else None
+    except (TypeError, ValueError): return None
+
+def _is_expired(item: Dict[str, Any], now: float) -> bool:
+    expires_at = _expires_at(item)
+    return expires_at is not None and expires_at <= now
 
 class SqliteModelStore(BaseModelStore):
     def __init__(self, db_path: str) -> None:
         self._db_path = db_path
         os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+        self._connections = get_connection_manager(self._db_path)
         self._ensure_schema()
     def _conn(self):
-        cx = sqlite3.connect(self._db_path, check_same_thread=False, timeout=30.0)
-        # Align SQLite tuning with other repos to reduce lock contention.
-        cx.execute("PRAGMA journal_mode=WAL;")
-        cx.execute("PRAGMA synchronous=NORMAL;")
-        cx.execute("PRAGMA busy_timeout=30000;")
-        return cx
+        # Shared per-thread connection (tuned once) instead of a new connection per call.
+        return self._connections.connection()
     def _ensure_schema(self) -> None:
-        with self._conn() as conn:
+        def create(conn) -> bool:
             conn.execute("CREATE TABLE IF NOT EXISTS models (id TEXT PRIMARY KEY, payload TEXT NOT NULL)")
-            conn.commit()
+            # Expression indexes are maintained by SQLite itself on every put/delete.
+            try:
+                for name in self.indexes + RETENTION_FIELDS:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_models_{name} ON models({self._index_expr(name)})")
+            except sqlite3.OperationalError as e:
+                print(f"[model_store] JSON indexes unavailable, query() will scan: {e}")
+                return False
+            return True
+        # Through the writer like every other write, so workers starting together do not race for the lock.
+        self._json_indexes = self._connections.write(create)
+    @staticmethod
+    def _index_expr(name: str) -> str:
+        return f"json_extract(payload, '$.{name}')"
     def get(self, model_id: str) -> Optional[Dict[str, Any]]:
         print(f"Retrieving model item with id: {model_id}")
         with self._conn() as conn:
@@ -38,45 +91,236 @@ class SqliteModelStore(BaseModelStore):
         print(f"Storing model item with id: {item.get('id')}")
         if not item or "id" not in item: raise ValueError("Model item must include an 'id' field.")
         payload = json.dumps(item)
-        with self._conn() as conn:
-            conn.execute("""INSERT INTO models (id,payload) VALUES (?,?)
-                          ON CONFLICT(id) DO UPDATE SET payload=excluded.payload""", (item["id"], payload))
-            conn.commit()
+        # Writes go through the file's single writer thread (group commit, no lock retries).
+        self._connections.write(lambda conn: conn.execute("""INSERT INTO models (id,payload) VALUES (?,?)
+                          ON CONFLICT(id) DO UPDATE SET payload=excluded.payload""", (item["id"], payload)))
+    def put_many(self, items: List[Dict[str, Any]]) -> None:
+        if any(not item or "id" not in item for item in items): raise ValueError("Model item must include an 'id' field.")
+        rows = [(item["id"], json.dumps(item)) for item in items]
+        self._connections.write(lambda conn: conn.executemany("""INSERT INTO models (id,payload) VALUES (?,?)
+                          ON CONFLICT(id) DO UPDATE SET payload=excluded.payload""", rows))
     def delete(self, model_id: str) -> None:
         print(f"Deleting model item with id: {model_id}")
-        with self._conn() as conn:
-            conn.execute("DELETE FROM models WHERE id=?", (model_id,)); conn.commit()
+        self._connections.write(lambda conn: conn.execute("DELETE FROM models WHERE id=?", (model_id,)))
     def list(self) -> List[Dict[str, Any]]:
         print("Listing all model items")
         with self._conn() as conn:
             cur = conn.execute("SELECT payload FROM models")
             return [json.loads(row[0]) for row in cur.fetchall()]
+    def query(self, index: str, value: Any) -> List[Dict[str, Any]]:
+        self._check_index(index)
+        if not self._json_indexes: return super().query(index, value)
+        with self._conn() as conn:
+            cur = conn.execute(f"SELECT payload FROM models WHERE {self._index_expr(index)}=?", (value,))
+            return [json.loads(row[0]) for row in cur.fetchall()]
+    def expire(self, now: float, limit: int) -> int:
+        if not self._json_indexes: return super().expire(now, limit)
+        # One small batch per write job keeps the write lock short; the sweeper calls this repeatedly.
+        return self._connections.write(lambda conn: conn.execute(
+            f"""DELETE FROM models WHERE id IN (
+                    SELECT id FROM models WHERE {self._index_expr('expiresAt')} <= ? LIMIT ?)""", (now, limit)).rowcount)
+    def stamp_expiry(self, kind: str, expiry: int, limit: int) -> int:
+        if not self._json_indexes: return super().stamp_expiry(kind, expiry, limit)
+        # Stamped in place with json_set, so payloads are never loaded into Python.
+        return self._connections.write(lambda conn: conn.execute(
+            f"""UPDATE models SET payload=json_set(payload, '$.expiresAt', ?) WHERE id IN (
+                    SELECT id FROM models WHERE {self._index_expr('type')}=? AND {self._index_expr('expiresAt')} IS NULL LIMIT ?)""",
+            (expiry, kind, limit)).rowcount)
 
 class FileModelStore(BaseModelStore):
+    """
+    Append-only JSON-lines log (`models.log`) with an in-memory id -> (offset, length)
+    index, so a write appends one record instead of rewriting every model.
+
+    The index is rebuilt by scanning the log on startup. Other processes'
+    appends are picked up by scanning the new tail, and a compaction done by
+    another process is picked up by reopening when the inode changes. Appends
+    and compaction hold an flock on `models.log.lock`. A torn final record left
+    by a crash is truncated on the next write. Compaction rewrites the live
+    records once dead bytes exceed FILE_STORE_COMPACT_RATIO x live bytes.
+    FILE_STORE_FSYNC sets durability: always, interval (at most once every
+    FILE_STORE_FSYNC_INTERVAL seconds) or never. A legacy `models.json` is
+    imported once. Secondary indexes (INDEXES) and expiry times are kept in
+    memory alongside the id index and rebuilt with it.
+    """
     def __init__(self, data_dir: Optional[str] = None) -> None:
         data_dir = data_dir or os.getenv("DATA_DIR", DATA_DIR_DEFAULT)
         os.makedirs(data_dir, exist_ok=True)
-        self._path = os.path.join(data_dir, JSON_FILENAME)
-        if not os.path.exists(self._path):
-            with open(self._path, "w", encoding="utf-8") as f: json.dump({}, f)
-    def _read(self) -> Dict[str, Dict[str, Any]]:
-        with open(self._path, "r", encoding="utf-8") as f:
+        self._path = os.path.join(data_dir, LOG_FILENAME)
+        self._lock_path = self._path + ".lock"
+        self._lock = threading.RLock()
+        self._fh = None
+        self._inode: Optional[int] = None
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._by_field: Dict[str, Dict[Any, Set[str]]] = {name: {} for name in self.indexes}
+        self._fields: Dict[str, Tuple[Any, ...]] = {}
+        self._expiry: Dict[str, float] = {}
+        self._end = 0
+        self._live = 0
+        self._last_fsync = 0.0
+        self._fsync = (os.getenv("FILE_STORE_FSYNC") or "interval").lower()
+        self._fsync_interval = env_number("FILE_STORE_FSYNC_INTERVAL", 1.0, positive=False)
+        self._compact_ratio = env_number("FILE_STORE_COMPACT_RATIO", 1.0, positive=False)
+        self._compact_min = env_int("FILE_STORE_COMPACT_MIN_BYTES", 1024 * 1024, positive=False)
+        with self._lock, self._flock(exclusive=True):
+            self._import_legacy(os.path.join(data_dir, JSON_FILENAME))
+            self._sync(repair=True)
+
+    @contextmanager
+    def _flock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
             try:
-                data = json.load(f); return data if isinstance(data, dict) else {}
-            except Exception: return {}
-    def _write(self, data: Dict[str, Dict[str, Any]]) -> None:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _import_legacy(self, legacy_path: str) -> None:
+        if os.path.exists(self._path) or not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f: data = json.load(f)
+        except Exception: data = {}
         tmp = self._path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f: json.dump(data, f)
+        with open(tmp, "wb") as f:
+            for item in (data.values() if isinstance(data, dict) else []):
+                f.write(self._encode({"op": "put", "item": item}))
+            f.flush(); os.fsync(f.fileno())
         os.replace(tmp, self._path)
-    def get(self, model_id: str) -> Optional[Dict[str, Any]]: return self._read().get(model_id)
+        os.replace(legacy_path, legacy_path + ".migrated")
+        print(f"[model_store] imported {len(data)} models from {legacy_path} into {self._path}")
+
+    @staticmethod
+    def _encode(record: Dict[str, Any]) -> bytes:
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+    def _reopen(self) -> None:
+        if self._fh is not None: self._fh.close()
+        self._fh = open(self._path, "a+b")
+        self._inode = os.fstat(self._fh.fileno()).st_ino
+        self._index, self._end, self._live = {}, 0, 0
+        self._by_field, self._fields, self._expiry = {name: {} for name in self.indexes}, {}, {}
+
+    def _sync(self, repair: bool = False) -> None:
+        """Catch the index up with the log; with `repair` (exclusive lock held) drop a torn tail."""
+        try:
+            on_disk = os.stat(self._path).st_ino
+        except FileNotFoundError:
+            on_disk = None
+        if self._fh is None or on_disk != self._inode:
+            self._reopen()
+        size = os.fstat(self._fh.fileno()).st_size
+        if size <= self._end:
+            return
+        chunk = os.pread(self._fh.fileno(), size - self._end, self._end)
+        pos = 0
+        while True:
+            nl = chunk.find(b"\n", pos)
+            if nl < 0: break
+            self._apply(chunk[pos:nl + 1], self._end + pos)
+            pos = nl + 1
+        self._end += pos
+        if pos < len(chunk) and repair:
+            print(f"[model_store] truncating torn record at offset {self._end} in {self._path}")
+            self._fh.truncate(self._end)
+
+    def _apply(self, line: bytes, offset: int) -> None:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return
+        item = record.get("item") or {}
+        model_id = item.get("id") if record.get("op") == "put" else record.get("id")
+        old = self._index.pop(model_id, None)
+        if old: self._live -= old[1]
+        self._expiry.pop(model_id, None)
+        for name, value in zip(self.indexes, self._fields.pop(model_id, ())):
+            ids = self._by_field[name].get(value)
+            if ids is not None:
+                ids.discard(model_id)
+                if not ids: del self._by_field[name][value]
+        if record.get("op") == "put" and model_id is not None:
+            self._index[model_id] = (offset, len(line))
+            self._live += len(line)
+            values = tuple(self._hashable(item.get(name)) for name in self.indexes)
+            self._fields[model_id] = values
+            for name, value in zip(self.indexes, values):
+                if value is not None: self._by_field[name].setdefault(value, set()).add(model_id)
+            expires_at = _expires_at(item)
+            if expires_at is not None: self._expiry[model_id] = expires_at
+
+    @staticmethod
+    def _hashable(value: Any) -> Any:
+        return value if value is None or isinstance(value, (str, int, float, bool)) else json.dumps(value, sort_keys=True)
+
+    def _read(self, entry: Tuple[int, int]) -> Dict[str, Any]:
+        return json.loads(os.pread(self._fh.fileno(), entry[1], entry[0]))["item"]
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        with self._lock, self._flock(exclusive=True):
+            self._sync(repair=True)
+            line = self._encode(record)
+            self._fh.write(line); self._fh.flush()
+            now = time.monotonic()
+            if self._fsync == "always" or (self._fsync == "interval" and now - self._last_fsync >= self._fsync_interval):
+                os.fsync(self._fh.fileno()); self._last_fsync = now
+            self._apply(line, self._end)
+            self._end += len(line)
+            if self._end >= self._compact_min and self._end - self._live > self._live * self._compact_ratio:
+                self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite only the live records (caller holds both locks), then swap the file in."""
+        tmp = self._path + ".compact"
+        with open(tmp, "wb") as f:
+            for entry in sorted(self._index.values()):
+                f.write(os.pread(self._fh.fileno(), entry[1], entry[0]))
+            f.flush(); os.fsync(f.fileno())
+        before = self._end
+        os.replace(tmp, self._path)
+        self._sync()
+        print(f"[model_store] compacted {self._path}: {before} -> {self._end} bytes")
+
+    def get(self, model_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._flock(exclusive=False):
+            self._sync()
+            entry = self._index.get(model_id)
+            return self._read(entry) if entry else None
     def put(self, item: Dict[str, Any]) -> None:
         if not item or "id" not in item: raise ValueError("Model item must include an 'id' field.")
-        data = self._read(); data[item["id"]] = item; self._write(data)
+        self._append({"op": "put", "item": item})
     def delete(self, model_id: str) -> None:
-        data = self._read(); 
-        if model_id in data: del data[model_id]; self._write(data)
+        with self._lock:
+            self._sync()
+            if model_id not in self._index: return
+        self._append({"op": "del", "id": model_id})
     def list(self) -> List[Dict[str, Dict[str, Any]]]:
-        return list(self._read().values())
+        with self._lock, self._flock(exclusive=False):
+            self._sync()
+            return [self._read(entry) for entry in sorted(self._index.values())]
+    def query(self, index: str, value: Any) -> List[Dict[str, Any]]:
+        self._check_index(index)
+        with self._lock, self._flock(exclusive=False):
+            self._sync()
+            ids = self._by_field[index].get(self._hashable(value), ())
+            return [self._read(entry) for entry in sorted(self._index[i] for i in ids)]
+    def expire(self, now: float, limit: int) -> int:
+        with self._lock:
+            self._sync()
+            expired = sorted((at, model_id) for model_id, at in self._expiry.items() if at <= now)[:limit]
+        for _, model_id in expired: self.delete(model_id)
+        return len(expired)
+    def stamp_expiry(self, kind: str, expiry: int, limit: int) -> int:
+        with self._lock, self._flock(exclusive=False):
+            self._sync()
+            ids = sorted(i for i in self._by_field["type"].get(self._hashable(kind), ()) if i not in self._expiry)[:limit]
+            items = [self._read(self._index[i]) for i in ids]
+        for item in items: item["expiresAt"] = expiry
+        if items: self.put_many(items)
+        return len(items)
 
 class DdbModelStore(BaseModelStore):
     def __init__(self, table_name: str, region: Optional[str] = None) -> None:
@@ -90,7 +334,28 @@ class DdbModelStore(BaseModelStore):
     def put(self, item: Dict[str, Any]) -> None:
         if not item or "id" not in item: raise ValueError("Model item must include an 'id' field.")
         self._table.put_item(Item=item)
+    def put_many(self, items: List[Dict[str, Any]]) -> None:
+        if any(not item or "id" not in item for item in items): raise ValueError("Model item must include an 'id' field.")
+        with self._table.batch_writer(overwrite_by_pkeys=["id"]) as batch:
+            for item in items: batch.put_item(Item=item)
     def delete(self, model_id: str) -> None: self._table.delete_item(Key={"id": model_id})
+    def expire(self, now: float, limit: int) -> int:
+        """No-op: enable the table's native TTL on the `expiresAt` attribute and DynamoDB deletes expired items itself."""
+        return 0
+    def query(self, index: str, value: Any) -> List[Dict[str, Any]]:
+        """Uses the GSI named by MODEL_STORE_GSI_<INDEX> (e.g. MODEL_STORE_GSI_PROJECTID) when set, else a filtered scan."""
+        from boto3.dynamodb.conditions import Attr, Key
+        self._check_index(index)
+        gsi = os.getenv(f"MODEL_STORE_GSI_{index.upper()}")
+        kwargs: Dict[str, Any] = {"IndexName": gsi, "KeyConditionExpression": Key(index).eq(value)} if gsi else {"FilterExpression": Attr(index).eq(value)}
+        op = self._table.query if gsi else self._table.scan
+        items: List[Dict[str, Any]] = []
+        while True:
+            resp = op(**kwargs); items.extend(resp.get("Items", []))
+            last = resp.get("LastEvaluatedKey")
+            if not last: break
+            kwargs["ExclusiveStartKey"] = last
+        return items
     def list(self) -> List[Dict[str, Any]]:
         items: List[Dict[str, Any]] = []; scan_kwargs: Dict[str, Any] = {}
         while True:
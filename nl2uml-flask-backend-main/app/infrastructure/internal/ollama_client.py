@@ -1,31 +1,56 @@
 from __future__ import annotations
-import os, requests, logging
+import os, logging
 from typing import Optional
 from app.infrastructure.internal.agent_registry import AgentRegistry
+from app.infrastructure.internal.llm_cache import cache_key, get_llm_cache, stage_cacheable
+from app.infrastructure.internal.ollama_http import get_session_pool, read_generate_stream, stream_cutoff_enabled, streaming_enabled
 
 logger = logging.getLogger(__name__)
 
 @AgentRegistry.register("ollama")
 class OllamaClient:
     """Minimal Ollama client used by InfrastructureService."""
-    def __init__(self, host: Optional[str] = None, model: Optional[str] = None, **_: object):
+    def __init__(self, host: Optional[str] = None, model: Optional[str] = None, stream: Optional[bool] = None, **_: object):
         self.host = (host or os.getenv("OLLAMA_HOST") or "http://localhost:11434").rstrip("/")
         self.model = model or os.getenv("OLLAMA_MODEL") or "mistral"
+        self.stream = streaming_enabled(stream)
+        self.cut_at_enduml = stream_cutoff_enabled()
 
-    def _post(self, path: str, payload: dict) -> dict:
+    def _post(self, path: str, payload: dict, cut_at_enduml: bool = False, cacheable: bool = True) -> dict:
+        cache = get_llm_cache() if cacheable and path == "/api/generate" else None
+        if cache is None:
+            return self._post_uncached(path, payload, cut_at_enduml=cut_at_enduml)
+        options = {"cutAtEnduml": cut_at_enduml, **(payload.get("options") or {})}
+        key = cache_key(payload.get("model", ""), payload.get("prompt", ""), options=options, host=self.host)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info("[ollama] model=%s served from llm cache", payload.get("model"))
+            return {"response": cached}
+        resp = self._post_uncached(path, payload, cut_at_enduml=cut_at_enduml)
+        cache.put(key, resp.get("response", ""), model=payload.get("model", ""))
+        return resp
+
+    def _post_uncached(self, path: str, payload: dict, cut_at_enduml: bool = False) -> dict:
         url = f"{self.host}{path}"
-        logger.info("[ollama] sending prompt to model=%s url=%s", payload.get("model"), url)
-        data = {"stream": False, **payload}
-        r = requests.post(url, json=data, timeout=120)
-        r.raise_for_status()
-        return r.json()
-
-    def generate(self, prompt: str) -> str:
-        resp = self._post("/api/generate", {"model": self.model, "prompt": prompt})
+        logger.info("[ollama] sending prompt to model=%s url=%s stream=%s", payload.get("model"), url, self.stream)
+        data = {"stream": self.stream, **payload}
+        r = get_session_pool().post(self.host, path, json=data, timeout=120, stream=self.stream)
+        if not self.stream:
+            r.raise_for_status()
+            return r.json()
+        try:
+            r.raise_for_status()
+        except Exception:
+            r.close()
+            raise
+        return {"response": read_generate_stream(r, cut_at_enduml=cut_at_enduml)}
+
+    def generate(self, prompt: str, cut_at_enduml: bool = False, cacheable: bool = True) -> str:
+        resp = self._post("/api/generate", {"model": self.model, "prompt": prompt}, cut_at_enduml=cut_at_enduml, cacheable=cacheable)
         return resp.get("response", "")
 
     def prompt_to_uml(self, prompt: str, **_: object) -> str:
-        return self.generate(prompt)
+        return self.generate(prompt, cut_at_enduml=self.cut_at_enduml)
 
     def explain_model(self, model: str) -> str:
         return self.generate(f"Explain this UML model briefly:\n\n{model}")
@@ -34,4 +59,7 @@ class OllamaClient:
         return model
 
     def refine_model(self, model: str, feedback: str) -> str:
-        return self.generate(f"Refine this UML model based on feedback.\n\nModel:\n{model}\n\nFeedback:\n{feedback}")
+        return self.generate(f"Refine this UML model based on feedback.\n\nModel:\n{model}\n\nFeedback:\n{feedback}", cut_at_enduml=self.cut_at_enduml, cacheable=stage_cacheable("refine"))
+
+    def refine_region(self, prompt: str) -> str:
+        return self.generate(prompt, cacheable=stage_cacheable("refine"))
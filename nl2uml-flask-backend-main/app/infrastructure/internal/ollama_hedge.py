@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import os
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from app.infrastructure.internal.ollama_http import CancelToken, GenerationCancelled
+from app.util.env import env_int
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEDGE_DELAY_SECONDS = 5.0
+DEFAULT_HEDGE_WORKERS = 8
+MIN_SAMPLES_FOR_PERCENTILE = 10
+LATENCY_WINDOW = 200
+
+
+def hedge_stages_from_env() -> Set[str]:
+    raw = os.getenv("OLLAMA_HEDGE_STAGES") or ""
+    return {token.strip().lower() for token in raw.replace(";", ",").split(",") if token.strip()}
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class _StageStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.hedges_fired = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+        self.both_failed = 0
+        self.primary_latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+
+class HedgeStats:
+    """
+    Per-stage counters for hedged calls. `latency` is what callers saw end to end;
+    `primaryLatency` is how long the first candidate took whenever it finished,
+    so the gap between their tails is what hedging buys.
+    """
+
+    def __init__(self) -> None:
+        self._stages: Dict[str, _StageStats] = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage: str) -> _StageStats:
+        return self._stages.setdefault(stage, _StageStats())
+
+    def delay_for(self, stage: str, fixed_delay: float, percentile: Optional[float]) -> float:
+        """Hedge after the stage's primary-latency percentile once enough samples exist."""
+        if percentile:
+            with self._lock:
+                samples = list(self._stage(stage).primary_latencies)
+            if len(samples) >= MIN_SAMPLES_FOR_PERCENTILE:
+                return _percentile(samples, percentile) or fixed_delay
+        return fixed_delay
+
+    def record(self, stage: str, *, hedged: bool, winner: Optional[str], seconds: float) -> None:
+        with self._lock:
+            stats = self._stage(stage)
+            stats.calls += 1
+            if hedged:
+                stats.hedges_fired += 1
+            if winner == "primary":
+                stats.primary_wins += 1
+            elif winner == "hedge":
+                stats.hedge_wins += 1
+            else:
+                stats.both_failed += 1
+            if winner:
+                stats.latencies.append(seconds)
+
+    def record_primary_latency(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._stage(stage).primary_latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for stage, s in self._stages.items():
+                latencies = list(s.latencies)
+                primary = list(s.primary_latencies)
+                out[stage] = {
+                    "calls": s.calls,
+                    "hedgesFired": s.hedges_fired,
+                    "hedgeRate": round(s.hedges_fired / s.calls, 3) if s.calls else 0.0,
+                    "primaryWins": s.primary_wins,
+                    "hedgeWins": s.hedge_wins,
+                    "bothFailed": s.both_failed,
+                    "latency": {f"p{p}": _round(_percentile(latencies, p)) for p in (50, 90, 99)},
+                    "primaryLatency": {f"p{p}": _round(_percentile(primary, p)) for p in (50, 90, 99)},
+                }
+            return out
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 3)
+
+
+_STATS = HedgeStats()
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def hedge_stats() -> HedgeStats:
+    return _STATS
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                workers = env_int("OLLAMA_HEDGE_WORKERS", DEFAULT_HEDGE_WORKERS)
+                _EXECUTOR = ThreadPoolExecutor(max_workers=max(2, workers), thread_name_prefix="ollama-hedge")
+    return _EXECUTOR
+
+
+def hedged_call(
+    stage: str,
+    primary: str,
+    secondary: str,
+    call: Callable[[str, CancelToken], str],
+    delay_seconds: float,
+    cancel: Optional[CancelToken] = None,
+) -> Tuple[str, str]:
+    """
+    Run `call(primary)`; if it has not answered within `delay_seconds`, also run
+    `call(secondary)`. Returns (model, result) of whichever succeeds first and
+    cancels the other. A primary failure fires the secondary immediately.
+    Raises the last error if both fail. Cancellation only stops a streaming
+    `call`; callers must not hedge non-streaming requests. Cancelling `cancel`
+    stops both candidates.
+    """
+    started = time.perf_counter()
+    tokens = {model: (cancel.child() if cancel is not None else CancelToken()) for model in (primary, secondary)}
+
+    def _timed(model: str) -> str:
+        t0 = time.perf_counter()
+        result = call(model, tokens[model])
+        if model == primary:
+            _STATS.record_primary_latency(stage, time.perf_counter() - t0)
+        return result
+
+    pool = _executor()
+    futures: Dict[Future, str] = {pool.submit(_timed, primary): primary}
+    done, _ = wait(list(futures), timeout=delay_seconds)
+    hedged = False
+    if not done or next(iter(done)).exception() is not None:
+        hedged = True
+        logger.info("[ollama-hedge] stage=%s firing hedge model=%s (primary=%s)", stage, secondary, primary)
+        futures[pool.submit(_timed, secondary)] = secondary
+
+    last_exc: Optional[BaseException] = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            exc = fut.exception()
+            if exc is not None:
+                if not isinstance(exc, GenerationCancelled):
+                    last_exc = exc
+                continue
+            model = futures[fut]
+            for other, other_model in futures.items():
+                if other is not fut:
+                    tokens[other_model].cancel()
+            winner = "primary" if model == primary else "hedge"
+            _STATS.record(stage, hedged=hedged, winner=winner, seconds=time.perf_counter() - started)
+            return model, fut.result()
+
+    if cancel is not None and cancel.cancelled:
+        raise GenerationCancelled()
+    _STATS.record(stage, hedged=hedged, winner=None, seconds=time.perf_counter() - started)
+    raise last_exc or RuntimeError(f"hedged call for stage={stage} failed")
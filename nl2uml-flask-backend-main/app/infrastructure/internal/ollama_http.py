@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import os
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.util.env import env_int
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GUNICORN_THREADS = 4
+PLANTUML_START = "@startuml"
+PLANTUML_END = "@enduml"
+
+
+def _pool_size_from_env() -> int:
+    """
+    Size the per-host pool to the number of request threads that can talk to
+    Ollama at once (gunicorn --threads), unless explicitly overridden.
+    """
+    return env_int("OLLAMA_HTTP_POOL_SIZE", env_int("GUNICORN_THREADS", DEFAULT_GUNICORN_THREADS))
+
+
+class _HostMetrics:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avgSeconds": round(self.total_seconds / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+class OllamaSessionPool:
+    """
+    Process-wide keep-alive sessions, one per Ollama host.
+
+    Each session mounts a requests HTTPAdapter (urllib3 PoolManager underneath)
+    sized to the gunicorn thread count, so sequential pipeline stages and the
+    validator loop reuse warm TCP connections instead of reconnecting per call.
+    """
+
+    def __init__(self, pool_size: Optional[int] = None) -> None:
+        self.pool_size = pool_size or _pool_size_from_env()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._metrics: Dict[str, _HostMetrics] = {}
+        self._lock = threading.Lock()
+
+    def session(self, host: str) -> requests.Session:
+        key = host.rstrip("/")
+        sess = self._sessions.get(key)
+        if sess is not None:
+            return sess
+        with self._lock:
+            sess = self._sessions.get(key)
+            if sess is None:
+                sess = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                sess.mount("http://", adapter)
+                sess.mount("https://", adapter)
+                self._sessions[key] = sess
+                self._metrics[key] = _HostMetrics()
+                logger.info("[ollama-http] opened pooled session host=%s pool_size=%s", key, self.pool_size)
+            return sess
+
+    def request(self, method: str, host: str, path: str, **kwargs: Any) -> requests.Response:
+        """
+        Issue a request through the pooled session for `host` and record timing.
+        """
+        key = host.rstrip("/")
+        sess = self.session(key)
+        metrics = self._metrics[key]
+        started = time.perf_counter()
+        try:
+            return sess.request(method, f"{key}{path}", **kwargs)
+        except Exception:
+            with self._lock:
+                metrics.errors += 1
+            raise
+        finally:
+            with self._lock:
+                metrics.requests += 1
+                metrics.total_seconds += time.perf_counter() - started
+
+    def post(self, host: str, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", host, path, **kwargs)
+
+    def get(self, host: str, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", host, path, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Per-host request counters plus connection counts read from urllib3's pools.
+        `connectionsOpened` well below `requests` means keep-alive is working.
+        """
+        out: Dict[str, Any] = {}
+        with self._lock:
+            items = list(self._sessions.items())
+        for host, sess in items:
+            opened = 0
+            adapter = sess.get_adapter(host)
+            pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+            if pools is not None:
+                for pool_key in list(pools.keys()):
+                    pool = pools.get(pool_key)
+                    opened += getattr(pool, "num_connections", 0) if pool is not None else 0
+            entry = self._metrics[host].as_dict()
+            entry["connectionsOpened"] = opened
+            entry["poolSize"] = self.pool_size
+            out[host] = entry
+        return out
+
+
+_POOL: Optional[OllamaSessionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_session_pool() -> OllamaSessionPool:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = OllamaSessionPool()
+    return _POOL
+
+
+def connection_stats() -> Dict[str, Any]:
+    return get_session_pool().stats() if _POOL is not None else {}
+
+
+class GenerationCancelled(Exception):
+    """Raised inside a streaming read when another caller no longer needs the answer."""
+
+
+class CancelToken:
+    """
+    Lets one thread abandon another thread's in-flight streaming generation.
+    Cancelling closes the attached response, which also stops Ollama generating,
+    and cancels every token made with child().
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._resp: Optional[requests.Response] = None
+        self._children: List["CancelToken"] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def attach(self, resp: requests.Response) -> None:
+        with self._lock:
+            self._resp = resp
+        if self.cancelled:
+            resp.close()
+
+    def child(self) -> "CancelToken":
+        """A token that can be cancelled on its own, and is cancelled along with this one."""
+        token = CancelToken()
+        with self._lock:
+            self._children.append(token)
+        if self.cancelled:
+            token.cancel()
+        return token
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise GenerationCancelled()
+
+    def cancel(self) -> None:
+        self._event.set()
+        with self._lock:
+            resp = self._resp
+            children = list(self._children)
+        for token in children:
+            token.cancel()
+        if resp is not None:
+            try:
+                resp.close()
+            except Exception:
+                pass
+
+
+def streaming_enabled(value: Optional[bool] = None) -> bool:
+    if value is not None:
+        return bool(value)
+    return (os.getenv("OLLAMA_STREAM", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def stream_cutoff_enabled() -> bool:
+    """
+    Whether PlantUML-producing calls stop at the first @enduml. Any explanation the
+    model writes after the diagram is dropped when this is on.
+    """
+    return (os.getenv("OLLAMA_STREAM_CUTOFF", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def read_generate_stream(resp: requests.Response, cut_at_enduml: bool = False, cancel: Optional[CancelToken] = None) -> str:
+    """
+    Accumulate the `response` fields of an Ollama NDJSON stream.
+
+    With `cut_at_enduml`, stop reading (and close the connection, which makes
+    Ollama abort generation) as soon as a complete @startuml ... @enduml block
+    has arrived, so trailing explanations are never decoded.
+    """
+    if cancel is not None:
+        cancel.attach(resp)
+    text = ""
+    lower = ""
+    start_idx = -1
+    scan_from = 0
+    try:
+        for line in resp.iter_lines():
+            if cancel is not None and cancel.cancelled:
+                raise GenerationCancelled()
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise RuntimeError(f"Ollama stream error: {chunk['error']}")
+            token = chunk.get("response") or ""
+            if token and cut_at_enduml:
+                text += token
+                # Keep `lower` index-aligned with `text`; the markers themselves are ASCII.
+                lower += token.lower() if token.isascii() else token
+                if start_idx == -1:
+                    start_idx = lower.find(PLANTUML_START, scan_from)
+                    # Markers can be split across tokens, so only skip what cannot hold one.
+                    scan_from = (start_idx + len(PLANTUML_START)) if start_idx != -1 else max(0, len(lower) - len(PLANTUML_START) + 1)
+                if start_idx != -1:
+                    end_idx = lower.find(PLANTUML_END, scan_from)
+                    if end_idx != -1:
+                        logger.info("[ollama-http] @enduml reached after %s chars; closing stream early", end_idx)
+                        return text[: end_idx + len(PLANTUML_END)]
+                    scan_from = max(scan_from, len(lower) - len(PLANTUML_END) + 1)
+            elif token:
+                text += token
+            if chunk.get("done"):
+                break
+        if cancel is not None and cancel.cancelled:
+            raise GenerationCancelled()
+        return text
+    except Exception:
+        if cancel is not None and cancel.cancelled:
+            raise GenerationCancelled()
+        raise
+    finally:
+        resp.close()
@@ -2,11 +2,24 @@ from __future__ import annotations
 
 import os
 import logging
+import time
 from typing import Iterable, List, Optional, Sequence
 
 import requests
 
 from app.infrastructure.internal.agent_registry import AgentRegistry
+from app.infrastructure.internal.llm_cache import cache_key, get_llm_cache, stage_cacheable
+from app.infrastructure.internal.model_health import get_health_tracker
+from app.infrastructure.internal.ollama_hedge import DEFAULT_HEDGE_DELAY_SECONDS, hedge_stages_from_env, hedge_stats, hedged_call
+from app.infrastructure.internal.ollama_http import (
+    CancelToken,
+    GenerationCancelled,
+    get_session_pool,
+    read_generate_stream,
+    stream_cutoff_enabled,
+    streaming_enabled,
+)
+from app.util.env import env_int, env_number
 
 logger = logging.getLogger(__name__)
 
@@ -14,9 +27,11 @@ DEFAULT_IDEATION_MODELS = "deepseek-coder-v2:latest, gemma3:12b, llama3.1:70b"
 DEFAULT_UML_MODELS = "gemma3:27b, qwen2.5-coder:7b, deepseek-coder-v2:latest, codellama:7b, llama3.1:70b"
 DEFAULT_VALIDATION_MODELS = "gemma3:4b, magicoder:latest, codellama:7b"
 DEFAULT_NUM_CTX = 4096
+DEFAULT_LOADING_RETRIES = 3
+DEFAULT_LOADING_BACKOFF_SECONDS = 2.0
 
 
-def _parse_models(value: Optional[Iterable[str] | str]) -> List[str]:
+def parse_models(value: Optional[Iterable[str] | str]) -> List[str]:
     """
     Normalize comma or list-based model definitions into a clean list.
     """
@@ -55,17 +70,19 @@ class MultiOllamaPipelineClient:
         validator_models: Optional[Sequence[str] | str] = None,
         num_ctx: Optional[int] = None,
         timeout_seconds: int = 180,
+        stream: Optional[bool] = None,
+        hedge_stages: Optional[Sequence[str] | str] = None,
         **_: object,
     ):
         self.timeout_seconds = timeout_seconds
         self.host = (host or os.getenv("OLLAMA_HOST") or "http://localhost:11434").rstrip("/")
-        self.ideation_models = _parse_models(
+        self.ideation_models = parse_models(
             ideation_models or os.getenv("OLLAMA_IDEATION_MODELS") or DEFAULT_IDEATION_MODELS
         )
-        self.uml_models = _parse_models(
+        self.uml_models = parse_models(
             uml_models or os.getenv("OLLAMA_UML_MODELS") or DEFAULT_UML_MODELS
         )
-        self.validator_models = _parse_models(
+        self.validator_models = parse_models(
             validator_models or os.getenv("OLLAMA_VALIDATION_MODELS") or DEFAULT_VALIDATION_MODELS
         )
         self.num_ctx = _parse_num_ctx(num_ctx or os.getenv("OLLAMA_NUM_CTX") or os.getenv("OLLAMA_CONTEXT_WINDOW") or DEFAULT_NUM_CTX)
@@ -76,28 +93,41 @@ class MultiOllamaPipelineClient:
             self.validator_models = [m for m in self.validator_models if m in available] or self.validator_models
             logger.info("[ollama-pipeline] available_models=%s filtered_ideation=%s filtered_uml=%s filtered_validator=%s", available, self.ideation_models, self.uml_models, self.validator_models)
         self.timeout_seconds = timeout_seconds
+        self.stream = streaming_enabled(stream)
+        self.cut_at_enduml = stream_cutoff_enabled()
+        self.health = get_health_tracker(self.host)
+        self.loading_retries = max(env_int("OLLAMA_LOADING_RETRIES", DEFAULT_LOADING_RETRIES, positive=False), 0)
+        self.hedge_stages = {m.lower() for m in parse_models(hedge_stages)} if hedge_stages is not None else hedge_stages_from_env()
+        self.hedge_delay_seconds = env_number("OLLAMA_HEDGE_DELAY_SECONDS", DEFAULT_HEDGE_DELAY_SECONDS)
+        self.hedge_percentile = env_number("OLLAMA_HEDGE_PERCENTILE", 0) or None
         self.debug = (os.getenv("OLLAMA_PIPELINE_DEBUG") or "").lower() in ("1", "true", "yes", "on")
 
     # --- internal helpers -------------------------------------------------
-    def _post(self, model: str, prompt: str, num_ctx: Optional[int] = None) -> str:
+    def _post(self, model: str, prompt: str, num_ctx: Optional[int] = None, cut_at_enduml: bool = False, cancel: Optional[CancelToken] = None) -> str:
         url = f"{self.host}/api/generate"
-        logger.info("[ollama-pipeline] sending prompt to model=%s url=%s", model, url)
+        logger.info("[ollama-pipeline] sending prompt to model=%s url=%s stream=%s", model, url, self.stream)
         print(f"[ollama-pipeline] -> model={model} len(prompt)={len(prompt)}")
-        data = {"stream": False, "model": model, "prompt": prompt}
+        data = {"stream": self.stream, "model": model, "prompt": prompt}
         ctx = num_ctx or self.num_ctx
         if ctx:
             data["options"] = {"num_ctx": ctx}
-        resp = requests.post(url, json=data, timeout=self.timeout_seconds)
-        resp.raise_for_status()
-        return resp.json().get("response", "")
+        resp = get_session_pool().post(self.host, "/api/generate", json=data, timeout=self.timeout_seconds, stream=self.stream)
+        if not self.stream:
+            resp.raise_for_status()
+            return resp.json().get("response", "")
+        try:
+            resp.raise_for_status()
+        except Exception:
+            resp.close()
+            raise
+        return read_generate_stream(resp, cut_at_enduml=cut_at_enduml, cancel=cancel)
 
     def _list_models(self) -> List[str]:
         """
         Fetch available models from the Ollama host to avoid calling missing ones.
         """
         try:
-            url = f"{self.host}/api/tags"
-            resp = requests.get(url, timeout=self.timeout_seconds)
+            resp = get_session_pool().get(self.host, "/api/tags", timeout=self.timeout_seconds)
             resp.raise_for_status()
             data = resp.json() or {}
             models = data.get("models") or data.get("model") or []
@@ -107,19 +137,106 @@ class MultiOllamaPipelineClient:
             logger.warning("[ollama-pipeline] unable to list models from %s: %s", getattr(self, "host", "?"), exc)
             return []
 
-    def _generate_with_candidates(self, models: List[str], prompt: str, num_ctx: Optional[int] = None) -> str:
+    def _post_with_backoff(self, model: str, prompt: str, num_ctx: Optional[int] = None, cut_at_enduml: bool = False, cancel: Optional[CancelToken] = None) -> str:
+        """
+        Ollama answers 503 while a model is still loading (or the queue is full).
+        Wait and retry the same model instead of treating it as broken.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._post(model, prompt, num_ctx=num_ctx, cut_at_enduml=cut_at_enduml, cancel=cancel)
+            except requests.HTTPError as exc:
+                response = exc.response
+                if response is None or response.status_code != 503 or attempt >= self.loading_retries:
+                    raise
+                if cancel is not None and cancel.cancelled:
+                    raise GenerationCancelled() from exc
+                delay = _retry_after_seconds(response) or DEFAULT_LOADING_BACKOFF_SECONDS * (2 ** attempt)
+                logger.info("[ollama-pipeline] model=%s busy/loading (503); retrying in %.1fs", model, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _attempt(self, model: str, prompt: str, num_ctx: Optional[int] = None, cut_at_enduml: bool = False, cancel: Optional[CancelToken] = None, cacheable: bool = True) -> str:
+        """
+        One model attempt with health bookkeeping. Cancelled hedge losers are not failures.
+        Cached responses are returned before any bookkeeping so they do not skew latency.
+        """
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        cache = get_llm_cache() if cacheable else None
+        key = None
+        if cache is not None:
+            key = cache_key(model, prompt, num_ctx=num_ctx or self.num_ctx, options={"cutAtEnduml": cut_at_enduml}, host=self.host)
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info("[ollama-pipeline] model=%s served from llm cache", model)
+                return cached
+        started = time.perf_counter()
+        try:
+            result = self._post_with_backoff(model, prompt, num_ctx=num_ctx, cut_at_enduml=cut_at_enduml, cancel=cancel)
+        except GenerationCancelled:
+            logger.info("[ollama-pipeline] model=%s cancelled", model)
+            raise
+        except Exception as exc:
+            self.health.record_failure(model, timeout=_is_timeout(exc))
+            raise
+        self.health.record_success(model, time.perf_counter() - started)
+        if key is not None:
+            cache.put(key, result, model=model)
+        if self.debug:
+            logger.info("[ollama-pipeline] model=%s output_preview=%s", model, (result[:400] + ("..." if len(result) > 400 else "")))
+        return result
+
+    def _generate_with_candidates(self, models: List[str], prompt: str, num_ctx: Optional[int] = None, cut_at_enduml: bool = False, cancel: Optional[CancelToken] = None, cacheable: bool = True) -> str:
+        """Try `models` in the given order (already ranked by the health tracker)."""
         errors = []
         for model in models:
             try:
-                result = self._post(model, prompt, num_ctx=num_ctx)
-                if self.debug:
-                    logger.info("[ollama-pipeline] model=%s output_preview=%s", model, (result[:400] + ("..." if len(result) > 400 else "")))
-                return result
+                return self._attempt(model, prompt, num_ctx=num_ctx, cut_at_enduml=cut_at_enduml, cancel=cancel, cacheable=cacheable)
+            except GenerationCancelled:
+                raise
             except Exception as exc:  # keep going to the next available model
                 logger.exception("[ollama-pipeline] model=%s failed", model)
                 errors.append(f"{model}: {repr(exc)}")
         raise RuntimeError(f"All Ollama model attempts failed: {' | '.join(errors)}")
 
+    def _generate_for_stage(self, stage: str, models: List[str], prompt: str, num_ctx: Optional[int] = None, cut_at_enduml: bool = False, cancel: Optional[CancelToken] = None) -> str:
+        """
+        Route a stage through hedging when it is listed in OLLAMA_HEDGE_STAGES:
+        the first two healthy candidates race (the second starts after the hedge
+        delay) and the remaining ones are tried in order if both fail.
+        Hedging needs streaming: without it a losing request cannot be cancelled
+        and would only double the load, so stages run unhedged when OLLAMA_STREAM=0.
+        `cancel` abandons the stage (including both hedged candidates). Refine
+        stages bypass the LLM cache (see llm_cache.UNCACHED_STAGES).
+        """
+        ordered = self.health.order(models)
+        cacheable = stage_cacheable(stage)
+        if not self.stream or stage not in self.hedge_stages or len(ordered) < 2:
+            return self._generate_with_candidates(ordered, prompt, num_ctx=num_ctx, cut_at_enduml=cut_at_enduml, cancel=cancel, cacheable=cacheable)
+
+        delay = hedge_stats().delay_for(stage, self.hedge_delay_seconds, self.hedge_percentile)
+        primary, secondary = ordered[0], ordered[1]
+        try:
+            model, result = hedged_call(
+                stage,
+                primary,
+                secondary,
+                lambda m, token: self._attempt(m, prompt, num_ctx=num_ctx, cut_at_enduml=cut_at_enduml, cancel=token, cacheable=cacheable),
+                delay,
+                cancel=cancel,
+            )
+            logger.info("[ollama-pipeline] stage=%s hedge winner=%s", stage, model)
+            return result
+        except GenerationCancelled:
+            raise
+        except Exception as exc:
+            if len(ordered) <= 2:
+                raise RuntimeError(f"All Ollama model attempts failed: {primary}, {secondary}: {repr(exc)}") from exc
+            logger.warning("[ollama-pipeline] stage=%s hedged pair failed (%s); trying remaining models", stage, exc)
+            return self._generate_with_candidates(ordered[2:], prompt, num_ctx=num_ctx, cut_at_enduml=cut_at_enduml, cancel=cancel, cacheable=cacheable)
+
     @staticmethod
     def _extract_plantuml(text: str) -> str:
         """
@@ -147,7 +264,7 @@ class MultiOllamaPipelineClient:
             return False
         return lines[0].lower().startswith("@startuml") and lines[-1].lower().startswith("@enduml")
 
-    def _validate_with_llm(self, plantuml: str, original_prompt: str, analyst_notes: str, validator_models: Optional[List[str]] = None, num_ctx: Optional[int] = None) -> str:
+    def _validate_with_llm(self, plantuml: str, original_prompt: str, analyst_notes: str, validator_models: Optional[List[str]] = None, num_ctx: Optional[int] = None, cancel: Optional[CancelToken] = None) -> str:
         validators = validator_models if validator_models is not None else self.validator_models
         if not validators:
             return plantuml
@@ -161,12 +278,14 @@ class MultiOllamaPipelineClient:
         )
         try:
             validated = self._extract_plantuml(
-                self._generate_with_candidates(validators, validation_prompt, num_ctx=num_ctx)
+                self._generate_for_stage("validation", validators, validation_prompt, num_ctx=num_ctx, cut_at_enduml=self.cut_at_enduml, cancel=cancel)
             )
             if not self._looks_like_plantuml(validated):
                 logger.warning("[ollama-pipeline] validator returned non-PlantUML output; keeping original diagram.")
                 return plantuml
             return validated
+        except GenerationCancelled:
+            raise
         except Exception:
             # If validation fails, fallback to the unvalidated version.
             return plantuml
@@ -177,7 +296,7 @@ class MultiOllamaPipelineClient:
         Generic text generation using the ideation list (or UML list as fallback).
         """
         candidates = self.ideation_models or self.uml_models
-        return self._generate_with_candidates(candidates, prompt)
+        return self._generate_for_stage("generate", candidates, prompt)
 
     def prompt_to_uml(
         self,
@@ -185,6 +304,7 @@ class MultiOllamaPipelineClient:
         diagram_type: Optional[str] = None,
         pipeline_prompts: Optional[dict] = None,
         pipeline_models: Optional[dict] = None,
+        cancel: Optional[CancelToken] = None,
     ) -> str:
         # Respect provided diagram_type/pipeline prompts first; otherwise infer.
         diagram_hint = (pipeline_prompts or {}).get("diagram_type") or diagram_type or self._detect_diagram_type(prompt)
@@ -198,15 +318,15 @@ class MultiOllamaPipelineClient:
 
         if pipeline_models:
             if "ideation" in pipeline_models:
-                override = _parse_models(pipeline_models.get("ideation"))
+                override = parse_models(pipeline_models.get("ideation"))
                 if override:
                     ideation_models = override
             if "uml" in pipeline_models:
-                override = _parse_models(pipeline_models.get("uml"))
+                override = parse_models(pipeline_models.get("uml"))
                 if override:
                     uml_models = override
             if "validation" in pipeline_models:
-                validator_models = _parse_models(pipeline_models.get("validation"))
+                validator_models = parse_models(pipeline_models.get("validation"))
             if "contextWindow" in pipeline_models or "num_ctx" in pipeline_models:
                 override_ctx = _parse_num_ctx(pipeline_models.get("contextWindow") or pipeline_models.get("num_ctx"))
                 if override_ctx:
@@ -220,17 +340,17 @@ class MultiOllamaPipelineClient:
             logger.info("[ollama-pipeline] using direct UML generation (no ideation)")
             print("[ollama-pipeline] path=direct")
             direct_prompt = uml_prompt_template or self._build_non_class_prompt(prompt, diagram_hint)
-            plantuml = self._extract_plantuml(self._generate_with_candidates(uml_models, direct_prompt, num_ctx=num_ctx))
+            plantuml = self._extract_plantuml(self._generate_for_stage("uml", uml_models, direct_prompt, num_ctx=num_ctx, cut_at_enduml=self.cut_at_enduml, cancel=cancel))
             if self.debug:
                 logger.info("[ollama-pipeline] plantuml_candidate=%s", plantuml)
-            return self._validate_with_llm(plantuml, prompt, analyst_notes="", validator_models=validator_models, num_ctx=num_ctx)
+            return self._validate_with_llm(plantuml, prompt, analyst_notes="", validator_models=validator_models, num_ctx=num_ctx, cancel=cancel)
 
         # Class diagrams: run ideation unless explicitly skipped.
         effective_ideation = ideation_prompt or self._default_class_ideation_prompt(prompt)
         logger.info("[ollama-pipeline] running ideation with models=%s", ideation_models)
         print(f"[ollama-pipeline] path=class ideation_models={ideation_models}")
-        analyst_notes = self._generate_with_candidates(
-            ideation_models or uml_models, effective_ideation, num_ctx=num_ctx
+        analyst_notes = self._generate_for_stage(
+            "ideation", ideation_models or uml_models, effective_ideation, num_ctx=num_ctx, cancel=cancel
         )
         if self.debug:
             logger.info("[ollama-pipeline] ideation_notes=%s", analyst_notes)
@@ -241,12 +361,12 @@ class MultiOllamaPipelineClient:
 
         logger.info("[ollama-pipeline] generating UML with models=%s", uml_models)
         print(f"[ollama-pipeline] path=uml_generation uml_models={uml_models}")
-        plantuml = self._extract_plantuml(self._generate_with_candidates(uml_models, uml_prompt_text, num_ctx=num_ctx))
+        plantuml = self._extract_plantuml(self._generate_for_stage("uml", uml_models, uml_prompt_text, num_ctx=num_ctx, cut_at_enduml=self.cut_at_enduml, cancel=cancel))
         if self.debug:
             logger.info("[ollama-pipeline] plantuml_candidate=%s", plantuml)
 
         # Stage 3: optional LLM-based syntax validation/fixing.
-        return self._validate_with_llm(plantuml, prompt, analyst_notes, validator_models=validator_models, num_ctx=num_ctx)
+        return self._validate_with_llm(plantuml, prompt, analyst_notes, validator_models=validator_models, num_ctx=num_ctx, cancel=cancel)
 
     def explain_model(self, model: str) -> str:
         explain_prompt = f"Explain this UML model briefly:\n\n{model}"
@@ -428,11 +548,18 @@ class MultiOllamaPipelineClient:
             f"Current PlantUML:\n{model}\n\n"
             f"Feedback:\n{feedback}"
         )
-        updated = self._extract_plantuml(self._generate_with_candidates(self.uml_models, refine_prompt))
+        updated = self._extract_plantuml(self._generate_for_stage("refine", self.uml_models, refine_prompt, cut_at_enduml=self.cut_at_enduml))
         if self.debug:
             logger.info("[ollama-pipeline] refined_candidate=%s", updated)
         return self._validate_with_llm(updated, feedback, model)
 
+    def refine_region(self, prompt: str) -> str:
+        """
+        Rewrite a fragment of a diagram with the UML models. The LLM validator is skipped:
+        it expects a whole diagram and the spliced result is re-validated by the caller.
+        """
+        return self._generate_for_stage("refine", self.uml_models, prompt)
+
     def generate_code(self, model: str) -> str:
         """
         Optional compatibility hook; reuse UML models to translate diagrams into code.
@@ -442,7 +569,7 @@ class MultiOllamaPipelineClient:
             "Choose reasonable defaults for types and keep output concise.\n\n"
             f"PlantUML:\n{model}"
         )
-        return self._generate_with_candidates(self.uml_models, code_prompt)
+        return self._generate_for_stage("code", self.uml_models, code_prompt)
 def _parse_num_ctx(value: Optional[str | int]) -> Optional[int]:
     """
     Convert an env/JSON value to a positive int for Ollama's num_ctx.
@@ -454,3 +581,16 @@ def _parse_num_ctx(value: Optional[str | int]) -> Optional[int]:
         return num if num > 0 else None
     except Exception:
         return None
+
+
+def _retry_after_seconds(response) -> Optional[float]:
+    try:
+        value = float(response.headers.get("Retry-After", ""))
+        return value if value > 0 else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    # Streaming reads surface urllib3 read timeouts as ConnectionError, so check the message too.
+    return isinstance(exc, requests.Timeout) or "timed out" in str(exc).lower()
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+from app.util.env import env_number
+
+# Days to keep each kind of record; 0 keeps it forever. Overridden by RETENTION_<KIND>_DAYS.
+DEFAULT_POLICIES: Dict[str, float] = {
+    "model": 30,     # raw LLM output saved next to each diagram (ModelStoreAdapter)
+    "diagram": 0,    # diagram records are user data
+    "history": 90,   # undo/redo history, counted from the diagram's last refine/undo/redo
+}
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_BATCH_PAUSE_MS = 50
+DEFAULT_INTERVAL = 3600
+DEFAULT_DELAY = 60
+DEFAULT_VACUUM_PAGES = 1000
+DAY = 86400
+
+
+def sweeper_enabled() -> bool:
+    return (os.getenv("RETENTION_SWEEPER", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def retention_days(kind: str) -> float:
+    return max(env_number(f"RETENTION_{kind.upper()}_DAYS", DEFAULT_POLICIES.get(kind, 0), positive=False), 0.0)
+
+
+def expires_at(kind: str, now: Optional[float] = None) -> Optional[int]:
+    """Epoch-seconds expiry for a record of `kind` written at `now`, or None when it is kept forever."""
+    days = retention_days(kind)
+    return int((now or time.time()) + days * DAY) if days else None
+
+
+def stamp(item: Dict[str, Any], kind: str) -> Dict[str, Any]:
+    """Set createdAt (if missing) and expiresAt on a model store item; every save restarts its expiry."""
+    item.setdefault("createdAt", datetime.utcnow().isoformat())
+    expiry = expires_at(kind)
+    if expiry is not None:
+        item["expiresAt"] = expiry
+    else:
+        item.pop("expiresAt", None)
+    return item
+
+
+class RetentionSweeper:
+    """
+    Background thread that enforces the retention policies.
+
+    Each sweep deletes expired model store items (per `expiresAt`), and the
+    history of diagrams idle longer than the history policy. It works in
+    batches of RETENTION_BATCH_SIZE, one write transaction each, with
+    RETENTION_BATCH_PAUSE_MS between them, so a large backlog never holds the
+    write lock for long. It then checkpoints the WAL and runs an incremental
+    VACUUM on each SQLite file involved, so freed pages go back to the file
+    system. Items saved before expiry stamps existed get one on the first
+    sweep, counted from that moment.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, interval: Optional[float] = None) -> None:
+        self.batch_size = int(batch_size or env_number("RETENTION_BATCH_SIZE", DEFAULT_BATCH_SIZE, positive=False))
+        self.batch_pause = env_number("RETENTION_BATCH_PAUSE_MS", DEFAULT_BATCH_PAUSE_MS, positive=False) / 1000.0
+        self.interval = interval or env_number("RETENTION_SWEEP_INTERVAL", DEFAULT_INTERVAL, positive=False)
+        self.vacuum_pages = int(env_number("RETENTION_VACUUM_PAGES", DEFAULT_VACUUM_PAGES, positive=False))
+        self.full_vacuum = (os.getenv("RETENTION_FULL_VACUUM", "0").lower() in ("1", "true", "yes", "on"))
+        self._stores: Dict[str, Any] = {}
+        self._histories: Dict[str, Any] = {}
+        self._stamped: set = set()
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._counters: Dict[str, Any] = {"sweeps": 0, "modelsExpired": 0, "historiesPruned": 0, "stamped": 0, "failures": 0}
+        self._last: Dict[str, Any] = {}
+
+    @staticmethod
+    def _key(target: Any) -> str:
+        path = getattr(target, "_db_path", None) or getattr(target, "db_path", None) or getattr(target, "_path", None)
+        return f"{type(target).__name__}:{path or id(target)}"
+
+    def register_store(self, store: Any) -> None:
+        """Sweep a BaseModelStore; several handlers sharing one file register it once."""
+        with self._lock:
+            self._stores.setdefault(self._key(store), store)
+
+    def register_history(self, repo: Any) -> None:
+        """Prune a command history repository that supports prune(idle_before_ms, limit)."""
+        if hasattr(repo, "prune"):
+            with self._lock:
+                self._histories.setdefault(self._key(repo), repo)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="retention-sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        time.sleep(env_number("RETENTION_SWEEP_DELAY", DEFAULT_DELAY, positive=False))
+        while True:
+            try:
+                self.sweep()
+            except Exception as exc:
+                with self._lock:
+                    self._counters["failures"] += 1
+                print(f"[retention] sweep failed: {exc}")
+            time.sleep(self.interval)
+
+    def _batches(self, step) -> int:
+        """Call `step(limit)` until it returns a short batch; returns the total."""
+        total = 0
+        while True:
+            done = step(self.batch_size)
+            total += done
+            if done < self.batch_size:
+                return total
+            time.sleep(self.batch_pause)
+
+    def _stamp_legacy(self, store: Any, now: float) -> int:
+        """Give items of each expiring type that predate expiry stamps an expiry, once per store."""
+        key = self._key(store)
+        if key in self._stamped:
+            return 0
+        stamped = 0
+        for kind in ("model", "diagram"):
+            expiry = expires_at(kind, now)
+            if expiry is not None:
+                stamped += self._batches(lambda limit: store.stamp_expiry(kind, expiry, limit))
+        self._stamped.add(key)
+        return stamped
+
+    def expire_store(self, store: Any) -> int:
+        """Delete every expired item of `store` now, batch by batch; returns how many."""
+        with self._sweep_lock:
+            now = time.time()
+            stamped = self._stamp_legacy(store, now)
+            expired = self._batches(lambda limit: store.expire(now, limit))
+        with self._lock:
+            self._counters["stamped"] += stamped
+            self._counters["modelsExpired"] += expired
+        return expired
+
+    def prune_history(self, repo: Any) -> int:
+        days = retention_days("history")
+        if not days:
+            return 0
+        idle_before_ms = int((time.time() - days * DAY) * 1000)
+        with self._sweep_lock:
+            pruned = self._batches(lambda limit: repo.prune(idle_before_ms, limit))
+        with self._lock:
+            self._counters["historiesPruned"] += pruned
+        return pruned
+
+    def sweep(self) -> Dict[str, Any]:
+        """Run one full pass now (also what the cleanup handler calls); returns what it did."""
+        with self._sweep_lock:
+            started = time.perf_counter()
+            with self._lock:
+                stores, histories = list(self._stores.values()), list(self._histories.values())
+            expired = sum(self.expire_store(store) for store in stores)
+            pruned = sum(self.prune_history(repo) for repo in histories)
+            maintenance = {}
+            paths = {getattr(t, "_db_path", None) or getattr(t, "db_path", None) for t in stores + histories}
+            for path in sorted(p for p in paths if p and os.path.exists(p)):
+                maintenance[path] = get_connection_manager(path).maintain(self.vacuum_pages, self.full_vacuum)
+            result = {
+                "modelsExpired": expired,
+                "historiesPruned": pruned,
+                "maintenance": maintenance,
+                "seconds": round(time.perf_counter() - started, 4),
+                "at": datetime.utcnow().isoformat(),
+            }
+            with self._lock:
+                self._counters["sweeps"] += 1
+                self._last = result
+            if expired or pruned:
+                print(f"[retention] expired {expired} models, pruned {pruned} histories in {result['seconds']}s")
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": sweeper_enabled(),
+                "running": self._thread is not None and self._thread.is_alive(),
+                **self._counters,
+                "policiesDays": {kind: retention_days(kind) for kind in DEFAULT_POLICIES},
+                "targets": sorted(list(self._stores) + list(self._histories)),
+                "last": self._last,
+            }
+
+
+_SWEEPER: Optional[RetentionSweeper] = None
+_SWEEPER_LOCK = threading.Lock()
+
+
+def get_retention_sweeper() -> RetentionSweeper:
+    """Process-wide sweeper; its background thread only runs once start() is called."""
+    global _SWEEPER
+    if _SWEEPER is None:
+        with _SWEEPER_LOCK:
+            if _SWEEPER is None:
+                _SWEEPER = RetentionSweeper()
+    return _SWEEPER
+
+
+def retention_stats() -> Dict[str, Any]:
+    return _SWEEPER.stats() if _SWEEPER is not None else {"enabled": sweeper_enabled()}
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import os
+import re
+import json
+import array
+import hashlib
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:  # numpy makes the similarity scan a single matrix-vector product
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only when numpy is absent
+    np = None
+
+from app.infrastructure.internal.ollama_http import get_session_pool
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+from app.util.env import env_number
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR_DEFAULT = "/var/lib/nl2uml"
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_EMBED_TIMEOUT_SECONDS = 15.0
+EMBED_MEMO_SIZE = 256
+
+
+def semantic_cache_enabled() -> bool:
+    return (os.getenv("SEMANTIC_CACHE", "0").lower() in ("1", "true", "yes", "on"))
+
+
+def normalize_prompt(text: str) -> str:
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+def _unit(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else list(vector)
+
+
+class OllamaEmbedder:
+    """Embeds text through Ollama's /api/embeddings with a small memo for repeated prompts."""
+
+    def __init__(self, host: Optional[str] = None, model: Optional[str] = None, timeout_seconds: Optional[float] = None) -> None:
+        self.host = (host or os.getenv("OLLAMA_HOST") or "http://localhost:11434").rstrip("/")
+        self.model = model or os.getenv("OLLAMA_EMBED_MODEL") or DEFAULT_EMBED_MODEL
+        self.timeout_seconds = timeout_seconds or env_number("OLLAMA_EMBED_TIMEOUT_SECONDS", DEFAULT_EMBED_TIMEOUT_SECONDS)
+        self._memo: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> List[float]:
+        with self._lock:
+            cached = self._memo.get(text)
+            if cached is not None:
+                self._memo.move_to_end(text)
+                return cached
+        resp = get_session_pool().post(
+            self.host, "/api/embeddings", json={"model": self.model, "prompt": text}, timeout=self.timeout_seconds
+        )
+        resp.raise_for_status()
+        embedding = (resp.json() or {}).get("embedding") or []
+        if not embedding:
+            raise RuntimeError(f"Ollama returned no embedding for model={self.model}")
+        vector = _unit([float(v) for v in embedding])
+        with self._lock:
+            self._memo[text] = vector
+            while len(self._memo) > EMBED_MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return vector
+
+
+class _Partition:
+    def __init__(self) -> None:
+        self.ids: List[int] = []
+        self.vectors: List[List[float]] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self._matrix = None
+
+    def matrix(self):
+        if self._matrix is None and self.vectors:
+            self._matrix = np.asarray(self.vectors, dtype=np.float32)
+        return self._matrix
+
+    def add(self, row_id: int, vector: List[float], payload: Dict[str, Any], max_entries: int) -> List[int]:
+        self.ids.append(row_id)
+        self.vectors.append(vector)
+        self.payloads.append(payload)
+        self._matrix = None
+        dropped = []
+        while len(self.ids) > max_entries:
+            dropped.append(self.ids.pop(0))
+            self.vectors.pop(0)
+            self.payloads.pop(0)
+        return dropped
+
+    def best(self, vector: List[float]) -> Tuple[int, float]:
+        if not self.vectors:
+            return -1, 0.0
+        if np is not None:
+            matrix = self.matrix()
+            if matrix.shape[1] != len(vector):
+                return -1, 0.0
+            scores = matrix @ np.asarray(vector, dtype=np.float32)
+            idx = int(scores.argmax())
+            return idx, float(scores[idx])
+        best_idx, best_score = -1, -1.0
+        for idx, stored in enumerate(self.vectors):
+            if len(stored) != len(vector):
+                continue
+            score = sum(a * b for a, b in zip(stored, vector))
+            if score > best_score:
+                best_idx, best_score = idx, score
+        return best_idx, best_score
+
+
+class SemanticPromptCache:
+    """
+    Near-duplicate prompt cache. Each partition (diagram type, agent and template
+    context, chosen by the caller) holds unit-length prompt embeddings and the
+    validated diagram generated for them; a lookup returns the stored diagram of
+    the most similar prompt when cosine similarity reaches SEMANTIC_CACHE_THRESHOLD.
+    Entries are persisted to SQLite under DATA_DIR and loaded per partition on
+    first use.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[OllamaEmbedder] = None,
+        db_path: Optional[str] = None,
+        threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        self.embedder = embedder or OllamaEmbedder()
+        data_dir = os.getenv("DATA_DIR", DATA_DIR_DEFAULT)
+        self.db_path = db_path or os.getenv("SEMANTIC_CACHE_PATH") or os.path.join(data_dir, "db", "semantic_cache.sqlite")
+        self.threshold = threshold or env_number("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)
+        self.max_entries = int(max_entries or env_number("SEMANTIC_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self._partitions: Dict[str, _Partition] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "embedErrors": 0}
+        self._disk_ok = True
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db().write(self._create_schema)
+        except Exception as exc:
+            logger.warning("[semantic-cache] persistence disabled (%s): %s", self.db_path, exc)
+            self._disk_ok = False
+
+    def _db(self):
+        return get_connection_manager(self.db_path)
+
+    @staticmethod
+    def _create_schema(conn) -> None:
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS semantic_cache (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   partition TEXT NOT NULL,
+                   prompt TEXT NOT NULL,
+                   vector BLOB NOT NULL,
+                   payload TEXT NOT NULL,
+                   created_at REAL NOT NULL
+               )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_semantic_cache_partition ON semantic_cache(partition, id)")
+
+    def _partition_key(self, partition: str) -> str:
+        # Vectors from different embedding models are not comparable.
+        return f"{self.embedder.model}|{partition}"
+
+    def _partition(self, key: str) -> _Partition:
+        part = self._partitions.get(key)
+        if part is not None:
+            return part
+        part = _Partition()
+        if self._disk_ok:
+            try:
+                with self._db().connection() as conn:
+                    rows = conn.execute(
+                        "SELECT id, vector, payload FROM semantic_cache WHERE partition=? ORDER BY id DESC LIMIT ?",
+                        (key, self.max_entries),
+                    ).fetchall()
+                for row_id, blob, payload in reversed(rows):
+                    part.add(row_id, array.array("f", blob).tolist(), json.loads(payload), self.max_entries)
+            except sqlite3.Error as exc:
+                logger.warning("[semantic-cache] failed to load partition: %s", exc)
+        self._partitions[key] = part
+        return part
+
+    def _embed(self, prompt: str) -> Optional[List[float]]:
+        try:
+            return self.embedder.embed(normalize_prompt(prompt))
+        except Exception as exc:
+            with self._lock:
+                self._counters["embedErrors"] += 1
+            logger.warning("[semantic-cache] embedding failed: %s", exc)
+            return None
+
+    def lookup(self, prompt: str, partition: str) -> Optional[Dict[str, Any]]:
+        vector = self._embed(prompt)
+        if vector is None:
+            return None
+        with self._lock:
+            part = self._partition(self._partition_key(partition))
+            idx, score = part.best(vector)
+            if idx >= 0 and score >= self.threshold:
+                self._counters["hits"] += 1
+                logger.info("[semantic-cache] hit partition=%s similarity=%.4f", partition, score)
+                return dict(part.payloads[idx], similarity=round(score, 4))
+            self._counters["misses"] += 1
+        return None
+
+    def store(self, prompt: str, partition: str, payload: Dict[str, Any]) -> None:
+        vector = self._embed(prompt)
+        if vector is None:
+            return
+        key = self._partition_key(partition)
+        row_id = -1
+        if self._disk_ok:
+            try:
+                row_id = self._db().write(lambda conn: conn.execute(
+                    "INSERT INTO semantic_cache (partition, prompt, vector, payload, created_at) VALUES (?,?,?,?,?)",
+                    (key, prompt, array.array("f", vector).tobytes(), json.dumps(payload), time.time()),
+                ).lastrowid)
+            except sqlite3.Error as exc:
+                logger.warning("[semantic-cache] failed to persist entry: %s", exc)
+        with self._lock:
+            dropped = self._partition(key).add(row_id, vector, payload, self.max_entries)
+            self._counters["stores"] += 1
+        dropped = [(i,) for i in dropped if i >= 0]
+        if dropped and self._disk_ok:
+            try:
+                self._db().write(lambda conn: conn.executemany("DELETE FROM semantic_cache WHERE id=?", dropped))
+            except sqlite3.Error as exc:
+                logger.warning("[semantic-cache] failed to trim partition: %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counters)
+            lookups = out["hits"] + out["misses"]
+            out["hitRate"] = round(out["hits"] / lookups, 3) if lookups else 0.0
+            out["partitions"] = {key: len(part.ids) for key, part in self._partitions.items()}
+        out["threshold"] = self.threshold
+        out["embedModel"] = self.embedder.model
+        out["numpy"] = np is not None
+        return out
+
+
+_CACHE: Optional[SemanticPromptCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticPromptCache]:
+    """Process-wide cache, or None when SEMANTIC_CACHE is off."""
+    global _CACHE
+    if not semantic_cache_enabled():
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = SemanticPromptCache()
+    return _CACHE
+
+
+def semantic_cache_stats() -> Dict[str, Any]:
+    return _CACHE.stats() if _CACHE is not None else {"enabled": semantic_cache_enabled()}
+
+
+def semantic_partition(diagram_type: Optional[str], agent_type: Optional[str], full_prompt: str, user_prompt: str, pipeline_models: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Entries are only comparable for the same diagram type, agent, models and
+    template context (e.g. the related class diagram), so those form the
+    partition. The context is hashed from the prompt with the user's text
+    removed; per-request model overrides (`ollamaModels`) are hashed as given.
+    """
+    context = (full_prompt or "").replace(user_prompt or "", "")
+    fingerprint = hashlib.sha256(context.encode("utf-8")).hexdigest()[:16]
+    partition = f"{(diagram_type or '').lower()}|{agent_type or 'default'}|{fingerprint}"
+    if pipeline_models:
+        models = json.dumps(pipeline_models, sort_keys=True, default=str)
+        partition += f"|{hashlib.sha256(models.encode('utf-8')).hexdigest()[:16]}"
+    return partition
@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import os
+import re
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.util.env import env_int, env_number
+
+DEFAULT_PROFILE = "default"
+DEFAULT_STATEMENT_CACHE = 256
+DEFAULT_WRITE_BATCH = 64
+DEFAULT_WRITE_BATCH_WAIT_MS = 2.0
+SLOW_QUERY_LIMIT = 10
+
+# cache_size is in KiB (negative, per SQLite convention), mmap_size in bytes.
+PROFILES: Dict[str, Dict[str, int]] = {
+    "default": {"cache_size": -8192, "mmap_size": 0},
+    "read_heavy": {"cache_size": -65536, "mmap_size": 256 * 1024 * 1024},
+    "low_memory": {"cache_size": -2048, "mmap_size": 0},
+}
+
+_WS_RE = re.compile(r"\s+")
+
+
+def persistent_connections_enabled() -> bool:
+    return (os.getenv("SQLITE_PERSISTENT_CONNECTIONS", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def write_queue_enabled() -> bool:
+    return (os.getenv("SQLITE_WRITE_QUEUE", "1").lower() in ("1", "true", "yes", "on"))
+
+
+def resolve_profile(name: Optional[str] = None) -> Dict[str, int]:
+    """PRAGMA values for a profile (SQLITE_PROFILE), with SQLITE_CACHE_SIZE_KB / SQLITE_MMAP_SIZE overrides."""
+    name = (name or os.getenv("SQLITE_PROFILE") or DEFAULT_PROFILE).lower()
+    profile = dict(PROFILES.get(name, PROFILES[DEFAULT_PROFILE]))
+    if os.getenv("SQLITE_CACHE_SIZE_KB"):
+        profile["cache_size"] = -abs(env_int("SQLITE_CACHE_SIZE_KB", -profile["cache_size"], positive=False))
+    if os.getenv("SQLITE_MMAP_SIZE"):
+        profile["mmap_size"] = max(env_int("SQLITE_MMAP_SIZE", profile["mmap_size"], positive=False), 0)
+    return profile
+
+
+class QueryStats:
+    """Per-statement counters (count, total and max seconds) for one database file."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._statements: Dict[str, list] = {}
+        self.connections = 0
+
+    def record(self, sql: str, seconds: float) -> None:
+        key = _WS_RE.sub(" ", sql).strip()[:120]
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def opened(self) -> None:
+        with self._lock:
+            self.connections += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            items = [(sql, list(v)) for sql, v in self._statements.items()]
+            connections = self.connections
+        queries = sum(v[0] for _, v in items)
+        total = sum(v[1] for _, v in items)
+        slowest = sorted(items, key=lambda item: item[1][1], reverse=True)[:SLOW_QUERY_LIMIT]
+        return {
+            "connectionsOpened": connections,
+            "queries": queries,
+            "totalSeconds": round(total, 4),
+            "avgSeconds": round(total / queries, 6) if queries else 0.0,
+            "byTotalTime": [
+                {"sql": sql, "count": v[0], "totalSeconds": round(v[1], 4), "maxSeconds": round(v[2], 4)}
+                for sql, v in slowest
+            ],
+        }
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3.Connection that reports how long each execute and commit takes to its QueryStats."""
+
+    stats: Optional[QueryStats] = None
+
+    def execute(self, sql, parameters=(), /):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            if self.stats is not None:
+                self.stats.record(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters, /):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            if self.stats is not None:
+                self.stats.record(sql, time.perf_counter() - started)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            if self.stats is not None:
+                self.stats.record("COMMIT", time.perf_counter() - started)
+
+    def executescript(self, sql_script, /):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            if self.stats is not None:
+                self.stats.record("<script> " + sql_script, time.perf_counter() - started)
+
+
+class SqliteConnectionManager:
+    """
+    Hands out one configured connection per thread (and process) for a database
+    file instead of a fresh connection per call.
+
+    PRAGMAs run once when a thread's connection is opened, and each connection
+    keeps sqlite3's prepared-statement cache warm across calls. Connections are
+    usable as `with manager.connection() as cx:` exactly like the per-call
+    connections they replace: the block commits or rolls back but does not
+    close. A fork (gunicorn workers) gets fresh connections in the child.
+    """
+
+    def __init__(self, db_path: str, profile: Optional[str] = None) -> None:
+        self.db_path = db_path
+        self.profile = resolve_profile(profile)
+        self.statement_cache = env_int("SQLITE_STATEMENT_CACHE", DEFAULT_STATEMENT_CACHE, positive=False)
+        self.stats = QueryStats()
+        self._local = threading.local()
+        self._writer: Optional[WriteCoordinator] = None
+        self._writer_lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+
+    def _open(self) -> sqlite3.Connection:
+        cx = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=30.0,
+            factory=TimedConnection,
+            cached_statements=self.statement_cache,
+        )
+        cx.stats = self.stats
+        # Only takes effect on a new file (or after a full VACUUM); lets maintain() return free pages.
+        cx.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        cx.execute("PRAGMA journal_mode=WAL;")
+        cx.execute("PRAGMA synchronous=NORMAL;")
+        cx.execute("PRAGMA busy_timeout=30000;")
+        cx.execute(f"PRAGMA cache_size={int(self.profile['cache_size'])};")
+        cx.execute(f"PRAGMA mmap_size={int(self.profile['mmap_size'])};")
+        cx.execute("PRAGMA temp_store=MEMORY;")
+        cx.row_factory = sqlite3.Row
+        self.stats.opened()
+        return cx
+
+    def connection(self) -> sqlite3.Connection:
+        if not persistent_connections_enabled():
+            return self._open()
+        pid = os.getpid()
+        cx = getattr(self._local, "cx", None)
+        if cx is None or getattr(self._local, "pid", None) != pid:
+            cx = self._local.cx = self._open()
+            self._local.pid = pid
+        return cx
+
+    def write(self, job: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Run `job(cx)` as one write and return its result once it is committed.
+
+        With SQLITE_WRITE_QUEUE on (the default) the job runs on this file's
+        writer thread, so writers in this process never contend for the lock.
+        Jobs must not commit themselves. With the queue off, the job runs in its
+        own transaction on the calling thread's connection; either way a write
+        issued from inside a job joins that job's transaction.
+        """
+        if not write_queue_enabled():
+            active = getattr(self._local, "writing", None)
+            if active is not None:
+                # Nested write (e.g. a unit of work): join the outer transaction instead of committing early.
+                return job(active)
+            with self.connection() as cx:
+                self._local.writing = cx
+                try:
+                    return job(cx)
+                finally:
+                    self._local.writing = None
+        return self._get_writer().submit(job)
+
+    def _get_writer(self) -> "WriteCoordinator":
+        with self._writer_lock:
+            writer = self._writer
+            if writer is None or writer.pid != os.getpid() or writer.error is not None:
+                # A writer that could not open the file is replaced, so a transient failure is retried.
+                writer = self._writer = WriteCoordinator(self)
+            return writer
+
+    def maintain(self, vacuum_pages: int, full_vacuum: bool = False) -> Dict[str, object]:
+        """
+        Checkpoint and truncate the WAL, then give back up to `vacuum_pages`
+        free pages with an incremental vacuum. Files created before
+        auto_vacuum=INCREMENTAL was set only get the checkpoint, unless
+        `full_vacuum` converts them with a one-off (blocking) VACUUM.
+
+        This writes to the file, so with the write queue on it runs on the
+        writer thread between batches (VACUUM and checkpoints cannot run inside
+        its transactions) rather than racing it from a reader connection.
+        """
+        if not write_queue_enabled():
+            return self._maintain(self.connection(), vacuum_pages, full_vacuum)
+        return self._get_writer().submit(lambda cx: self._maintain(cx, vacuum_pages, full_vacuum), transaction=False)
+
+    @staticmethod
+    def _maintain(cx: sqlite3.Connection, vacuum_pages: int, full_vacuum: bool) -> Dict[str, object]:
+        mode = cx.execute("PRAGMA auto_vacuum").fetchone()[0]
+        out: Dict[str, object] = {"autoVacuum": mode, "freedPages": 0}
+        if mode != 2 and full_vacuum:
+            cx.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            cx.execute("VACUUM")
+            mode = out["autoVacuum"] = cx.execute("PRAGMA auto_vacuum").fetchone()[0]
+            out["fullVacuum"] = True
+        if mode == 2 and vacuum_pages > 0:
+            before = cx.execute("PRAGMA freelist_count").fetchone()[0]
+            cx.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+            out["freedPages"] = before - cx.execute("PRAGMA freelist_count").fetchone()[0]
+        busy, wal_pages, checkpointed = cx.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        out.update({"checkpointBusy": bool(busy), "walPages": wal_pages, "checkpointedPages": checkpointed})
+        return out
+
+    def write_stats(self) -> Optional[Dict[str, object]]:
+        writer = self._writer
+        return writer.stats() if writer is not None and writer.pid == os.getpid() else None
+
+
+class WriteCoordinator:
+    """
+    The single writer for one database file in this process.
+
+    Callers enqueue jobs and block on a future; the writer thread takes whatever
+    is queued (up to SQLITE_WRITE_BATCH jobs, waiting SQLITE_WRITE_BATCH_WAIT_MS
+    for stragglers) and runs them in one BEGIN IMMEDIATE ... COMMIT, each inside
+    its own savepoint so a failing job is rolled back without affecting the rest
+    of the batch. Group commit turns a burst of small writes into one fsync, and
+    because only this thread writes, nobody in the process waits on busy_timeout.
+    If the thread cannot open the file, queued and later jobs fail with that
+    error instead of waiting forever. Jobs submitted with transaction=False
+    (maintenance) run alone, between batches, in autocommit mode.
+    """
+
+    def __init__(self, manager: SqliteConnectionManager) -> None:
+        self.manager = manager
+        self.pid = os.getpid()
+        self.max_batch = max(env_int("SQLITE_WRITE_BATCH", DEFAULT_WRITE_BATCH, positive=False), 1)
+        self.batch_wait = max(env_number("SQLITE_WRITE_BATCH_WAIT_MS", DEFAULT_WRITE_BATCH_WAIT_MS, positive=False), 0.0) / 1000.0
+        self._jobs: "queue.Queue[Tuple[Callable[[sqlite3.Connection], Any], Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._counters = {"jobs": 0, "batches": 0, "failedJobs": 0, "failedCommits": 0, "maxBatch": 0, "waitSeconds": 0.0}
+        self.error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer-{os.path.basename(manager.db_path)}", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Callable[[sqlite3.Connection], Any], transaction: bool = True) -> Any:
+        if threading.current_thread() is self._thread:
+            # A job that writes through another repository on the same file joins the current batch.
+            return job(self._cx)
+        future: Future = Future()
+        future.enqueued_at = time.perf_counter()
+        future.transaction = transaction
+        with self._lock:
+            # Checked under the lock so a job cannot be queued after _fail() drained the queue.
+            if self.error is not None:
+                raise self.error
+            self._jobs.put((job, future))
+        return future.result()
+
+    def _fail(self, exc: BaseException) -> None:
+        with self._lock:
+            self.error = exc
+            while True:
+                try:
+                    _, future = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                future.set_exception(exc)
+
+    def _run(self) -> None:
+        try:
+            self._cx = self.manager._open()
+            self._cx.isolation_level = None  # explicit BEGIN/SAVEPOINT/COMMIT below
+        except Exception as exc:
+            print(f"[sqlite-writer] cannot open {self.manager.db_path}: {exc}")
+            self._fail(exc)
+            return
+        held = None
+        while True:
+            batch = [held or self._jobs.get()]
+            held = None
+            if not batch[0][1].transaction:
+                self._run_alone(*batch[0])
+                continue
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if not item[1].transaction:
+                    # Runs right after this batch commits.
+                    held = item
+                    break
+                batch.append(item)
+            try:
+                self._run_batch(batch)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def _run_alone(self, job: Callable[[sqlite3.Connection], Any], future: Future) -> None:
+        try:
+            result = job(self._cx)
+        except Exception as exc:
+            with self._lock:
+                self._counters["failedJobs"] += 1
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+        with self._lock:
+            self._counters["jobs"] += 1
+            self._counters["batches"] += 1
+            self._counters["waitSeconds"] += time.perf_counter() - future.enqueued_at
+
+    def _run_batch(self, batch: List[Tuple[Callable[[sqlite3.Connection], Any], Future]]) -> None:
+        cx = self._cx
+        results: List[Tuple[Future, bool, Any]] = []
+        try:
+            cx.execute("BEGIN IMMEDIATE")
+            for idx, (job, future) in enumerate(batch):
+                cx.execute(f"SAVEPOINT job_{idx}")
+                try:
+                    results.append((future, True, job(cx)))
+                    cx.execute(f"RELEASE job_{idx}")
+                except Exception as exc:
+                    cx.execute(f"ROLLBACK TO job_{idx}")
+                    cx.execute(f"RELEASE job_{idx}")
+                    results.append((future, False, exc))
+            cx.execute("COMMIT")
+        except Exception as exc:
+            if cx.in_transaction:
+                try:
+                    cx.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            print(f"[sqlite-writer] batch of {len(batch)} failed: {exc}")
+            with self._lock:
+                self._counters["failedCommits"] += 1
+            done = {id(f) for f, _, _ in results}
+            results = [(f, False, exc) for f, _, _ in results] + [(f, False, exc) for _, f in batch if id(f) not in done]
+
+        now = time.perf_counter()
+        with self._lock:
+            self._counters["jobs"] += len(batch)
+            self._counters["batches"] += 1
+            self._counters["maxBatch"] = max(self._counters["maxBatch"], len(batch))
+            self._counters["failedJobs"] += sum(1 for _, ok, _ in results if not ok)
+            self._counters["waitSeconds"] += sum(now - f.enqueued_at for _, f in batch)
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            out: Dict[str, object] = dict(self._counters)
+        jobs = out["jobs"] or 0
+        out["avgWaitSeconds"] = round(out.pop("waitSeconds") / jobs, 6) if jobs else 0.0
+        out["avgBatch"] = round(jobs / out["batches"], 2) if out["batches"] else 0.0
+        out["queued"] = self._jobs.qsize()
+        return out
+
+
+_MANAGERS: Dict[str, SqliteConnectionManager] = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def get_connection_manager(db_path: str) -> SqliteConnectionManager:
+    """Shared manager per database file, so every repository on that file reuses the same connections."""
+    key = os.path.abspath(db_path)
+    with _MANAGERS_LOCK:
+        manager = _MANAGERS.get(key)
+        if manager is None:
+            manager = _MANAGERS[key] = SqliteConnectionManager(key)
+        return manager
+
+
+def sqlite_stats() -> Dict[str, object]:
+    with _MANAGERS_LOCK:
+        items = list(_MANAGERS.items())
+    out: Dict[str, object] = {}
+    for path, manager in items:
+        snapshot = manager.stats.snapshot()
+        snapshot["writer"] = manager.write_stats()
+        out[path] = snapshot
+    return out
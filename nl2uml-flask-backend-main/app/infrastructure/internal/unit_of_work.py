@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+
+_LOCAL = threading.local()
+_COUNTERS = {"commits": 0, "writes": 0, "transactions": 0, "failures": 0, "discarded": 0}
+_COUNTERS_LOCK = threading.Lock()
+
+
+def _sqlite_path(target: Any) -> Optional[str]:
+    """Database file behind a SQLite store/repository (SqliteModelStore._db_path, Sqlite*Repository.db_path)."""
+    path = getattr(target, "_db_path", None) or getattr(target, "db_path", None)
+    return os.path.abspath(path) if isinstance(path, str) else None
+
+
+def _store_key(store: Any) -> str:
+    path = _sqlite_path(store)
+    if path:
+        return f"sqlite:{path}"
+    table = getattr(getattr(store, "_table", None), "name", None)
+    if table:
+        return f"dynamodb:{table}"
+    return f"store:{id(store)}"
+
+
+class UnitOfWork:
+    """
+    Collects the writes of one request and commits them together on exit.
+
+    Model store puts are grouped per store and issued as one put_many (a
+    single DynamoDB batch_writer flush on DynamoDB). Everything that lands in
+    the same SQLite file, model store puts included, runs as one job on that
+    file's writer thread: nested writes join the job, so it is a single
+    transaction. Other writes run in order at commit. Deferred writes are not
+    visible to reads made before commit.
+    """
+
+    def __init__(self) -> None:
+        self._puts: Dict[str, Tuple[Any, List[Dict[str, Any]]]] = {}
+        self._writes: List[Tuple[Optional[str], Callable[[], Any]]] = []
+
+    def put(self, store: Any, item: Dict[str, Any]) -> None:
+        key = _store_key(store)
+        if key not in self._puts:
+            self._puts[key] = (store, [])
+        self._puts[key][1].append(item)
+
+    def add(self, target: Any, write: Callable[[], Any]) -> None:
+        self._writes.append((_sqlite_path(target), write))
+
+    def __len__(self) -> int:
+        return sum(len(items) for _, items in self._puts.values()) + len(self._writes)
+
+    def commit(self) -> None:
+        groups: Dict[Optional[str], List[Callable[[], Any]]] = {}
+        for store, items in self._puts.values():
+            groups.setdefault(_sqlite_path(store), []).append(lambda store=store, items=items: store.put_many(items))
+        for path, write in self._writes:
+            groups.setdefault(path, []).append(write)
+        writes = len(self)
+        self._puts, self._writes = {}, []
+        try:
+            for path, fns in groups.items():
+                if path:
+                    get_connection_manager(path).write(lambda cx, fns=fns: [fn() for fn in fns])
+                else:
+                    for fn in fns:
+                        fn()
+        except Exception:
+            _count("failures")
+            raise
+        _count("commits")
+        _count("writes", writes)
+        _count("transactions", sum(1 for path in groups if path))
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _COUNTERS_LOCK:
+        _COUNTERS[name] += amount
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    return getattr(_LOCAL, "uow", None)
+
+
+@contextmanager
+def unit_of_work() -> Iterator[UnitOfWork]:
+    """
+    Open a unit of work for this thread, or join the one already open. The
+    outermost block commits when it exits cleanly; if it raises, the queued
+    writes are dropped.
+    """
+    active = current_unit_of_work()
+    if active is not None:
+        yield active
+        return
+    uow = _LOCAL.uow = UnitOfWork()
+    try:
+        yield uow
+    except BaseException:
+        if len(uow):
+            _count("discarded")
+        raise
+    else:
+        _LOCAL.uow = None
+        uow.commit()
+    finally:
+        _LOCAL.uow = None
+
+
+def run_or_defer(target: Any, write: Callable[[], Any]) -> Any:
+    """Run `write` now, or queue it on this thread's open unit of work (returning None)."""
+    uow = current_unit_of_work()
+    if uow is None:
+        return write()
+    uow.add(target, write)
+    return None
+
+
+def put_or_defer(store: Any, item: Dict[str, Any]) -> None:
+    """store.put(item) now, or as part of this thread's open unit of work."""
+    uow = current_unit_of_work()
+    if uow is None:
+        store.put(item)
+    else:
+        uow.put(store, item)
+
+
+def unit_of_work_stats() -> Dict[str, int]:
+    with _COUNTERS_LOCK:
+        return dict(_COUNTERS)
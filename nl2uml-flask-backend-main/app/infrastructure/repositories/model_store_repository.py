@@ -1,6 +1,8 @@
 from __future__ import annotations
 from typing import Any, Dict, List, Optional
 from app.infrastructure.internal.model_store import ModelStore, BaseModelStore
+from app.infrastructure.internal.retention import get_retention_sweeper, stamp
+from app.infrastructure.internal.unit_of_work import put_or_defer
 
 class ModelStoreDiagramRepository:
     """
@@ -10,6 +12,7 @@ class ModelStoreDiagramRepository:
     """
     def __init__(self, store: Optional[BaseModelStore] = None):
         self.store: BaseModelStore = store or ModelStore()
+        get_retention_sweeper().register_store(self.store)
 
     def save(self, diagram_id: str, diagram_item: Dict[str, Any]) -> None:
         """Persist a diagram entity into the underlying store."""
@@ -23,11 +26,11 @@ class ModelStoreDiagramRepository:
         item.setdefault("pk", diagram_id) # useful for debugging or portability
 
         print(f"[ModelStoreDiagramRepository] Saving diagram {diagram_id}")
-        self.store.put(item)
+        put_or_defer(self.store, stamp(item, "diagram"))
 
     def get_by_project(self, project_id: str) -> List[Dict[str, Any]]:
         """Return all diagrams for a given project."""
-        return [it for it in self.store.list() if it.get("projectId") == project_id]
+        return self.store.query("projectId", project_id)
 
     def get_by_id(self, diagram_id: str) -> Optional[Dict[str, Any]]:
         """Retrieve a single diagram by its id."""
@@ -42,6 +45,7 @@ class ModelStoreAdapter:
     def __init__(self, store: Optional[BaseModelStore] = None) -> None:
         # Use whichever backend the ModelStore factory returns (SQLite, JSON, etc.)
         self._store = store or ModelStore()
+        get_retention_sweeper().register_store(self._store)
 
     def save(self, pk: str, sk: str, value: str) -> None:
         """Save a model blob under composite key pk#sk."""
@@ -53,13 +57,13 @@ class ModelStoreAdapter:
             "sk": sk,
             "value": value,
         }
-        self._store.put(item)
+        put_or_defer(self._store, stamp(item, "model"))
 
     def retrieve(self, pk: str, sk: str) -> str:
         """Retrieve model blob for pk#sk."""
         item = self._store.get(f"{pk}#{sk}") or {}
         return item.get("value", "")
 
-    def cleanup_old_models(self) -> None:
-        """Placeholder for TTL cleanup logic."""
-        return
+    def cleanup_old_models(self) -> int:
+        """Delete expired model blobs now (the retention sweeper also does this periodically); returns how many."""
+        return get_retention_sweeper().expire_store(self._store)
@@ -1,10 +1,13 @@
 from __future__ import annotations
-import os, sqlite3
-from typing import Dict, Optional
+import os, sqlite3, time
+from typing import Dict, List, Optional
 
 from app.domain.internal.command_history_repository import CommandHistoryRepository
+from app.domain.internal.plantuml_delta import DELTA, FULL, encode_version, make_delta, rebuild
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+from app.infrastructure.internal.unit_of_work import run_or_defer
 
-_SCHEMA = """
+_TABLES = """
 CREATE TABLE IF NOT EXISTS command_history (
   diagramId     TEXT NOT NULL,
   commandId     TEXT NOT NULL,
@@ -15,26 +18,103 @@ CREATE TABLE IF NOT EXISTS command_history (
   plantumlBefore TEXT,
   plantumlAfter  TEXT,
   isCurrent     INTEGER NOT NULL DEFAULT 0,
+  storage       TEXT NOT NULL DEFAULT 'full',
+  beforeDelta   TEXT,
+  seq           INTEGER,
   PRIMARY KEY (diagramId, commandId)
 );
+CREATE TABLE IF NOT EXISTS command_cursor (
+  diagramId TEXT PRIMARY KEY,
+  seq       INTEGER NOT NULL,
+  headSeq   INTEGER NOT NULL,
+  updatedAt INTEGER
+);
+"""
+
+_INDEXES = """
 CREATE INDEX IF NOT EXISTS idx_command_history_diagram_ts ON command_history(diagramId, timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_command_history_diagram_seq ON command_history(diagramId, seq);
+CREATE INDEX IF NOT EXISTS idx_command_cursor_updated ON command_cursor(updatedAt);
 """
 
+# Columns added after the first release; older databases get them via ALTER TABLE.
+_ADDED_COLUMNS = (
+    ("storage", "TEXT NOT NULL DEFAULT 'full'"),
+    ("beforeDelta", "TEXT"),
+    ("seq", "INTEGER"),
+)
+
 class SqliteCommandHistoryRepository(CommandHistoryRepository):
+    """
+    Versions of a diagram are numbered by `seq` (0 is the baseline), and
+    `command_cursor` holds the current and newest seq for each diagram. Undo,
+    redo and jumps are a cursor read, a point lookup and one cursor update,
+    all run as a single job on the writer thread, whatever the history length.
+    `isCurrent` is no longer maintained; the cursor is authoritative.
+
+    Each row's `plantumlAfter` holds either the full text (storage='full', a
+    keyframe) or a line delta against the previous seq (storage='delta'), with
+    a keyframe at least every COMMAND_HISTORY_KEYFRAME_INTERVAL versions. Any
+    version is rebuilt from its nearest keyframe. `plantumlBefore` is only kept
+    as `beforeDelta`, and only when it differs from the previous version (a
+    manual edit between refines). Rows written before deltas existed are
+    keyframes.
+    """
+
     def __init__(self, db_path: Optional[str] = None) -> None:
         self.db_path = db_path or os.getenv("SQLITE_DB_PATH", "/var/lib/nl2uml/db/nl2uml.sqlite")
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        with self._conn() as cx:
-            cx.executescript(_SCHEMA)
+        self._write(self._ensure_schema)
 
     def _conn(self) -> sqlite3.Connection:
-        cx = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
-        # Keep SQLite settings consistent across all repos to minimize lock contention.
-        cx.execute("PRAGMA journal_mode=WAL;")
-        cx.execute("PRAGMA synchronous=NORMAL;")
-        cx.execute("PRAGMA busy_timeout=30000;")
-        cx.row_factory = sqlite3.Row
-        return cx
+        # Per-thread connection shared with the other repositories on this file (see sqlite_connections).
+        return get_connection_manager(self.db_path).connection()
+
+    def _write(self, job):
+        # Read-modify-write runs as one job on the file's writer thread, so concurrent clicks serialize.
+        return get_connection_manager(self.db_path).write(job)
+
+    @classmethod
+    def _ensure_schema(cls, cx: sqlite3.Connection) -> None:
+        cls._run_script(cx, _TABLES)
+        columns = {row["name"] for row in cx.execute("PRAGMA table_info(command_history)").fetchall()}
+        for name, decl in _ADDED_COLUMNS:
+            if name not in columns:
+                cx.execute(f"ALTER TABLE command_history ADD COLUMN {name} {decl}")
+        if "seq" not in columns:
+            cls._migrate_to_cursor(cx)
+        cursor_columns = {row["name"] for row in cx.execute("PRAGMA table_info(command_cursor)").fetchall()}
+        if "updatedAt" not in cursor_columns:
+            cx.execute("ALTER TABLE command_cursor ADD COLUMN updatedAt INTEGER")
+        # Cursors from before updatedAt existed take their newest command's timestamp.
+        cx.execute(
+            """UPDATE command_cursor SET updatedAt = (
+                   SELECT MAX(timestamp) FROM command_history WHERE command_history.diagramId = command_cursor.diagramId)
+               WHERE updatedAt IS NULL"""
+        )
+        cls._run_script(cx, _INDEXES)
+
+    @staticmethod
+    def _run_script(cx: sqlite3.Connection, script: str) -> None:
+        for statement in script.split(";"):
+            if statement.strip():
+                cx.execute(statement)
+
+    @staticmethod
+    def _migrate_to_cursor(cx: sqlite3.Connection) -> None:
+        """Number existing rows by timestamp and turn their isCurrent flags into cursor rows."""
+        cx.execute(
+            """UPDATE command_history SET seq = (
+                   SELECT COUNT(*) FROM command_history AS older
+                   WHERE older.diagramId = command_history.diagramId
+                     AND (older.timestamp < command_history.timestamp
+                          OR (older.timestamp = command_history.timestamp AND older.commandId < command_history.commandId)))"""
+        )
+        cx.execute(
+            """INSERT OR IGNORE INTO command_cursor (diagramId, seq, headSeq)
+               SELECT diagramId, COALESCE(MAX(CASE WHEN isCurrent=1 THEN seq END), MAX(seq)), MAX(seq)
+               FROM command_history GROUP BY diagramId"""
+        )
 
     def record_refine(
         self,
@@ -47,23 +127,21 @@ class SqliteCommandHistoryRepository(CommandHistoryRepository):
         plantuml_before: str,
         plantuml_after: str,
     ) -> None:
-        with self._conn() as cx:
-            current = self._current(cx, diagram_id)
-            if current:
-                cx.execute(
-                    "DELETE FROM command_history WHERE diagramId=? AND timestamp>? ",
-                    (diagram_id, current["timestamp"]),
-                )
-                cx.execute(
-                    "UPDATE command_history SET isCurrent=0 WHERE diagramId=?",
-                    (diagram_id,),
-                )
+        def _apply(cx):
+            cursor = self._cursor(cx, diagram_id)
+            if cursor:
+                # Remove redo stack (anything after current)
+                if cursor["headSeq"] > cursor["seq"]:
+                    cx.execute("DELETE FROM command_history WHERE diagramId=? AND seq>?", (diagram_id, cursor["seq"]))
+                current_seq = cursor["seq"]
             else:
                 # seed baseline snapshot so undo has somewhere to go back to
+                # (rows left without a cursor are unreachable, so they are dropped)
+                cx.execute("DELETE FROM command_history WHERE diagramId=?", (diagram_id,))
                 cx.execute(
-                    """INSERT OR IGNORE INTO command_history
+                    """INSERT INTO command_history
                        (diagramId, commandId, timestamp, userEmail, projectId, commandType,
-                        plantumlBefore, plantumlAfter, isCurrent)
+                        plantumlAfter, storage, seq)
                        VALUES (?, ?, ?, ?, ?, 'BASE', ?, ?, 0)""",
                     (
                         diagram_id,
@@ -72,89 +150,147 @@ class SqliteCommandHistoryRepository(CommandHistoryRepository):
                         user_email,
                         project_id,
                         plantuml_before or "",
-                        plantuml_before or "",
+                        FULL,
                     ),
                 )
+                current_seq = 0
 
+            chain = self._chain(cx, diagram_id, current_seq)
+            previous, chain_length = rebuild(chain), len(chain) - 1
+            storage, payload = encode_version(previous, plantuml_after or "", chain_length)
+            before_delta = make_delta(previous, plantuml_before or "") if (plantuml_before or "") != previous else None
+            new_seq = current_seq + 1
             cx.execute(
                 """INSERT INTO command_history
                    (diagramId, commandId, timestamp, userEmail, projectId, commandType,
-                    plantumlBefore, plantumlAfter, isCurrent)
-                   VALUES (?, ?, ?, ?, ?, 'RefineDiagram', ?, ?, 1)""",
+                    plantumlAfter, storage, beforeDelta, seq)
+                   VALUES (?, ?, ?, ?, ?, 'RefineDiagram', ?, ?, ?, ?)""",
                 (
                     diagram_id,
                     command_id,
                     timestamp,
                     user_email,
                     project_id,
-                    plantuml_before or "",
-                    plantuml_after or "",
+                    payload,
+                    storage,
+                    before_delta,
+                    new_seq,
                 ),
             )
+            self._set_cursor(cx, diagram_id, new_seq, new_seq)
+
+        # Inside a unit of work the command commits together with the refined diagram.
+        run_or_defer(self, lambda: self._write(_apply))
 
     def undo(self, diagram_id: str, user_email: str, project_id: str) -> Optional[Dict[str, str]]:
-        with self._conn() as cx:
-            cmds = self._all(cx, diagram_id)
-            if not cmds:
-                return None
-            current_idx = self._current_index(cmds)
-            if current_idx is None or current_idx == 0:
+        def _apply(cx):
+            cursor = self._cursor(cx, diagram_id)
+            if not cursor or cursor["seq"] <= 0:
                 return None
-            current = cmds[current_idx]
-            prev_cmd = cmds[current_idx - 1]
-            cx.execute(
-                "UPDATE command_history SET isCurrent=0 WHERE diagramId=? AND commandId=?",
-                (diagram_id, current["commandId"]),
-            )
-            cx.execute(
-                "UPDATE command_history SET isCurrent=1 WHERE diagramId=? AND commandId=?",
-                (diagram_id, prev_cmd["commandId"]),
-            )
+            target = cursor["seq"] - 1
+            self._set_cursor(cx, diagram_id, target, cursor["headSeq"])
             return {
                 "diagramId": diagram_id,
-                "plantuml": prev_cmd["plantumlAfter"] or "",
+                "plantuml": self._state_at(cx, diagram_id, target),
                 "message": "Undo successful",
             }
 
+        return self._write(_apply)
+
     def redo(self, diagram_id: str, user_email: str, project_id: str) -> Optional[Dict[str, str]]:
-        with self._conn() as cx:
-            cmds = self._all(cx, diagram_id)
-            if not cmds:
-                return None
-            current_idx = self._current_index(cmds)
-            if current_idx is None or current_idx >= len(cmds) - 1:
+        def _apply(cx):
+            cursor = self._cursor(cx, diagram_id)
+            if not cursor or cursor["seq"] >= cursor["headSeq"]:
                 return None
-            current = cmds[current_idx]
-            next_cmd = cmds[current_idx + 1]
-            cx.execute(
-                "UPDATE command_history SET isCurrent=0 WHERE diagramId=? AND commandId=?",
-                (diagram_id, current["commandId"]),
-            )
-            cx.execute(
-                "UPDATE command_history SET isCurrent=1 WHERE diagramId=? AND commandId=?",
-                (diagram_id, next_cmd["commandId"]),
-            )
+            target = cursor["seq"] + 1
+            self._set_cursor(cx, diagram_id, target, cursor["headSeq"])
             return {
                 "diagramId": diagram_id,
-                "plantuml": next_cmd["plantumlAfter"] or "",
+                "plantuml": self._state_at(cx, diagram_id, target),
                 "message": "Redo successful",
             }
 
-    def _current(self, cx: sqlite3.Connection, diagram_id: str):
-        return cx.execute(
-            "SELECT * FROM command_history WHERE diagramId=? AND isCurrent=1 LIMIT 1",
-            (diagram_id,),
-        ).fetchone()
+        return self._write(_apply)
+
+    def list_versions(self, diagram_id: str) -> List[Dict[str, object]]:
+        with self._conn() as cx:
+            cursor = self._cursor(cx, diagram_id)
+            rows = cx.execute(
+                """SELECT commandId, timestamp, commandType, storage, seq
+                   FROM command_history WHERE diagramId=? ORDER BY seq ASC""",
+                (diagram_id,),
+            ).fetchall()
+            return [
+                {
+                    "commandId": row["commandId"],
+                    "timestamp": row["timestamp"],
+                    "commandType": row["commandType"],
+                    "isCurrent": bool(cursor) and row["seq"] == cursor["seq"],
+                    "keyframe": row["storage"] != DELTA,
+                }
+                for row in rows
+            ]
 
-    def _all(self, cx: sqlite3.Connection, diagram_id: str):
+    def jump_to(self, diagram_id: str, user_email: str, project_id: str, command_id: str) -> Optional[Dict[str, str]]:
+        def _apply(cx):
+            cursor = self._cursor(cx, diagram_id)
+            target = cx.execute(
+                "SELECT seq FROM command_history WHERE diagramId=? AND commandId=?",
+                (diagram_id, command_id),
+            ).fetchone()
+            if not cursor or not target:
+                return None
+            self._set_cursor(cx, diagram_id, target["seq"], cursor["headSeq"])
+            return {
+                "diagramId": diagram_id,
+                "commandId": command_id,
+                "plantuml": self._state_at(cx, diagram_id, target["seq"]),
+                "message": "Jump successful",
+            }
+
+        return self._write(_apply)
+
+    def prune(self, idle_before_ms: int, limit: int) -> int:
+        """
+        Drop the whole history of up to `limit` diagrams not refined, undone or
+        redone since `idle_before_ms` (epoch ms); returns how many diagrams.
+        """
+        def _apply(cx):
+            idle = [row["diagramId"] for row in cx.execute(
+                "SELECT diagramId FROM command_cursor WHERE updatedAt < ? ORDER BY updatedAt LIMIT ?",
+                (idle_before_ms, limit),
+            ).fetchall()]
+            for diagram_id in idle:
+                cx.execute("DELETE FROM command_history WHERE diagramId=?", (diagram_id,))
+                cx.execute("DELETE FROM command_cursor WHERE diagramId=?", (diagram_id,))
+            return len(idle)
+
+        return self._write(_apply)
+
+    @staticmethod
+    def _cursor(cx: sqlite3.Connection, diagram_id: str):
+        return cx.execute("SELECT seq, headSeq FROM command_cursor WHERE diagramId=?", (diagram_id,)).fetchone()
+
+    @staticmethod
+    def _set_cursor(cx: sqlite3.Connection, diagram_id: str, seq: int, head_seq: int) -> None:
+        cx.execute(
+            """INSERT INTO command_cursor (diagramId, seq, headSeq, updatedAt) VALUES (?, ?, ?, ?)
+               ON CONFLICT(diagramId) DO UPDATE SET
+                   seq=excluded.seq, headSeq=excluded.headSeq, updatedAt=excluded.updatedAt""",
+            (diagram_id, seq, head_seq, int(time.time() * 1000)),
+        )
+
+    @staticmethod
+    def _chain(cx: sqlite3.Connection, diagram_id: str, seq: int):
+        """(storage, payload) rows from the nearest keyframe at or before `seq` up to it."""
         return cx.execute(
-            "SELECT * FROM command_history WHERE diagramId=? ORDER BY timestamp ASC",
-            (diagram_id,),
+            """SELECT storage, plantumlAfter FROM command_history
+               WHERE diagramId=? AND seq<=? AND seq>=COALESCE(
+                   (SELECT MAX(seq) FROM command_history
+                    WHERE diagramId=? AND seq<=? AND storage!=?), 0)
+               ORDER BY seq ASC""",
+            (diagram_id, seq, diagram_id, seq, DELTA),
         ).fetchall()
 
-    @staticmethod
-    def _current_index(cmds):
-        for idx, cmd in enumerate(cmds):
-            if cmd["isCurrent"]:
-                return idx
-        return None
+    def _state_at(self, cx: sqlite3.Connection, diagram_id: str, seq: int) -> str:
+        return rebuild(self._chain(cx, diagram_id, seq))
@@ -5,6 +5,9 @@ import time
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+from app.infrastructure.internal.unit_of_work import run_or_defer
+
 _SCHEMA = """
 CREATE TABLE IF NOT EXISTS diagrams (
   PK          TEXT NOT NULL,
@@ -40,13 +43,8 @@ class SqliteDiagramRepository:
             self._ensure_schema(cx)
 
     def _conn(self):
-        # Longer timeout + WAL mode reduces "database is locked" errors under concurrent access.
-        cx = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
-        cx.execute("PRAGMA journal_mode=WAL;")
-        cx.execute("PRAGMA synchronous=NORMAL;")
-        cx.execute("PRAGMA busy_timeout=30000;")
-        cx.row_factory = sqlite3.Row
-        return cx
+        # Per-thread connection shared with the other repositories on this file (see sqlite_connections).
+        return get_connection_manager(self.db_path).connection()
 
     def _ensure_schema(self, cx: sqlite3.Connection) -> None:
         cols = self._table_columns(cx, "diagrams")
@@ -134,31 +132,35 @@ class SqliteDiagramRepository:
             ).fetchone()
             return self._row_to_diagram(row) if row else None
 
+    def _write(self, job):
+        # Writes go through the file's single writer thread (see sqlite_connections).
+        return get_connection_manager(self.db_path).write(job)
+
     def save(self, diagram_id: str, diagram_item: Dict[str, Any]) -> None:
-        with self._conn() as cx:
-            cx.execute(
-                """INSERT INTO diagrams
-                   (PK, SK, projectId, userEmail, name, diagramType, plantuml, createdAt)
-                   VALUES (:PK, 'DIAGRAM', :projectId, :userEmail, :name, :diagramType, :plantuml, :createdAt)
-                   ON CONFLICT(PK, SK) DO UPDATE SET
-                       projectId=excluded.projectId,
-                       userEmail=excluded.userEmail,
-                       name=excluded.name,
-                       diagramType=excluded.diagramType,
-                       plantuml=excluded.plantuml,
-                       createdAt=excluded.createdAt
-                """,
-                {
-                    "PK": diagram_id,
-                    "projectId": diagram_item.get("projectId"),
-                    "userEmail": diagram_item.get("userEmail"),
-                    "name": diagram_item.get("name"),
-                    "diagramType": diagram_item.get("diagramType"),
-                    "plantuml": diagram_item.get("plantuml"),
-                    "createdAt": diagram_item.get("createdAt"),
-                }
-            )
+        params = {
+            "PK": diagram_id,
+            "projectId": diagram_item.get("projectId"),
+            "userEmail": diagram_item.get("userEmail"),
+            "name": diagram_item.get("name"),
+            "diagramType": diagram_item.get("diagramType"),
+            "plantuml": diagram_item.get("plantuml"),
+            "createdAt": diagram_item.get("createdAt"),
+        }
+        # Inside a unit of work the upsert commits with the request's other writes.
+        run_or_defer(self, lambda: self._write(lambda cx: cx.execute(
+            """INSERT INTO diagrams
+               (PK, SK, projectId, userEmail, name, diagramType, plantuml, createdAt)
+               VALUES (:PK, 'DIAGRAM', :projectId, :userEmail, :name, :diagramType, :plantuml, :createdAt)
+               ON CONFLICT(PK, SK) DO UPDATE SET
+                   projectId=excluded.projectId,
+                   userEmail=excluded.userEmail,
+                   name=excluded.name,
+                   diagramType=excluded.diagramType,
+                   plantuml=excluded.plantuml,
+                   createdAt=excluded.createdAt
+            """,
+            params,
+        )))
 
     def delete(self, diagram_id: str) -> None:
-        with self._conn() as cx:
-            cx.execute("DELETE FROM diagrams WHERE PK=? AND SK='DIAGRAM'", (diagram_id,))
+        self._write(lambda cx: cx.execute("DELETE FROM diagrams WHERE PK=? AND SK='DIAGRAM'", (diagram_id,)))
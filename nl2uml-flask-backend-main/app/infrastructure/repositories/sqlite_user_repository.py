@@ -6,11 +6,45 @@ import time
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+  email     TEXT PRIMARY KEY,
+  createdAt TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS projects (
+  id          INTEGER PRIMARY KEY,
+  email       TEXT NOT NULL,
+  projectId   TEXT NOT NULL,
+  name        TEXT,
+  description TEXT,
+  payload     TEXT NOT NULL,
+  UNIQUE (email, projectId)
+);
+CREATE INDEX IF NOT EXISTS idx_projects_email ON projects(email);
+CREATE TABLE IF NOT EXISTS user_diagrams (
+  id        INTEGER PRIMARY KEY,
+  email     TEXT NOT NULL,
+  diagramId TEXT NOT NULL,
+  payload   TEXT NOT NULL,
+  UNIQUE (email, diagramId)
+);
+CREATE INDEX IF NOT EXISTS idx_user_diagrams_email ON user_diagrams(email);
+"""
+
+_LEGACY_COLUMNS = ("projects", "diagrams")
+
 
 class SqliteUserRepository:
     """
-    Simple SQLite-backed user store to persist projects/diagrams between restarts.
+    SQLite-backed user store to persist projects/diagrams between restarts.
     Mirrors the in-memory repo surface so existing callers keep working.
+
+    Projects and per-user diagrams live in their own tables (one row each,
+    ordered by insertion), so adding or deleting one is a single-row write and
+    the read path never writes. Databases that still hold the older JSON-array
+    columns on `users` are migrated in place on startup.
     """
 
     def __init__(self, db_path: Optional[str] = None) -> None:
@@ -19,178 +53,194 @@ class SqliteUserRepository:
         self.db_path = db_path or os.getenv("SQLITE_USERS_DB_PATH") or default_path
         print(f"[SqliteUserRepository] using db_path={self.db_path}")
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        with self._conn() as cx:
-            self._ensure_schema(cx)
+        self._write(self._ensure_schema)
 
     def _conn(self):
-        # Longer timeout + WAL mode reduces "database is locked" errors under concurrent access.
-        cx = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
-        cx.execute("PRAGMA journal_mode=WAL;")
-        cx.execute("PRAGMA synchronous=NORMAL;")
-        cx.execute("PRAGMA busy_timeout=30000;")
-        cx.row_factory = sqlite3.Row
-        return cx
+        # Per-thread connection shared with the other repositories on this file (see sqlite_connections).
+        return get_connection_manager(self.db_path).connection()
+
+    def _write(self, job):
+        # All writes go through the file's single writer thread (group commit), so
+        # concurrent requests queue in-process instead of sleeping on "database is locked".
+        return get_connection_manager(self.db_path).write(job)
 
     def _ensure_schema(self, cx: sqlite3.Connection) -> None:
-        cx.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-              email TEXT PRIMARY KEY,
-              projects TEXT NOT NULL,
-              diagrams TEXT NOT NULL,
-              createdAt TEXT NOT NULL
+        columns = [row["name"] for row in cx.execute("PRAGMA table_info(users)").fetchall()]
+        if any(col in columns for col in _LEGACY_COLUMNS):
+            self._migrate_json_columns(cx)
+        for statement in _SCHEMA.split(";"):
+            if statement.strip():
+                cx.execute(statement)
+
+    def _migrate_json_columns(self, cx: sqlite3.Connection) -> None:
+        """Move the legacy users.projects/users.diagrams JSON arrays into their own tables."""
+        started = time.perf_counter()
+        cx.execute("ALTER TABLE users RENAME TO users_legacy")
+        for statement in _SCHEMA.split(";"):
+            if statement.strip():
+                cx.execute(statement)
+        rows = cx.execute("SELECT * FROM users_legacy").fetchall()
+        for row in rows:
+            email = self._key(row["email"])
+            cx.execute(
+                "INSERT OR IGNORE INTO users (email, createdAt) VALUES (?, ?)",
+                (email, row["createdAt"] or datetime.utcnow().isoformat()),
             )
-            """
-        )
-        cx.commit()
+            for project in self._decode(row["projects"]):
+                self._insert_project(cx, email, project)
+            for diagram in self._decode(row["diagrams"]):
+                self._insert_diagram(cx, email, diagram)
+        cx.execute("DROP TABLE users_legacy")
+        print(f"[SqliteUserRepository] migrated {len(rows)} users to normalized tables in {time.perf_counter() - started:.4f}s")
 
     @staticmethod
     def _key(email: str) -> str:
         return (email or "").lower()
 
     @staticmethod
-    def _row_to_user(row: sqlite3.Row) -> Dict[str, Any]:
-        projects = []
-        diagrams = []
-        try:
-            projects = json.loads(row["projects"] or "[]")
-        except Exception:
-            projects = []
+    def _decode(raw: Optional[str]) -> List[Dict[str, Any]]:
         try:
-            diagrams = json.loads(row["diagrams"] or "[]")
+            items = json.loads(raw or "[]")
         except Exception:
-            diagrams = []
-        return {
-            "email": row["email"],
-            "projects": projects,
-            "diagrams": diagrams,
-            "createdAt": row["createdAt"],
-        }
-
-    def _get_or_create(self, email: str) -> Dict[str, Any]:
-        user = self.get_user(email)
-        if user:
-            return user
-        return self.create_user(email)
-
-    def _with_retry(self, func, retries: int = 5, delay: float = 0.1):
-        import time as _time
-        start = _time.perf_counter()
-        # Log start/end to track if we ever hang in here
-        print("[SqliteUserRepository] _with_retry start")
-        last_exc = None
-        for attempt in range(retries):
-            try:
-                if attempt > 0:
-                    print(f"[SqliteUserRepository] retry attempt {attempt}")
-                result = func()
-                elapsed = _time.perf_counter() - start
-                print(f"[SqliteUserRepository] _with_retry success after {elapsed:.4f}s")
-                return result
-            except sqlite3.OperationalError as exc:
-                last_exc = exc
-                msg = str(exc).lower()
-                if "locked" in msg or "busy" in msg:
-                    sleep_for = delay * (attempt + 1)
-                    print(f"[SqliteUserRepository] database locked, sleeping {sleep_for:.3f}s (attempt {attempt + 1}/{retries})")
-                    _time.sleep(sleep_for)
-                    continue
-                raise
-        # Final attempt (let exception bubble so we know)
-        print(f"[SqliteUserRepository] _with_retry final attempt after {retries} retries")
-        return func()
+            return []
+        return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+    @staticmethod
+    def _ensure_user(cx: sqlite3.Connection, email_key: str) -> None:
+        cx.execute(
+            "INSERT OR IGNORE INTO users (email, createdAt) VALUES (?, ?)",
+            (email_key, datetime.utcnow().isoformat()),
+        )
+
+    @staticmethod
+    def _insert_project(cx: sqlite3.Connection, email_key: str, project: Dict[str, Any]) -> None:
+        cx.execute(
+            """INSERT INTO projects (email, projectId, name, description, payload)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(email, projectId) DO UPDATE SET
+                   name=excluded.name, description=excluded.description, payload=excluded.payload""",
+            (
+                email_key,
+                str(project.get("projectId") or ""),
+                project.get("name"),
+                project.get("description"),
+                json.dumps(project),
+            ),
+        )
+
+    @staticmethod
+    def _insert_diagram(cx: sqlite3.Connection, email_key: str, diagram: Dict[str, Any]) -> None:
+        cx.execute(
+            """INSERT INTO user_diagrams (email, diagramId, payload) VALUES (?, ?, ?)
+               ON CONFLICT(email, diagramId) DO UPDATE SET payload=excluded.payload""",
+            (email_key, str(diagram.get("diagramId") or ""), json.dumps(diagram)),
+        )
 
     def create_user(self, email: str, projects: Optional[List[Dict[str, Any]]] = None, diagrams: Optional[List[Dict[str, Any]]] = None, **fields) -> Dict[str, Any]:
-        projects = projects or []
-        diagrams = diagrams or []
+        email_key = self._key(email)
         now = datetime.utcnow().isoformat()
-        record = {
-            "email": self._key(email),
-            "projects": json.dumps(projects),
-            "diagrams": json.dumps(diagrams),
-            "createdAt": now,
-        }
-
-        def _insert():
-            with self._conn() as cx:
-                cx.execute(
-                    """INSERT INTO users (email, projects, diagrams, createdAt)
-                       VALUES (:email, :projects, :diagrams, :createdAt)
-                       ON CONFLICT(email) DO NOTHING""",
-                    record,
-                )
-        self._with_retry(_insert)
-        return {"email": record["email"], "projects": projects, "diagrams": diagrams, "createdAt": now, **fields}
+
+        def _apply(cx):
+            created = cx.execute(
+                "INSERT INTO users (email, createdAt) VALUES (?, ?) ON CONFLICT(email) DO NOTHING",
+                (email_key, now),
+            ).rowcount
+            # Seed lists only for a brand-new user, matching the old ON CONFLICT DO NOTHING row insert.
+            if created:
+                for project in projects or []:
+                    self._insert_project(cx, email_key, project)
+                for diagram in diagrams or []:
+                    self._insert_diagram(cx, email_key, diagram)
+
+        self._write(_apply)
+        return {"email": email_key, "projects": list(projects or []), "diagrams": list(diagrams or []), "createdAt": now, **fields}
 
     def get_user(self, email: Optional[str] = None, **kwargs) -> Optional[Dict[str, Any]]:
         email = self._key(email or kwargs.get("user_id"))
         if not email:
             return None
         with self._conn() as cx:
-            row = cx.execute("SELECT * FROM users WHERE email=?", (email,)).fetchone()
-            return self._row_to_user(row) if row else None
+            row = cx.execute("SELECT email, createdAt FROM users WHERE email=?", (email,)).fetchone()
+            if not row:
+                return None
+            return {
+                "email": row["email"],
+                "projects": self._list(cx, "projects", email),
+                "diagrams": self._list(cx, "user_diagrams", email),
+                "createdAt": row["createdAt"],
+            }
+
+    @staticmethod
+    def _list(cx: sqlite3.Connection, table: str, email_key: str) -> List[Dict[str, Any]]:
+        rows = cx.execute(f"SELECT payload FROM {table} WHERE email=? ORDER BY id", (email_key,)).fetchall()
+        return [json.loads(row["payload"]) for row in rows]
 
     # ---- Projects ----
     def list_projects(self, email: str) -> List[Dict[str, Any]]:
-        return list(self._get_or_create(email)["projects"])
+        with self._conn() as cx:
+            return self._list(cx, "projects", self._key(email))
+
+    def get_project(self, email: str, project_id: str) -> Optional[Dict[str, Any]]:
+        with self._conn() as cx:
+            row = cx.execute(
+                "SELECT payload FROM projects WHERE email=? AND projectId=?", (self._key(email), project_id)
+            ).fetchone()
+            return json.loads(row["payload"]) if row else None
 
     def add_project(self, email: str, project: Dict[str, Any]) -> None:
-        user = self._get_or_create(email)
-        user["projects"].append(project)
-        self.update_projects(email, user["projects"])
+        email_key = self._key(email)
 
-    def delete_project(self, email: str, project_id: str) -> None:
-        user = self._get_or_create(email)
-        projects = [p for p in user["projects"] if p.get("projectId") != project_id]
-        self.update_projects(email, projects)
+        def _apply(cx):
+            self._ensure_user(cx, email_key)
+            self._insert_project(cx, email_key, project)
+
+        self._write(_apply)
+
+    def delete_project(self, email: str, project_id: str) -> bool:
+        email_key = self._key(email)
+        return self._write(lambda cx: cx.execute(
+            "DELETE FROM projects WHERE email=? AND projectId=?", (email_key, project_id)
+        ).rowcount > 0)
 
     def update_projects(self, email: str, projects: List[Dict[str, Any]]) -> None:
+        """Replace the whole project list (kept for callers that still rewrite it wholesale)."""
         email_key = self._key(email)
 
-        def _update():
-            now = datetime.utcnow().isoformat()
-            t_conn = time.perf_counter()
-            with self._conn() as cx:
-                print(f"[SqliteUserRepository] update_projects open conn in {time.perf_counter() - t_conn:.4f}s")
-                t_exec = time.perf_counter()
-                cx.execute(
-                    """
-                    INSERT INTO users (email, projects, diagrams, createdAt)
-                    VALUES (?, ?, '[]', ?)
-                    ON CONFLICT(email) DO UPDATE SET projects=excluded.projects
-                    """,
-                    (email_key, json.dumps(projects), now),
-                )
-                print(f"[SqliteUserRepository] upsert projects execute in {time.perf_counter() - t_exec:.4f}s")
-                cx.commit()
-                print("[SqliteUserRepository] update_projects commit done")
-
-        self._with_retry(_update)
+        def _apply(cx):
+            self._ensure_user(cx, email_key)
+            cx.execute("DELETE FROM projects WHERE email=?", (email_key,))
+            for project in projects:
+                self._insert_project(cx, email_key, project)
+
+        self._write(_apply)
 
     # ---- Diagrams (optional parity with in-memory repo) ----
     def list_diagrams(self, email: str) -> List[Dict[str, Any]]:
-        return list(self._get_or_create(email)["diagrams"])
+        with self._conn() as cx:
+            return self._list(cx, "user_diagrams", self._key(email))
 
     def add_diagram(self, email: str, diagram: Dict[str, Any]) -> None:
-        user = self._get_or_create(email)
-        user["diagrams"].append(diagram)
-        self.update_diagrams(email, user["diagrams"])
+        email_key = self._key(email)
+
+        def _apply(cx):
+            self._ensure_user(cx, email_key)
+            self._insert_diagram(cx, email_key, diagram)
+
+        self._write(_apply)
 
     def delete_diagram(self, email: str, diagram_id: str) -> None:
-        user = self._get_or_create(email)
-        diagrams = [d for d in user["diagrams"] if d.get("diagramId") != diagram_id]
-        self.update_diagrams(email, diagrams)
+        email_key = self._key(email)
+        self._write(lambda cx: cx.execute(
+            "DELETE FROM user_diagrams WHERE email=? AND diagramId=?", (email_key, diagram_id)
+        ))
 
     def update_diagrams(self, email: str, diagrams: List[Dict[str, Any]]) -> None:
         email_key = self._key(email)
 
-        def _update():
-            with self._conn() as cx:
-                cx.execute(
-                    "UPDATE users SET diagrams=? WHERE email=?",
-                    (json.dumps(diagrams), email_key),
-                )
-                if cx.total_changes == 0:
-                    self.create_user(email, diagrams=diagrams)
+        def _apply(cx):
+            self._ensure_user(cx, email_key)
+            cx.execute("DELETE FROM user_diagrams WHERE email=?", (email_key,))
+            for diagram in diagrams:
+                self._insert_diagram(cx, email_key, diagram)
 
-        self._with_retry(_update)
+        self._write(_apply)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import Optional, Tuple
+
+from app.domain.internal.plantuml_validation_cache import ValidationStore
+from app.infrastructure.internal.sqlite_connections import get_connection_manager
+
+
+class SqliteValidationStore(ValidationStore):
+    """Persists PlantUML validation results in SQLite so they survive restarts and are shared by workers."""
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._db().write(lambda conn: conn.execute(
+            """CREATE TABLE IF NOT EXISTS plantuml_validation (
+                   key TEXT PRIMARY KEY,
+                   raw_hash TEXT NOT NULL,
+                   is_valid INTEGER NOT NULL,
+                   output TEXT NOT NULL
+               )"""
+        ))
+
+    def _db(self):
+        return get_connection_manager(self.db_path)
+
+    def get(self, key: str) -> Optional[Tuple[bool, str, str]]:
+        try:
+            with self._db().connection() as conn:
+                row = conn.execute("SELECT is_valid, output, raw_hash FROM plantuml_validation WHERE key=?", (key,)).fetchone()
+            return (bool(row[0]), row[1], row[2]) if row else None
+        except sqlite3.Error as exc:
+            print(f"[plantuml-cache] lookup failed: {exc}")
+            return None
+
+    def put(self, key: str, raw_hash: str, is_valid: bool, output: str) -> None:
+        try:
+            self._db().write(lambda conn: conn.execute(
+                """INSERT INTO plantuml_validation (key, raw_hash, is_valid, output) VALUES (?,?,?,?)
+                   ON CONFLICT(key) DO UPDATE SET raw_hash=excluded.raw_hash,
+                       is_valid=excluded.is_valid, output=excluded.output""",
+                (key, raw_hash, int(is_valid), output),
+            ))
+        except sqlite3.Error as exc:
+            print(f"[plantuml-cache] failed to persist result: {exc}")
+
+
+def validation_store_from_env() -> Optional[SqliteValidationStore]:
+    """The store named by PLANTUML_VALIDATION_CACHE_DB, or None (memory only) when unset or unusable."""
+    db_path = os.getenv("PLANTUML_VALIDATION_CACHE_DB")
+    if not db_path:
+        return None
+    try:
+        return SqliteValidationStore(db_path)
+    except Exception as exc:
+        print(f"[plantuml-cache] persistence disabled ({db_path}): {exc}")
+        return None
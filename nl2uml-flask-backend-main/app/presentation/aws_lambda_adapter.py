@@ -1,4 +1,5 @@
 import os
+import base64
 import importlib
 import json
 from flask import request, make_response
@@ -116,7 +117,10 @@ class AWSLambdaAdapter:
             # Build Flask response
             status = result.get("statusCode", 200)
             body = result.get("body", "")
-            if isinstance(body, str):
+            if result.get("isBase64Encoded"):
+                # Binary payloads (e.g. rendered PNGs) travel base64-encoded, as with API Gateway.
+                body = base64.b64decode(body or "")
+            elif isinstance(body, str):
                 try:
                     body = json.loads(body)
                 except json.JSONDecodeError:
@@ -1,28 +1,49 @@
-import boto3
+import json
+import os
 from datetime import datetime, timezone, timedelta
 
-from infrastructure.bootstrap import build_application_service_injection
+from app.util.env import env_number
+
+try:
+    from app.bootstrap import build_application_service_injection
+except ImportError:
+    from ....bootstrap import build_application_service_injection
+
 service = build_application_service_injection()
 
-def handler(event, context):
-    s3 = boto3.client('s3')
-    bucket = "your-s3-bucket-name"
-    cutoff = datetime.now(timezone.utc) - timedelta(days=7)
+cors_headers = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,PUT,DELETE'
+}
 
-    result = s3.list_objects_v2(Bucket=bucket)
+
+def _cleanup_s3(bucket, days):
+    """Delete objects older than `days` from `bucket` (CLEANUP_S3_BUCKET), page by page."""
+    import boto3
+    s3 = boto3.client('s3')
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
     deleted = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+        for obj in page.get("Contents", []):
+            if obj["LastModified"] < cutoff:
+                s3.delete_object(Bucket=bucket, Key=obj["Key"])
+                deleted += 1
+    return deleted
 
-    for obj in result.get("Contents", []):
-        if obj["LastModified"] < cutoff:
-            s3.delete_object(Bucket=bucket, Key=obj["Key"])
-            deleted += 1
-
-    return {
-        "statusCode": 200,
-          'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,PUT,DELETE'
-        },
-        "body": f"Deleted {deleted} old files."
-    }
\ No newline at end of file
+
+def handler(event, context):
+    """Scheduled cleanup: runs the retention sweep now and, when configured, prunes the S3 bucket."""
+    try:
+        result = service.cleanup_expired()
+        bucket = os.getenv("CLEANUP_S3_BUCKET")
+        if bucket:
+            result["s3Deleted"] = _cleanup_s3(bucket, env_number("CLEANUP_S3_DAYS", 7, positive=False))
+        return {"statusCode": 200, "headers": cors_headers, "body": json.dumps(result)}
+    except Exception as e:
+        print(f"❌ Error in cleanup: {str(e)}")
+        return {
+            "statusCode": 500,
+            "headers": cors_headers,
+            "body": json.dumps({"error": f"Internal server error: {str(e)}"})
+        }
@@ -0,0 +1,45 @@
+import json
+from app.util.login.auth import resolve_user_email
+
+try:
+    from app.bootstrap import build_application_service_injection
+except ImportError:
+    from ....bootstrap import build_application_service_injection
+
+
+service = build_application_service_injection()
+
+cors_headers = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization,X-User-Email,X-User-Id,X-Session-Id",
+    "Access-Control-Allow-Methods": "OPTIONS,POST,GET",
+}
+
+def _error(status, message):
+    return {"statusCode": status, "headers": cors_headers, "body": json.dumps({"error": message})}
+
+def handler(event, context):
+    """GET ?diagramId= lists a diagram's versions; POST {diagramId, projectId, commandId} jumps to one."""
+    method = event.get("httpMethod")
+    if method == "OPTIONS":
+        return {"statusCode": 200, "headers": cors_headers, "body": ""}
+    try:
+        user_email = resolve_user_email(event)
+        if method == "GET":
+            diagram_id = (event.get("queryStringParameters") or {}).get("diagramId")
+            if not diagram_id:
+                return _error(400, "diagramId query parameter is required")
+            result = service.list_command_history(user_email, diagram_id)
+            return {"statusCode": 200, "headers": cors_headers, "body": json.dumps(result)}
+        if method == "POST":
+            body = json.loads(event.get("body") or "{}")
+            result = service.handle_jump_request(user_email, body)
+            return {"statusCode": 200, "headers": cors_headers, "body": json.dumps(result)}
+        return _error(405, "Method not allowed")
+    except json.JSONDecodeError:
+        return _error(400, "Request body must be JSON")
+    except ValueError as e:
+        return _error(404 if "not found" in str(e).lower() else 400, str(e))
+    except Exception as e:
+        print("❌ HISTORY ERROR:", str(e))
+        return _error(500, f"Internal server error: {str(e)}")
@@ -0,0 +1,55 @@
+import json
+
+from app.domain.internal.plantuml_autofix import repair_stats
+from app.domain.internal.plantuml_renderer import render_stats
+from app.domain.internal.plantuml_validation_cache import validation_cache_stats
+from app.domain.internal.plantuml_worker import worker_stats
+from app.domain.internal.render_queue import prerender_stats
+from app.infrastructure.internal.llm_cache import llm_cache_stats
+from app.infrastructure.internal.model_health import model_health_stats
+from app.infrastructure.internal.ollama_hedge import hedge_stats
+from app.infrastructure.internal.ollama_http import connection_stats
+from app.infrastructure.internal.retention import retention_stats
+from app.infrastructure.internal.semantic_cache import semantic_cache_stats
+from app.infrastructure.internal.sqlite_connections import sqlite_stats
+from app.infrastructure.internal.unit_of_work import unit_of_work_stats
+
+cors_headers = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization,X-User-Email,X-User-Id,X-Session-Id",
+    "Access-Control-Allow-Methods": "OPTIONS,GET",
+}
+
+
+def handler(event, context):
+    method = event.get("httpMethod")
+    if method == "OPTIONS":
+        return {"statusCode": 200, "headers": cors_headers, "body": ""}
+
+    if method not in ("GET", None):
+        return {
+            "statusCode": 405,
+            "headers": cors_headers,
+            "body": json.dumps({"error": "Method not allowed"})
+        }
+
+    payload = {
+        "ollamaConnections": connection_stats(),
+        "modelHealth": model_health_stats(),
+        "hedging": hedge_stats().snapshot(),
+        "llmCache": llm_cache_stats(),
+        "semanticCache": semantic_cache_stats(),
+        "plantumlWorkers": worker_stats(),
+        "plantumlValidationCache": validation_cache_stats(),
+        "plantumlRepair": repair_stats().snapshot(),
+        "plantumlRender": render_stats(),
+        "plantumlPrerender": prerender_stats(),
+        "sqlite": sqlite_stats(),
+        "retention": retention_stats(),
+        "unitOfWork": unit_of_work_stats(),
+    }
+    return {
+        "statusCode": 200,
+        "headers": cors_headers,
+        "body": json.dumps(payload),
+    }
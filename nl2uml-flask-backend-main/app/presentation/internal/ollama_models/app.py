@@ -6,7 +6,7 @@ from app.infrastructure.internal.ollama_pipeline_client import (
     DEFAULT_UML_MODELS,
     DEFAULT_VALIDATION_MODELS,
     MultiOllamaPipelineClient,
-    _parse_models,
+    parse_models,
 )
 
 cors_headers = {
@@ -30,9 +30,9 @@ def handler(event, context):
 
     # Build from environment (or defaults) and filter against the running Ollama host
     client = MultiOllamaPipelineClient()
-    ideation_models = client.ideation_models or _parse_models(os.getenv("OLLAMA_IDEATION_MODELS") or DEFAULT_IDEATION_MODELS)
-    uml_models = client.uml_models or _parse_models(os.getenv("OLLAMA_UML_MODELS") or DEFAULT_UML_MODELS)
-    validation_models = client.validator_models or _parse_models(os.getenv("OLLAMA_VALIDATION_MODELS") or DEFAULT_VALIDATION_MODELS)
+    ideation_models = client.ideation_models or parse_models(os.getenv("OLLAMA_IDEATION_MODELS") or DEFAULT_IDEATION_MODELS)
+    uml_models = client.uml_models or parse_models(os.getenv("OLLAMA_UML_MODELS") or DEFAULT_UML_MODELS)
+    validation_models = client.validator_models or parse_models(os.getenv("OLLAMA_VALIDATION_MODELS") or DEFAULT_VALIDATION_MODELS)
 
     payload = {
         "ideationModels": ideation_models,
@@ -1,28 +1,114 @@
+import base64
 import json
 
+try:
+    from app.bootstrap import build_application_service_injection
+    from app.domain.internal.plantuml_renderer import PlantUMLRenderError, normalize_format
+except ImportError:
+    from ....bootstrap import build_application_service_injection
+    from ....domain.internal.plantuml_renderer import PlantUMLRenderError, normalize_format
+
+
+service = build_application_service_injection()
+
 cors_headers = {
     "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,Authorization",
-    "Access-Control-Allow-Methods": "OPTIONS,POST,GET,PUT,DELETE",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization,X-User-Email,X-User-Id,X-Session-Id,If-None-Match",
+    "Access-Control-Allow-Methods": "OPTIONS,POST,GET",
+    "Access-Control-Expose-Headers": "ETag,Content-Location,X-Render-Key",
 }
 
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _error(status, message):
+    return {
+        "statusCode": status,
+        "headers": cors_headers,
+        "body": json.dumps({"error": message})
+    }
+
+
+def _etag_matches(event, etag):
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    candidates = [c.strip() for c in (headers.get("if-none-match") or "").split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _image_response(event, result, cache_control):
+    """
+    `/render/<key>.<fmt>` and `/plantuml/<fmt>/<encoded>` URLs never change
+    content and are served immutable; responses for a diagram id or a posted
+    body are revalidated with the ETag.
+    """
+    headers = {
+        **cors_headers,
+        "ETag": result.etag,
+        "Cache-Control": cache_control,
+        "Content-Location": f"/render/{result.key}.{result.fmt}",
+        "X-Render-Key": result.key,
+    }
+    if event.get("httpMethod") == "GET" and _etag_matches(event, result.etag):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    headers["Content-Type"] = result.content_type
+    if result.fmt == "svg":
+        return {"statusCode": 200, "headers": headers, "body": result.data.decode("utf-8")}
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "body": base64.b64encode(result.data).decode("ascii"),
+        "isBase64Encoded": True,
+    }
+
+
 def handler(event, context):
-    method = event.get('httpMethod')
+    method = event.get("httpMethod")
     if method == "OPTIONS":
         return {"statusCode": 200, "headers": cors_headers, "body": ""}
 
     try:
-        print(f"🧪 Lambda placeholder invoked: {event.get('resource')} with method {method}")
-        return {
-            "statusCode": 200,
-            "headers": cors_headers,
-            "body": json.dumps({"message": "Lambda is wired correctly"})
-        }
+        path_params = event.get("pathParameters") or {}
+        render_key = path_params.get("renderKey")
+        query = event.get("queryStringParameters") or {}
+
+        if method == "GET" and path_params.get("encoded"):
+            # Same URL scheme as the public PlantUML server; the path fully determines the image.
+            result = service.render_encoded(path_params["encoded"], normalize_format(path_params.get("fmt")))
+            return _image_response(event, result, IMMUTABLE)
+
+        if method == "GET" and render_key:
+            key, _, fmt = render_key.partition(".")
+            result = service.render_cached(key, normalize_format(fmt))
+            if result is None:
+                return _error(404, "Rendered diagram not found")
+            return _image_response(event, result, IMMUTABLE)
+
+        if method == "GET":
+            diagram_id = query.get("diagramId")
+            if not diagram_id:
+                return _error(400, "diagramId query parameter is required")
+            thumbnail = (query.get("thumbnail") or "").lower() in ("1", "true", "yes", "on")
+            result = service.render_diagram(diagram_id, normalize_format(query.get("format")), thumbnail=thumbnail)
+            return _image_response(event, result, "no-cache")
+
+        if method == "POST":
+            body = json.loads(event.get("body") or "{}")
+            fmt = normalize_format(body.get("format") or query.get("format"))
+            result = service.render_plantuml(body.get("plantuml") or "", fmt)
+            return _image_response(event, result, "no-cache")
+
+        return _error(405, "Method not allowed")
 
+    except json.JSONDecodeError:
+        return _error(400, "Request body must be JSON")
+    except ValueError as e:
+        print(f"[render] {str(e)}")
+        return _error(404 if "not found" in str(e).lower() else 400, str(e))
+    except PlantUMLRenderError as e:
+        print(f"[render] Rendering failed: {str(e)}")
+        return _error(502, str(e))
+    except NotImplementedError as e:
+        return _error(503, str(e))
     except Exception as e:
-        print(f"❌ Error in stub: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": cors_headers,
-            "body": json.dumps({"error": f"Internal server error: {str(e)}"})
-        }
\ No newline at end of file
+        print(f"❌ Error in renderer: {str(e)}")
+        return _error(500, f"Internal server error: {str(e)}")
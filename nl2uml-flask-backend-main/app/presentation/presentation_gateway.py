@@ -15,15 +15,20 @@ class PresentationGateway:
             ("/diagrams",             "app.presentation.internal.workspace_manager.app:handler"),
             ("/diagrams/<diagramId>", "app.presentation.internal.workspace_manager.app:handler"),
             ("/explain",              "app.presentation.internal.explain_agent.app:handler"),
+            ("/history",              "app.presentation.internal.history.app:handler"),
             ("/uml/generate",         "app.presentation.internal.nlp_agent.app:handler"),
             ("/projects",             "app.presentation.internal.workspace_manager.app:handler"),
             ("/projects/<projectId>", "app.presentation.internal.workspace_manager.app:handler"),
             ("/projects/<projectId>/diagrams", "app.presentation.internal.workspace_manager.app:handler"),
             ("/redo",                 "app.presentation.internal.redo.app:handler"),
             ("/refine",               "app.presentation.internal.feedback_handler.app:handler"),
+            ("/render",               "app.presentation.internal.renderer.app:handler"),
+            ("/render/<renderKey>",   "app.presentation.internal.renderer.app:handler"),
+            ("/plantuml/<fmt>/<encoded>", "app.presentation.internal.renderer.app:handler"),
             ("/save-diagram",         "app.presentation.internal.save_diagram.app:handler"),
             ("/undo",                 "app.presentation.internal.undo.app:handler"),
             ("/ollama/models",        "app.presentation.internal.ollama_models.app:handler"),
+            ("/metrics",              "app.presentation.internal.metrics.app:handler"),
             # If you want a param route too, add it explicitly:
             # ("/diagrams/<diagram_id>", "app.presentation.internal.workspace_manager.app:handler"),
         ]
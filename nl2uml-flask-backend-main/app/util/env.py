@@ -0,0 +1,14 @@
+import os
+
+
+def env_number(name: str, default: float, positive: bool = True) -> float:
+    """Numeric environment setting; unset or malformed values (and non-positive ones when ``positive``) fall back to ``default``."""
+    try:
+        value = float(os.getenv(name) or default)
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 or not positive else default
+
+
+def env_int(name: str, default: int, positive: bool = True) -> int:
+    return int(env_number(name, default, positive))
@@ -0,0 +1,54 @@
+from app.domain.internal.plantuml_autofix import autofix_plantuml
+
+CROWS_FOOT_ERD = """@startuml
+entity Customer {
+  * id : int
+}
+entity Order {
+  * id : int
+}
+Customer ||--o{ Order
+Order }|--|| Customer
+@enduml"""
+
+
+def test_missing_brace_closes_before_relationship():
+    fixed, rules = autofix_plantuml("@startuml\nclass A {\n +x: int\n\nA --> B\n@enduml", "class", "Error line 6")
+    assert fixed == "@startuml\nclass A {\n +x: int\n}\n\nA --> B\n@enduml"
+    assert rules == ["close-brace"]
+
+
+def test_missing_brace_closes_before_next_declaration():
+    fixed, _ = autofix_plantuml("@startuml\nclass A {\n +x: int\nclass B {\n +y: int\n}\n@enduml", "class", "Error line 7")
+    assert fixed == "@startuml\nclass A {\n +x: int\n}\nclass B {\n +y: int\n}\n@enduml"
+
+
+def test_missing_brace_at_end_of_diagram():
+    fixed, _ = autofix_plantuml("@startuml\nclass A {\n +x: int\n@enduml", "class", "Error line 4")
+    assert fixed == "@startuml\nclass A {\n +x: int\n}\n@enduml"
+
+
+def test_unclosed_container_is_left_to_the_llm():
+    source = "@startuml\npackage P {\nclass A\nclass B\nA --> B\n@enduml"
+    fixed, rules = autofix_plantuml(source, "class", "Error line 6")
+    assert fixed == source
+    assert rules == []
+
+
+def test_missing_block_closer_stays_inside_enclosing_block():
+    source = "@startuml\nstart\nwhile (more?)\nif (ok?) then\n:work;\nendwhile\nstop\n@enduml"
+    fixed, _ = autofix_plantuml(source, "activity", "Error line 6")
+    assert fixed == "@startuml\nstart\nwhile (more?)\nif (ok?) then\n:work;\nendif\nendwhile\nstop\n@enduml"
+
+
+def test_no_structural_fix_without_a_validator_error():
+    broken = "@startuml\nclass A {\n +x: int\nA --> B\n@enduml"
+    fixed, rules = autofix_plantuml(broken, "class", "")
+    assert fixed == broken
+    assert rules == []
+
+
+def test_crows_foot_diagram_is_left_alone():
+    fixed, rules = autofix_plantuml(CROWS_FOOT_ERD, "eerd", "Error line 9")
+    assert fixed == CROWS_FOOT_ERD
+    assert rules == []
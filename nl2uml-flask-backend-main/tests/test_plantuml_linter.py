@@ -0,0 +1,41 @@
+from app.domain.internal.plantuml_linter import has_errors, lint_plantuml, strip_arrows
+
+CROWS_FOOT_ERD = """@startuml
+entity Customer {
+  * id : int
+}
+entity Order {
+  * id : int
+}
+Customer ||--o{ Order
+Order }|--|| Customer
+Order }o..o{ Customer : tagged
+@enduml"""
+
+
+def codes(plantuml, diagram_type=None):
+    return [issue.code for issue in lint_plantuml(plantuml, diagram_type)]
+
+
+def test_crows_foot_arrows_are_not_block_braces():
+    assert codes(CROWS_FOOT_ERD, "eerd") == []
+
+
+def test_strip_arrows_keeps_block_braces():
+    assert strip_arrows("Customer ||--o{ Order") == "Customer Order"
+    assert strip_arrows("entity Customer {") == "entity Customer {"
+
+
+def test_unclosed_entity_is_still_an_error():
+    broken = CROWS_FOOT_ERD.replace("  * id : int\n}\nentity Order", "  * id : int\nentity Order", 1)
+    issues = lint_plantuml(broken, "eerd")
+    assert has_errors(issues)
+    assert "unclosed-brace" in [issue.code for issue in issues]
+
+
+def test_stray_brace_is_still_an_error():
+    assert "unbalanced-brace" in codes("@startuml\nclass A\n}\n@enduml", "class")
+
+
+def test_implicit_class_declarations_are_accepted():
+    assert codes("@startuml\nclass User\nUser <|-- Admin\n@enduml", "class") == []
@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { encodePlantUML } from '../utils/plantumlEncoder';
+import { PLANTUML_SERVER } from '../config';
 import './Canvas.css';
 
 function Canvas({ umlText, justUpdated }) {
@@ -9,7 +10,7 @@ function Canvas({ umlText, justUpdated }) {
 
   const hasDiagram = !!(umlText && umlText.trim().toLowerCase().includes('@startuml'));
   const encoded = hasDiagram ? encodePlantUML(umlText) : '';
-  const imageUrl = hasDiagram ? `https://www.plantuml.com/plantuml/svg/${encoded}` : null;
+  const imageUrl = hasDiagram ? `${PLANTUML_SERVER}/svg/${encoded}` : null;
 
   const zoomIn = () => setZoom(prev => Math.min(prev + 0.1, 3));
   const zoomOut = () => setZoom(prev => Math.max(prev - 0.1, 0.2));
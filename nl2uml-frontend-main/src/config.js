@@ -3,3 +3,5 @@
 export const API_BASE = process.env.REACT_APP_API_BASE || "http://localhost:8080";
 export const WS_URL = process.env.REACT_APP_WS_URL || "ws://localhost:8080/ws";
 export const WS_ENABLED = (process.env.REACT_APP_WS_ENABLED || "").toLowerCase() === "true";
+// PlantUML-server-compatible renderer; the backend serves /plantuml/{svg,png}/<encoded> from its local cache.
+export const PLANTUML_SERVER = process.env.REACT_APP_PLANTUML_SERVER || `${API_BASE}/plantuml`;